@@ -0,0 +1,184 @@
+import sys
+
+import json
+
+import time
+
+import queue
+
+import atexit
+
+import random
+
+import logging
+
+from logging.handlers import QueueHandler, QueueListener
+
+from starlette.requests import Request
+
+from starlette.middleware.base import BaseHTTPMiddleware
+
+
+
+logger = logging.getLogger("api")
+
+access_logger = logging.getLogger("kissa.access")
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+
+class AccessLogMiddleware:
+
+    """
+    Journal d'accès structuré et échantillonné (middleware ASGI pur).
+
+    Une ligne JSON par requête journalisée : méthode, chemin, statut, durée, octets renvoyés.
+    On journalise toujours les erreurs (5xx) et les requêtes lentes (>= `slow_ms`), et une
+    fraction `sample_rate` des autres.
+
+    Le corps de la requête n'est jamais lu par le middleware : les uploads multipart de /scan
+    ne sont pas bufferisés. Avec `log_bodies`, on garde un extrait (`max_body` octets) des
+    corps JSON au moment où la route les lit, sans lecture supplémentaire.
+
+    Le dict est transmis tel quel au logger : la sérialisation JSON et l'écriture se font
+    dans le thread du QueueListener (cf. start_queue_logging), pas dans la boucle d'événements.
+    """
+
+    def __init__(self, app, sample_rate=0.1, slow_ms=1000, log_bodies=False, max_body=200):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.log_bodies = log_bodies
+        self.max_body = max_body
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        sent_bytes = 0
+        body_preview = []
+
+        async def send_wrapper(message):
+            nonlocal status, sent_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent_bytes += len(message.get("body", b""))
+            await send(message)
+
+        async def receive_wrapper():
+            message = await receive()
+            # Extrait du corps JSON, pris au passage quand la route le lit
+            if message["type"] == "http.request" and not body_preview:
+                body_preview.append(message.get("body", b"")[:self.max_body])
+            return message
+
+        if self.log_bodies and _is_json(scope):
+            app_receive = receive_wrapper
+        else:
+            app_receive = receive
+
+        try:
+            await self.app(scope, app_receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            if status >= 500 or duration_ms >= self.slow_ms or random.random() < self.sample_rate:
+                entry = {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "duration_ms": round(duration_ms, 2),
+                    "bytes": sent_bytes,
+                }
+                if body_preview:
+                    entry["body"] = body_preview[0]
+                access_logger.info(entry)
+
+
+def _is_json(scope):
+    for name, value in scope["headers"]:
+        if name == b"content-type":
+            return value.startswith(b"application/json")
+    return False
+
+
+class LoggingMiddleware(BaseHTTPMiddleware):
+
+    """
+    Mode "verbose" (historique, pour le débogage) : en-têtes et début du corps de chaque requête.
+    Attention : lit le corps entier des POST, uploads compris.
+    """
+
+    async def dispatch(self, request: Request, call_next):
+        start_time = time.time()
+        logger.info("="*70)
+        logger.info(f"🌐 REQUÊTE REÇUE: {request.method} {request.url.path}")
+        logger.info(f"   Headers: {dict(request.headers)}")
+        sys.stdout.flush()  # Force l'affichage immédiat
+
+        if request.method == "POST":
+            try:
+                body = await request.body()
+                logger.info(f"   Body: {body.decode()[:200]}")
+                sys.stdout.flush()
+            except:
+                pass
+
+        response = await call_next(request)
+
+        process_time = time.time() - start_time
+        logger.info(f"✅ RÉPONSE: {response.status_code} (temps: {process_time:.2f}s)")
+        logger.info("="*70)
+        sys.stdout.flush()
+        return response
+
+
+class StructuredFormatter(logging.Formatter):
+
+    """Formatter classique ; un message dict (journal d'accès) est sérialisé en JSON"""
+
+    def format(self, record):
+        if isinstance(record.msg, dict):
+            entry = record.msg
+            if isinstance(entry.get("body"), bytes):
+                entry = dict(entry, body=entry["body"].decode("utf-8", "replace"))
+            record.msg = json.dumps(entry, ensure_ascii=False)
+        return super().format(record)
+
+
+class DeferredQueueHandler(QueueHandler):
+
+    """
+    QueueHandler qui laisse les messages dict intacts : ils sont formatés par le listener.
+    (QueueHandler.prepare formate le message dans le thread appelant.)
+    """
+
+    def prepare(self, record):
+        if isinstance(record.msg, dict):
+            return record
+        return super().prepare(record)
+
+
+def start_queue_logging(level=logging.INFO, stream=None):
+    """
+    Fait passer tout le logging par une file : les appels logger.* ne font qu'empiler
+    l'enregistrement, un thread dédié (QueueListener) formate et écrit sur `stream`.
+    Renvoie le listener (arrêté automatiquement à la sortie du processus).
+    """
+    log_queue = queue.SimpleQueue()
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(StructuredFormatter(LOG_FORMAT))
+
+    root = logging.getLogger()
+    root.handlers = [DeferredQueueHandler(log_queue)]
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,387 @@
+import os
+
+import json
+
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+
+from postgrest.exceptions import APIError
+
+from metrics import upstream_call
+
+
+
+class AlbumRepository:
+
+    """
+    Accès à la table Supabase `albums` : conversion des résultats KissaCore en lignes,
+    écritures différées (write-behind) et lecture paginée.
+
+    `add` / `add_many` ne font que mettre la ligne en file : la requête HTTP (scan, ajout)
+    n'attend plus l'aller-retour vers la base. Une tâche de fond vide la file en un seul
+    insert multi-lignes dès que `batch_size` lignes attendent, ou au plus tard toutes les
+    `flush_interval` secondes.
+
+    Durabilité : à l'arrêt on vide la file ; si la base est injoignable, les lignes en
+    attente sont écrites dans `spool_path` (JSON lines) et renvoyées au démarrage suivant.
+    La file est bornée à `max_pending` lignes : au-delà, les plus anciennes partent aussi
+    dans `spool_path`, relu dès qu'un vidage réussit. Les fichiers de reprise sont lus et
+    écrits dans un thread dédié (un seul : les écritures restent dans l'ordre), jamais sur
+    la boucle d'événements.
+
+    Base injoignable : après un vidage raté, le suivant attend `flush_interval` doublé à
+    chaque nouvel échec consécutif, plafonné à `max_backoff` secondes.
+
+    Lot refusé par la base (ligne invalide, contrainte absente) : après `max_attempts`
+    échecs, le lot est coupé en deux jusqu'à isoler les lignes refusées ; les autres sont
+    écrites, les refusées vont dans `dead_letter_path` (avec l'erreur) au lieu de bloquer la file.
+
+    Dédoublonnage : chaque ligne porte le `discogs_id` de la release, sous contrainte
+    d'unicité (supabase/migrations) ; les écritures sont des upserts sur cette colonne,
+    un re-scan met donc à jour l'album existant au lieu d'en créer un second.
+    """
+
+    def __init__(self, table="albums", batch_size=20, flush_interval=0.5, spool_path=None, on_flush=None, on_saved=None,
+                 max_pending=5000, max_attempts=3, dead_letter_path=None, max_backoff=30.0):
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_path = spool_path
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.dead_letter_path = dead_letter_path
+        self.max_backoff = max_backoff
+        self.on_flush = on_flush
+        self.on_saved = on_saved
+        self.client = None
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+        self.rejected_rows = 0
+        self.spilled_rows = 0
+        self._rejections = 0
+        # Vidages ratés d'affilée (remis à zéro au premier succès) : règle l'attente avant le suivant
+        self._failure_streak = 0
+        self._spilled = False
+        self._pending = []
+        # Lignes du vidage en cours : plus en file, pas encore confirmées par la base
+        self._flushing = []
+        self._wakeup = None
+        self._stopping = None
+        self._flush_lock = None
+        self._task = None
+        self._spool_io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="album-spool")
+
+    @staticmethod
+    def row_from_result(result):
+        """Ligne de la table albums pour un résultat KissaCore (process, search_by_text, process_by_id)"""
+        return {
+            "discogs_id": result['details'].get('discogs_id'),
+            "artist": result['display']['artist'],
+            "title": result['display']['title'],
+            "cover_image": result['display']['cover_image'],
+            "year": result['details']['year'],
+            "label": result['details']['label'],
+            "genre": result['details']['genre'],  # Supabase gère les tableaux (text[])
+            "spotify_url": result['links']['spotify_url'],
+            "discogs_url": result['links']['discogs_url'],
+        }
+
+    @staticmethod
+    def result_from_row(row):
+        """Album enregistré -> même structure qu'un résultat KissaCore (marqué `already_in_library`)"""
+        spotify_url = row.get("spotify_url")
+        spotify_id = spotify_url.split("/album/")[1].split("?")[0] if spotify_url and "/album/" in spotify_url else None
+        return {
+            "status": "success",
+            "already_in_library": True,
+            "id": row.get("id"),
+            "display": {
+                "artist": row.get("artist"),
+                "title": row.get("title"),
+                "cover_image": row.get("cover_image"),
+            },
+            "details": {
+                "year": row.get("year"),
+                "label": row.get("label"),
+                "genre": row.get("genre") or [],
+                "tracklist": row.get("tracklist") or [],
+                "discogs_id": row.get("discogs_id"),
+            },
+            "links": {
+                "spotify_url": spotify_url,
+                "spotify_uri": f"spotify:album:{spotify_id}" if spotify_id else None,
+                "discogs_url": row.get("discogs_url"),
+            },
+        }
+
+    async def start(self, client):
+        """À appeler au démarrage de l'API, une fois le client Supabase créé"""
+        self.client = client
+        # Créés ici : ils appartiennent à la boucle d'événements de l'API
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        await self._replay_spool()
+        self._task = asyncio.create_task(self._run())
+
+    def add(self, result):
+        """Met l'album en file d'écriture et renvoie la ligne préparée"""
+        row = self.row_from_result(result)
+        self._pending.append(row)
+        if len(self._pending) > self.max_pending:
+            # Base injoignable depuis longtemps : les plus anciennes lignes attendent sur disque
+            self._spill(len(self._pending) - self.max_pending)
+        if len(self._pending) >= self.batch_size and self._wakeup:
+            self._wakeup.set()
+        return row
+
+    def add_many(self, results):
+        return [self.add(result) for result in results]
+
+    async def flush(self):
+        """Écrit toutes les lignes en attente en un seul insert ; en cas d'échec elles restent en file"""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+
+            rows, self._pending = self._pending, []
+            self._flushing = rows
+            try:
+                # Un même upsert ne peut pas toucher deux fois la même ligne : une seule entrée par release
+                if self._rejections >= self.max_attempts:
+                    saved, rejected = await self._upsert_isolating(_dedupe(rows))
+                else:
+                    saved, rejected = await self._upsert(_dedupe(rows)), []
+            except BaseException as e:
+                # On remet les lignes en tête de file : elles repartiront au prochain vidage
+                # (annulation comprise : une requête interrompue n'a rien garanti)
+                self._pending = rows + self._pending
+                if not isinstance(e, Exception):
+                    raise
+                self.failed_flushes += 1
+                self._failure_streak += 1
+                if isinstance(e, APIError):
+                    # Refus de la base (et non panne réseau) : au-delà de max_attempts, le lot sera découpé
+                    self._rejections += 1
+                print(f"ERREUR sauvegarde Supabase ({len(rows)} albums en attente) : {e}")
+                return 0
+            finally:
+                self._flushing = []
+
+            self._rejections = 0
+            self._failure_streak = 0
+            self.flushes += 1
+            self.flushed_rows += len(saved)
+            print(f"💾 {len(saved)} album(s) sauvegardé(s) en base de données")
+            if rejected:
+                await self._dead_letter(rejected)
+
+            # La base répond de nouveau : on reprend les lignes mises de côté pendant la panne
+            if self._spilled:
+                await self._replay_spool()
+
+        # Lignes telles qu'enregistrées (avec leur id), ex : pour l'index de recherche local
+        if self.on_saved:
+            self.on_saved(saved)
+        if self.on_flush:
+            await self.on_flush()
+        return len(saved)
+
+    async def _upsert(self, rows):
+        with upstream_call("supabase", "upsert"):
+            response = await self.client.table(self.table).upsert(rows, on_conflict="discogs_id").execute()
+        return response.data
+
+    async def _upsert_isolating(self, rows):
+        """Upsert par moitiés jusqu'à isoler les lignes refusées : (lignes enregistrées, [(ligne, erreur)])"""
+        try:
+            return await self._upsert(rows), []
+        except APIError as e:
+            if len(rows) == 1:
+                return [], [(rows[0], e)]
+        middle = len(rows) // 2
+        saved_head, rejected_head = await self._upsert_isolating(rows[:middle])
+        saved_tail, rejected_tail = await self._upsert_isolating(rows[middle:])
+        return saved_head + saved_tail, rejected_head + rejected_tail
+
+    def has_pending(self):
+        """Des lignes attendent encore la base (en file ou dans le vidage en cours)"""
+        return bool(self._pending or self._flushing)
+
+    def find_pending(self, discogs_id):
+        """Album encore en file d'écriture (ou en cours de vidage) pour cette release, sinon None"""
+        for row in reversed(self._pending + self._flushing):
+            if row.get("discogs_id") is not None and str(row["discogs_id"]) == str(discogs_id):
+                return self.result_from_row(row)
+        return None
+
+    async def find_by_discogs_id(self, discogs_id):
+        """Album déjà enregistré (ou en file d'écriture) pour cette release, au format résultat KissaCore"""
+        pending = self.find_pending(discogs_id)
+        if pending:
+            return pending
+
+        with upstream_call("supabase", "find"):
+            response = await self.client.table(self.table).select("*").eq("discogs_id", discogs_id).limit(1).execute()
+        return self.result_from_row(response.data[0]) if response.data else None
+
+    async def ping(self):
+        """Sonde de santé : plus petite lecture possible sur la table"""
+        with upstream_call("supabase", "ping"):
+            await self.client.table(self.table).select("id").limit(1).execute()
+        return {"pending_writes": len(self._pending)}
+
+    async def delete(self, album_id):
+        """Supprime l'album et renvoie les lignes supprimées"""
+        with upstream_call("supabase", "delete"):
+            response = await self.client.table(self.table).delete().eq("id", album_id).execute()
+        return response.data
+
+    async def page(self, columns, limit, after=None):
+        """
+        Albums du plus récent au plus ancien, triés par (created_at, id).
+        `after` = (created_at, id) du dernier album de la page précédente (pagination keyset).
+        """
+        query = self.client.table(self.table).select(columns)
+
+        if after:
+            created_at, album_id = after
+            # Keyset : strictement après (created_at, id) dans l'ordre décroissant
+            query = query.or_(
+                f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{album_id}")'
+            )
+
+        with upstream_call("supabase", "page"):
+            response = await query.order("created_at", desc=True).order("id", desc=True).limit(limit).execute()
+        return response.data
+
+    def backoff(self):
+        """Attente avant le prochain vidage : doublée à chaque échec consécutif, plafonnée à max_backoff"""
+        if not self._failure_streak:
+            return self.flush_interval
+        return min(self.flush_interval * 2 ** self._failure_streak, max(self.max_backoff, self.flush_interval))
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            # Après un échec, un lot complet ne réveille plus la boucle : seul l'arrêt écourte l'attente
+            event = self._stopping if self._failure_streak else self._wakeup
+            try:
+                await asyncio.wait_for(event.wait(), timeout=self.backoff())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def aclose(self):
+        """Arrêt : la boucle termine son vidage en cours, dernier vidage, puis sauvegarde sur disque du reste"""
+        if self._task:
+            # Pas d'annulation : un upsert interrompu laisserait ses lignes dans un état inconnu
+            self._stopping.set()
+            self._wakeup.set()
+            await self._task
+
+        await self.flush()
+
+        if self._pending:
+            rows, self._pending = self._pending, []
+            await self._spool_call(self._write_spool, rows)
+
+        # Attend aussi les écritures lancées par `add` (_spill)
+        await asyncio.to_thread(self._spool_io.shutdown)
+
+    def _spill(self, count):
+        """Envoie les `count` lignes les plus anciennes de la file dans le fichier de reprise (sans attendre l'écriture)"""
+        rows, self._pending = self._pending[:count], self._pending[count:]
+        self.spilled_rows += len(rows)
+        self._spilled = True
+        self._spool_io.submit(self._write_spool, rows).add_done_callback(_log_spool_failure)
+
+    async def _spool_call(self, func, *args):
+        """Exécute `func` dans le thread des fichiers de reprise, après les écritures déjà lancées"""
+        return await asyncio.wrap_future(self._spool_io.submit(func, *args))
+
+    def _write_spool(self, rows):
+        if not self.spool_path:
+            print(f"ERREUR : {len(rows)} album(s) non sauvegardé(s) (aucun fichier de reprise configuré)")
+            return
+
+        _append_lines(self.spool_path, rows)
+        print(f"ATTENTION : {len(rows)} album(s) mis de côté dans {self.spool_path}")
+
+    async def _dead_letter(self, rejected):
+        """Lignes refusées par la base, gardées avec leur erreur pour correction manuelle"""
+        self.rejected_rows += len(rejected)
+        if not self.dead_letter_path:
+            print(f"ERREUR : {len(rejected)} album(s) refusé(s) par la base et abandonné(s) : {rejected[0][1]}")
+            return
+
+        items = [{"row": row, "error": str(error)} for row, error in rejected]
+        await self._spool_call(_append_lines, self.dead_letter_path, items)
+        print(f"ERREUR : {len(rejected)} album(s) refusé(s) par la base, mis de côté dans {self.dead_letter_path}")
+
+    async def _replay_spool(self):
+        """Relit le fichier de reprise, dans la limite de la place libre en file (le reste y reste)"""
+        # Remis à zéro avant la lecture : une ligne mise de côté pendant celle-ci le relève
+        self._spilled = False
+        if not self.spool_path:
+            return
+
+        room = max(self.max_pending - len(self._pending), 0)
+        rows, kept = await self._spool_call(_take_lines, self.spool_path, room)
+        if kept:
+            self._spilled = True
+
+        if rows:
+            print(f"Reprise de {len(rows)} album(s) non sauvegardé(s)")
+            self._pending = rows + self._pending
+            self._wakeup.set()
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "failed_flushes": self.failed_flushes,
+            "rejected_rows": self.rejected_rows,
+            "spilled_rows": self.spilled_rows,
+            "avg_rows_per_flush": round(self.flushed_rows / self.flushes, 1) if self.flushes else 0.0,
+        }
+
+
+def _take_lines(path, count):
+    """Retire les `count` premières lignes du fichier : (lignes lues, lignes restées dans le fichier)"""
+    if not os.path.exists(path):
+        return [], 0
+
+    with open(path, encoding="utf-8") as spool:
+        rows = [json.loads(line) for line in spool if line.strip()]
+    os.remove(path)
+
+    rows, rest = rows[:count], rows[count:]
+    if rest:
+        _append_lines(path, rest)
+    return rows, len(rest)
+
+
+def _log_spool_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"ERREUR : écriture du fichier de reprise en échec ({future.exception()})")
+
+
+def _append_lines(path, items):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for item in items:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+
+def _dedupe(rows):
+    """Garde la dernière ligne de chaque release (les lignes sans discogs_id sont toutes conservées)"""
+    latest = {}
+    for index, row in enumerate(rows):
+        latest[row.get("discogs_id") or f"row:{index}"] = row
+    return list(latest.values())
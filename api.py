@@ -1,26 +1,33 @@
 import os
 import sys
 import logging
-from fastapi import FastAPI, File, UploadFile, HTTPException, Request
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from supabase import create_client, Client
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
+import httpx
 from dotenv import load_dotenv
 from pydantic import BaseModel
-from starlette.middleware.base import BaseHTTPMiddleware
-import time
-
-# Configuration du logging pour forcer l'affichage
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+from typing import List, Optional
+import json
+import base64
+from access_log import AccessLogMiddleware, LoggingMiddleware, start_queue_logging
+
+# Configuration du logging : écriture sur stdout par un thread dédié (file d'attente),
+# les logger.info() ne bloquent plus la boucle d'événements
+start_queue_logging(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Import de notre moteur
-from main import KissaCore
+from main import KissaCore, CANDIDATE_TYPES
+from async_core import AsyncKissaCore
+from pipeline_timing import server_timing_header
+from library_cache import LibraryCache, etag_for
+from album_repository import AlbumRepository
+from metrics import render_prometheus
+from upstream_health import UpstreamHealth
+from candidate_search import SearchSessions, SearchSuperseded
+from library_index import LibraryIndex
 
 # Chargement des variables d'environnement
 load_dotenv()
@@ -32,11 +39,98 @@ key: str = os.environ.get("SUPABASE_KEY")
 if not url or not key:
     print("⚠️  ATTENTION : SUPABASE_URL ou SUPABASE_KEY manquant dans le .env")
 
-# Initialisation du client Supabase
-supabase: Client = create_client(url, key)
+# Client Supabase asynchrone : créé au démarrage (il doit vivre dans la boucle d'événements)
+supabase: AsyncClient = None
+
+# On démarre le moteur Kissa (config, caches) et sa version asynchrone utilisée par les routes
+kissa = KissaCore()
+kissa_async = AsyncKissaCore(kissa)
+
+# Cache des pages de /library : en mémoire, ou Redis (partagé entre workers) si KISSA_LIBRARY_CACHE=redis
+library_cache_backend = os.getenv("KISSA_LIBRARY_CACHE", "memory")
+library_cache = LibraryCache(
+    ttl=int(os.getenv("KISSA_LIBRARY_CACHE_TTL", 60)),
+    max_entries=int(os.getenv("KISSA_LIBRARY_CACHE_MAX_PAGES", 256)),
+    redis_url=os.getenv("REDIS_URL") if library_cache_backend == "redis" else None,
+)
+
+# Index plein texte local de la bibliothèque (/library/search), resynchronisé en tâche de fond
+library_index = LibraryIndex(
+    path=os.getenv("KISSA_LIBRARY_INDEX_PATH", ".kissa_cache/library_index.sqlite3"),
+    sync_interval=float(os.getenv("KISSA_LIBRARY_INDEX_SYNC_INTERVAL", 300)),
+)
+
+# Table albums : écritures différées et groupées (le scan n'attend plus la base)
+albums = AlbumRepository(
+    batch_size=int(os.getenv("KISSA_DB_BATCH_SIZE", 20)),
+    flush_interval=float(os.getenv("KISSA_DB_FLUSH_INTERVAL", 0.5)),
+    spool_path=os.getenv("KISSA_DB_SPOOL_PATH", ".kissa_cache/pending_albums.jsonl"),
+    max_pending=int(os.getenv("KISSA_DB_MAX_PENDING", 5000)),
+    max_attempts=int(os.getenv("KISSA_DB_MAX_ATTEMPTS", 3)),
+    dead_letter_path=os.getenv("KISSA_DB_DEAD_LETTER_PATH", ".kissa_cache/rejected_albums.jsonl"),
+    max_backoff=float(os.getenv("KISSA_DB_MAX_BACKOFF", 30)),
+    on_flush=library_cache.invalidate,
+    on_saved=library_index.add_rows,
+)
+
+def save_album(result):
+    """Met l'album en file d'écriture (Supabase) et l'ajoute tout de suite à l'index local"""
+    row = albums.add(result)
+    library_index.add(row, tracklist=result['details'].get('tracklist'))
+    return row
+
+async def find_in_library(discogs_id):
+    """Album déjà enregistré : file d'écriture, puis index local ; Supabase seulement s'il n'y est pas"""
+    pending = albums.find_pending(discogs_id)
+    if pending:
+        return pending
+    indexed = await library_index.find(discogs_id)
+    if indexed:
+        return albums.result_from_row(indexed)
+    return await albums.find_by_discogs_id(discogs_id)
+
+# Un album déjà enregistré court-circuite Discogs et Spotify (scan, recherche manuelle, ajout par ID)
+kissa_async.library_lookup = find_in_library
+
+# Sondes de santé en tâche de fond (recherche canari), statut servi par /health/upstreams
+HEALTH_CANARY_QUERY = os.getenv("KISSA_HEALTH_CANARY_QUERY", "Apparat")
+upstream_health = UpstreamHealth(
+    probes={
+        "discogs": lambda: kissa_async.probe_discogs(HEALTH_CANARY_QUERY),
+        "spotify": (lambda: kissa_async.probe_spotify(HEALTH_CANARY_QUERY)) if kissa.sp else None,
+        "supabase": albums.ping,
+    },
+    interval=float(os.getenv("KISSA_HEALTH_INTERVAL", 60)),
+    timeout=float(os.getenv("KISSA_HEALTH_TIMEOUT", 10)),
+)
+
+# Recherche au fil de la saisie : une seule recherche de candidats en vol par session
+search_sessions = SearchSessions()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global supabase
+    # Client HTTP de Supabase sur le transport partagé (pool keep-alive, plafond, réessais sur 429)
+    supabase_http = httpx.AsyncClient(
+        transport=kissa.transports["supabase"].async_transport(),
+        timeout=float(os.getenv("KISSA_HTTP_TIMEOUT", 15)),
+        follow_redirects=True,
+    )
+    supabase = await acreate_client(url, key, options=AsyncClientOptions(httpx_client=supabase_http))
+    await albums.start(supabase)
+    await library_index.start(albums)
+    await kissa_async.start()
+    await upstream_health.start()
+    yield
+    await upstream_health.aclose()
+    await kissa_async.aclose()
+    await library_index.aclose()
+    await albums.aclose()
+    await library_cache.aclose()
+    await supabase_http.aclose()
 
 # --- CONFIGURATION FASTAPI ---
-app = FastAPI(title="Kissa API", description="Backend avec mémoire Supabase")
+app = FastAPI(title="Kissa API", description="Backend avec mémoire Supabase", lifespan=lifespan)
 
 # --- BLOC CORS CRITIQUE (EN PREMIER) ---
 # Ceci autorise le Frontend Vercel à parler au Backend Render
@@ -48,35 +142,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Middleware pour logger toutes les requêtes (EN SECOND)
-class LoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        start_time = time.time()
-        logger.info("="*70)
-        logger.info(f"🌐 REQUÊTE REÇUE: {request.method} {request.url.path}")
-        logger.info(f"   Headers: {dict(request.headers)}")
-        sys.stdout.flush()  # Force l'affichage immédiat
-        
-        if request.method == "POST":
-            try:
-                body = await request.body()
-                logger.info(f"   Body: {body.decode()[:200]}")
-                sys.stdout.flush()
-            except:
-                pass
-        
-        response = await call_next(request)
-        
-        process_time = time.time() - start_time
-        logger.info(f"✅ RÉPONSE: {response.status_code} (temps: {process_time:.2f}s)")
-        logger.info("="*70)
-        sys.stdout.flush()
-        return response
-
-app.add_middleware(LoggingMiddleware)
+# Journal des requêtes (EN SECOND)
+# KISSA_ACCESS_LOG : "sampled" (JSON, échantillonné), "verbose" (en-têtes + corps, débogage) ou "off"
+ACCESS_LOG_MODE = os.getenv("KISSA_ACCESS_LOG", "sampled")
 
-# On démarre le moteur Kissa
-kissa = KissaCore()
+if ACCESS_LOG_MODE == "verbose":
+    app.add_middleware(LoggingMiddleware)
+elif ACCESS_LOG_MODE != "off":
+    app.add_middleware(
+        AccessLogMiddleware,
+        sample_rate=float(os.getenv("KISSA_ACCESS_LOG_SAMPLE_RATE", 0.1)),
+        slow_ms=float(os.getenv("KISSA_ACCESS_LOG_SLOW_MS", 1000)),
+        log_bodies=os.getenv("KISSA_ACCESS_LOG_BODIES", "0") == "1",
+    )
 
 @app.get("/")
 def read_root():
@@ -86,85 +164,244 @@ def read_root():
     sys.stdout.flush()
     return {"message": "API Kissa connectée à Supabase. Prête ! 🚀"}
 
+# --- PAGINATION DE LA BIBLIOTHÈQUE ---
+LIBRARY_PAGE_SIZE = int(os.getenv("KISSA_LIBRARY_PAGE_SIZE", 50))
+LIBRARY_MAX_PAGE_SIZE = int(os.getenv("KISSA_LIBRARY_MAX_PAGE_SIZE", 200))
+
+# Colonnes que le client peut demander via `fields` (id et created_at sont toujours renvoyés : ils forment le curseur)
+LIBRARY_FIELDS = ("artist", "title", "cover_image", "year", "label", "genre", "spotify_url", "discogs_url")
+LIBRARY_KEY_FIELDS = ("id", "created_at")
+
+def encode_library_cursor(row):
+    """Curseur opaque : position (created_at, id) du dernier album renvoyé"""
+    raw = json.dumps([row["created_at"], row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_library_cursor(cursor):
+    try:
+        created_at, album_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return created_at, album_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Curseur de pagination invalide.")
+
+def library_columns(fields):
+    """Projection demandée (`fields=artist,title,cover_image`), "*" si absente"""
+    if not fields:
+        return "*"
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in LIBRARY_FIELDS + LIBRARY_KEY_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Champs inconnus : {', '.join(unknown)}")
+    return ",".join(dict.fromkeys(LIBRARY_KEY_FIELDS + tuple(requested)))
+
+async def fetch_library_page(cursor, limit, columns):
+    """Lit une page de la table albums dans Supabase"""
+    after = decode_library_cursor(cursor) if cursor else None
+
+    # Une ligne de plus que demandé : sa présence indique qu'il existe une page suivante
+    rows = await albums.page(columns, limit + 1, after=after)
+
+    items = rows[:limit]
+    next_cursor = encode_library_cursor(items[-1]) if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
 @app.get("/library")
-def get_library():
+async def get_library(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = LIBRARY_PAGE_SIZE,
+    fields: Optional[str] = None,
+):
     """
-    Récupère tous les albums enregistrés dans Supabase.
-    Classés du plus récent au plus ancien.
+    Récupère les albums enregistrés dans Supabase, page par page.
+    Classés du plus récent au plus ancien (created_at puis id, pagination par curseur :
+    on repart après le dernier album vu, sans OFFSET).
+    Renvoie {"items": [...], "next_cursor": "..." ou null sur la dernière page}.
+
+    Les pages passent par library_cache (vidé à chaque ajout/suppression) et portent un ETag :
+    si le client renvoie If-None-Match et que rien n'a changé, on répond 304 sans corps.
     """
+    limit = max(1, min(limit, LIBRARY_MAX_PAGE_SIZE))
+    columns = library_columns(fields)
+    page_key = f"{cursor or ''}|{limit}|{columns}"
+
     try:
-        # On interroge la table 'albums', on trie par date de création descendante
-        response = supabase.table("albums").select("*").order("created_at", desc=True).execute()
-        return response.data
+        # Lecture de ses propres écritures : les albums encore en file partent avant la lecture
+        # (rien à écrire la plupart du temps : pas d'aller-retour Supabase pour une page en cache)
+        if albums.has_pending():
+            await albums.flush()
+        generation = await library_cache.generation()
+        page = await library_cache.get(generation, page_key)
+
+        if page is None:
+            body = await fetch_library_page(cursor, limit, columns)
+            page = {"etag": etag_for(body), "body": body}
+            await library_cache.set(generation, page_key, page)
+
+        # no-cache : le navigateur garde la page mais revalide à chaque fois (If-None-Match)
+        headers = {"ETag": page["etag"], "Cache-Control": "no-cache"}
+        if request.headers.get("if-none-match") == page["etag"]:
+            library_cache.not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        response.headers.update(headers)
+        return page["body"]
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Nombre maximum de résultats de /library/search
+LIBRARY_SEARCH_MAX_RESULTS = 50
+
+@app.get("/library/search")
+async def search_library(q: str, limit: int = 20):
+    """
+    Recherche dans sa propre collection (artiste, titre, label, genres, pistes).
+    Servie par l'index local (SQLite FTS5) : aucun appel à Supabase. La requête tourne dans le
+    thread de l'index : la boucle n'attend pas un lot de synchronisation en cours.
+    """
+    limit = max(1, min(limit, LIBRARY_SEARCH_MAX_RESULTS))
+    return {"items": await library_index.search(q, limit=limit)}
+
 @app.post("/scan")
-async def scan_vinyl(file: UploadFile = File(...)):
+async def scan_vinyl(response: Response, file: UploadFile = File(...)):
     """
     1. Reçoit l'image
     2. Analyse avec Kissa (Google/Discogs/Spotify)
     3. Sauvegarde le résultat dans Supabase
     4. Renvoie le résultat au frontend
     """
-    temp_filename = f"temp_{file.filename}"
-    
     try:
-        # A. Sauvegarde temporaire
+        # A. Lecture de l'upload en mémoire (aucun fichier temporaire sur disque)
         print(f"📥 Réception : {file.filename}")
         contents = await file.read()
         if len(contents) == 0:
             raise HTTPException(status_code=400, detail="Fichier vide.")
-            
-        with open(temp_filename, "wb") as f:
-            f.write(contents)
 
-        # B. Analyse Kissa
-        result = kissa.process(temp_filename)
-        
-        # C. Nettoyage image
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
-            
-        # D. Vérification erreur
+        # B. Analyse Kissa : le buffer part directement vers Vision
+        # (asynchrone : la boucle reste libre pendant Vision/Discogs/Spotify)
+        timings = {}
+        result = await kissa_async.process_bytes(memoryview(contents), timings=timings, original_photo=file.filename)
+        response.headers["Server-Timing"] = server_timing_header(timings)
+
+        # C. Vérification erreur
         if result.get("status") == "error":
             raise HTTPException(status_code=404, detail=result["message"])
 
-        # E. SAUVEGARDE DANS SUPABASE (L'étape cruciale)
-        # On prépare l'objet à plat pour la base de données
-        new_album = {
-            "artist": result['display']['artist'],
-            "title": result['display']['title'],
-            "cover_image": result['display']['cover_image'],
-            "year": result['details']['year'],
-            "label": result['details']['label'],
-            "genre": result['details']['genre'], # Supabase gère les tableaux (text[])
-            "spotify_url": result['links']['spotify_url'],
-            "discogs_url": result['links']['discogs_url']
-        }
-
-        print("💾 Sauvegarde en base de données...")
-        db_response = supabase.table("albums").insert(new_album).execute()
-        
+        # D. SAUVEGARDE DANS SUPABASE (différée : upsert groupé en tâche de fond)
+        if result.get("already_in_library"):
+            print("📀 Album déjà dans la bibliothèque : rien à sauvegarder")
+        else:
+            print("💾 Sauvegarde en base de données...")
+            save_album(result)
+
         # On renvoie le résultat complet (incluant potentiellement l'ID créé)
         return result
 
     except HTTPException as he:
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
         raise he
     except Exception as e:
         print(f"❌ Erreur critique : {e}")
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
         raise HTTPException(status_code=500, detail=str(e))
 
+# Nombre maximum de photos acceptées par /scan/batch
+BATCH_MAX_FILES = int(os.getenv("KISSA_BATCH_MAX_FILES", 50))
+
+@app.post("/scan/batch")
+async def scan_vinyl_batch(response: Response, files: List[UploadFile] = File(...)):
+    """
+    Scan d'une pile de pochettes en une seule requête.
+    L'OCR part par lots vers Google Vision (batch_annotate_images, 16 images max par lot),
+    puis les résolutions Discogs/Spotify tournent en parallèle (concurrence bornée).
+    Renvoie un résultat par photo, dans l'ordre d'envoi ; les albums trouvés sont sauvegardés.
+    """
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"Trop de photos ({len(files)}), maximum {BATCH_MAX_FILES}.")
+
+    try:
+        print(f"📥 Réception d'un lot de {len(files)} photos")
+        contents = [await file.read() for file in files]
+        filenames = [file.filename for file in files]
+
+        timings = {}
+        results = await kissa_async.process_batch(
+            [memoryview(content) for content in contents], filenames=filenames, timings=timings
+        )
+        response.headers["Server-Timing"] = server_timing_header(timings)
+
+        # Sauvegarde de tous les albums trouvés (insert multi-lignes en tâche de fond)
+        found = [
+            result for result in results
+            if result.get("status") != "error" and not result.get("already_in_library")
+        ]
+        if found:
+            print(f"💾 Sauvegarde de {len(found)} albums en base de données...")
+            for result in found:
+                save_album(result)
+
+        return results
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        print(f"❌ Erreur critique : {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Taux de hit/miss des caches locaux (OCR et métadonnées Discogs)"""
+    return {
+        "ocr": kissa.ocr_cache.stats(),
+        "metadata": kissa.metadata_cache.stats(),
+        "library": library_cache.stats(),
+        "candidates": {**kissa.candidate_cache.stats(), **search_sessions.stats()},
+        "library_index": library_index.stats(),
+        "discogs_mirror": kissa.discogs_mirror.stats() if kissa.discogs_mirror else None,
+    }
+
+@app.get("/health/upstreams")
+def upstreams_health():
+    """Dernier statut des services externes (sondes en tâche de fond, aucun appel ici)"""
+    return upstream_health.snapshot()
+
+@app.get("/metrics")
+def metrics():
+    """
+    Métriques Prometheus : latence par étape du pipeline (histogrammes + p50/p95/p99),
+    erreurs par étape, appels et latence par service externe (Vision, Discogs, Spotify, Supabase)
+    """
+    return Response(content=render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats/db")
+def db_stats():
+    """File d'écriture vers Supabase : lignes en attente et taille moyenne des inserts groupés"""
+    return albums.stats()
+
+@app.get("/stats/upstreams")
+def upstream_stats():
+    """
+    Transport HTTP par service : requêtes en vol, réessais, 429 reçus, connexions ouvertes et réutilisées.
+    Discogs : état de l'ordonnanceur (seau à jetons, file par priorité, requêtes regroupées)
+    """
+    stats = {name: transport.stats() for name, transport in kissa.transports.items()}
+    stats["discogs"]["scheduler"] = kissa.discogs_scheduler.stats()
+    return stats
+
+@app.get("/stats/preprocess")
+def preprocess_stats():
+    """Octets économisés et coût moyen du prétraitement des photos avant Vision"""
+    return kissa.image_preprocessor.stats()
+
 # NOUVELLE ROUTE : SUPPRIMER UN ALBUM
 @app.delete("/album/{album_id}")
-def delete_album(album_id: str):
+async def delete_album(album_id: str):
     try:
         # On demande à Supabase de supprimer la ligne où l'id correspond
-        response = supabase.table("albums").delete().eq("id", album_id).execute()
+        deleted = await albums.delete(album_id)
+        library_index.remove(album_id=album_id, discogs_id=deleted[0].get("discogs_id") if deleted else None)
+        await library_cache.invalidate()
         return {"message": "Album supprimé"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -174,38 +411,34 @@ class SearchRequest(BaseModel):
     query: str
 
 @app.post("/search-manual")
-async def search_manual_vinyl(request: SearchRequest):
+async def search_manual_vinyl(request: SearchRequest, response: Response):
     """Reçoit un texte, cherche sur Discogs/Spotify et sauvegarde."""
     try:
         # A. Recherche
-        result = kissa.search_by_text(request.query)
-        
+        timings = {}
+        result = await kissa_async.search_by_text(request.query, timings=timings)
+        response.headers["Server-Timing"] = server_timing_header(timings)
+
         if result.get("status") == "error":
             raise HTTPException(status_code=404, detail=result["message"])
-        # B. Sauvegarde Supabase (Copier-coller de la logique du scan)
-        new_album = {
-            "artist": result['display']['artist'],
-            "title": result['display']['title'],
-            "cover_image": result['display']['cover_image'],
-            "year": result['details']['year'],
-            "label": result['details']['label'],
-            "genre": result['details']['genre'],
-            "spotify_url": result['links']['spotify_url'],
-            "discogs_url": result['links']['discogs_url']
-        }
-        
-        print(f"💾 Sauvegarde manuelle : {new_album['title']}")
-        supabase.table("albums").insert(new_album).execute()
-        
+        # B. Sauvegarde Supabase (différée)
+        if not result.get("already_in_library"):
+            new_album = save_album(result)
+            print(f"💾 Sauvegarde manuelle : {new_album['title']}")
+
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 class CandidateRequest(BaseModel):
     query: str
+    type: str = "release"  # 'release', 'master' ou 'all'
+    session: Optional[str] = None  # saisie au fil de l'eau : une requête plus récente annule la précédente
 
 class AddByIdRequest(BaseModel):
     discogs_id: int
+    type: str = "release"  # Type de l'entité choisie ('release' ou 'master')
+    title: Optional[str] = None  # Titre du candidat ("Artiste - Album") : permet de lancer Spotify en parallèle
 
 @app.get("/test-simple")
 def test_simple():
@@ -217,14 +450,14 @@ def test_simple():
     return {"test": "OK", "message": "Le serveur fonctionne !"}
 
 @app.get("/test-search")
-def test_search_direct():
+async def test_search_direct():
     """Endpoint de test pour vérifier que la recherche fonctionne"""
     try:
         logger.info("="*70)
         logger.info("🧪 TEST DIRECT - Recherche 'Apparat'")
         logger.info("="*70)
         sys.stdout.flush()
-        results = kissa.search_candidates("Apparat")
+        results = await kissa_async.search_candidates("Apparat")
         logger.info(f"🧪 Résultats : {len(results)} éléments")
         logger.info("="*70)
         sys.stdout.flush()
@@ -237,8 +470,11 @@ def test_search_direct():
         return {"error": str(e)}
 
 @app.post("/search-candidates")
-def get_candidates(request: CandidateRequest):
-    """Renvoie une liste de vinyles possibles"""
+async def get_candidates(request: CandidateRequest, http_request: Request):
+    """Renvoie une liste de vinyles possibles (409 si la recherche a été remplacée ou abandonnée)"""
+    if request.type not in CANDIDATE_TYPES:
+        raise HTTPException(status_code=400, detail=f"Type inconnu : {request.type}")
+
     try:
         logger.info("="*70)
         logger.info(f"🔍 RECHERCHE REÇUE : '{request.query}'")
@@ -250,16 +486,24 @@ def get_candidates(request: CandidateRequest):
         # Test direct pour voir si kissa fonctionne
         logger.info(f"🔍 Test direct avec kissa.search_candidates...")
         sys.stdout.flush()
-        results = kissa.search_candidates(request.query)
+        try:
+            results = await search_sessions.run(
+                request.session,
+                kissa_async.search_candidates(request.query, search_type=request.type),
+                disconnected=http_request.is_disconnected,
+            )
+        except SearchSuperseded:
+            logger.info(f"⏹️ Recherche abandonnée : '{request.query}'")
+            raise HTTPException(status_code=409, detail="Recherche remplacée par une requête plus récente")
         logger.info(f"📤 Résultats obtenus : {len(results)} éléments, type: {type(results)}")
         sys.stdout.flush()
         
         if len(results) == 0:
-            logger.warning("⚠️ ATTENTION : Liste vide retournée par search_candidates")
-            # Test avec une requête fixe pour voir si c'est la requête qui pose problème
-            test_results = kissa.search_candidates("Apparat")
-            logger.info(f"🧪 Test avec 'Apparat' : {len(test_results)} résultats")
-            sys.stdout.flush()
+            # Diagnostic sans appel réseau : dernier statut connu de la sonde Discogs
+            logger.warning(
+                f"⚠️ ATTENTION : Liste vide retournée par search_candidates "
+                f"(sonde Discogs : {upstream_health.status('discogs')})"
+            )
         
         # S'assurer que les résultats sont sérialisables en JSON
         serializable_results = []
@@ -267,6 +511,7 @@ def get_candidates(request: CandidateRequest):
             try:
                 serializable_result = {
                     "discogs_id": int(result.get("discogs_id", 0)) if result.get("discogs_id") else 0,
+                    "type": str(result.get("type", "release")),
                     "title": str(result.get("title", "")),
                     "artist": str(result.get("artist", "")),
                     "year": str(result.get("year", "")),
@@ -281,6 +526,8 @@ def get_candidates(request: CandidateRequest):
         logger.info(f"📤 Résultats sérialisés : {len(serializable_results)} éléments")
         sys.stdout.flush()
         return serializable_results
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Erreur dans /search-candidates : {e}")
         import traceback
@@ -289,27 +536,21 @@ def get_candidates(request: CandidateRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/add-by-id")
-async def add_vinyl_by_id(request: AddByIdRequest):
+async def add_vinyl_by_id(request: AddByIdRequest, response: Response):
     """Ajoute le vinyle spécifique choisi par l'utilisateur"""
     try:
         # A. Récupération des détails complets
-        result = kissa.process_by_id(request.discogs_id)
-        
+        timings = {}
+        result = await kissa_async.process_by_id(
+            request.discogs_id, entity_type=request.type, hint_title=request.title, timings=timings
+        )
+        response.headers["Server-Timing"] = server_timing_header(timings)
+
         if result.get("status") == "error":
             raise HTTPException(status_code=404, detail=result["message"])
-        # B. Sauvegarde Supabase
-        new_album = {
-            "artist": result['display']['artist'],
-            "title": result['display']['title'],
-            "cover_image": result['display']['cover_image'],
-            "year": result['details']['year'],
-            "label": result['details']['label'],
-            "genre": result['details']['genre'],
-            "spotify_url": result['links']['spotify_url'],
-            "discogs_url": result['links']['discogs_url']
-        }
-        
-        supabase.table("albums").insert(new_album).execute()
+        # B. Sauvegarde Supabase (différée)
+        if not result.get("already_in_library"):
+            save_album(result)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,523 @@
+import os
+
+import asyncio
+
+import httpx
+
+from google.cloud import vision
+
+from discogs_client.exceptions import HTTPError
+
+from discogs_records import ReleaseRecord, discogs_operation, split_search_title
+
+from main import _as_bytes
+
+from pipeline_timing import stage, timed_await
+
+from metrics import http_outcome, instrumented, record_error, track, upstream_call
+
+from discogs_scheduler import BATCH, INTERACTIVE, discogs_priority
+
+from upstream_transport import count_requests
+
+from upstream_health import probe_phase
+
+
+
+DISCOGS_API = "https://api.discogs.com"
+
+SPOTIFY_API = "https://api.spotify.com/v1"
+
+
+
+class AsyncKissaCore:
+
+    """
+    Version asynchrone du moteur Kissa, pour les routes FastAPI.
+
+    Mêmes étapes que KissaCore, mais en coroutines : Discogs et Spotify passent par
+    des clients httpx poolés (connexions keep-alive), Vision par le client gRPC asyncio.
+    La configuration, les caches et le formatage sont partagés avec le KissaCore fourni,
+    pour que les deux moteurs renvoient exactement les mêmes objets.
+
+    Les clients sont créés dans `start()` (dans la boucle d'événements) et fermés par `aclose()`.
+
+    `library_lookup` (coroutine discogs_id -> album déjà enregistré ou None) permet de
+    court-circuiter Discogs et Spotify quand la release est déjà dans la bibliothèque.
+    """
+
+    def __init__(self, core, library_lookup=None):
+        self.core = core
+        self.metadata_cache = core.metadata_cache
+        self.library_lookup = library_lookup
+        self.vision_client = None
+        self.discogs_http = None
+        self.spotify_http = None
+
+    async def start(self):
+        """Ouvre les pools de connexions (à appeler au démarrage de l'application)"""
+        limits = httpx.Limits(
+            max_connections=int(os.getenv('KISSA_HTTP_MAX_CONNECTIONS', 20)),
+            max_keepalive_connections=int(os.getenv('KISSA_HTTP_MAX_KEEPALIVE', 10)),
+        )
+        timeout = httpx.Timeout(float(os.getenv('KISSA_HTTP_TIMEOUT', 15)))
+
+        discogs_params = {"token": self.core.discogs_token} if self.core.discogs_token else {}
+        # Transports partagés avec KissaCore : plafond de concurrence et réessais (429, Retry-After) par service
+        self.discogs_http = httpx.AsyncClient(
+            base_url=DISCOGS_API,
+            params=discogs_params,
+            headers={"User-Agent": self.core.discogs.user_agent},
+            transport=self.core.transports["discogs"].async_transport(limits),
+            timeout=timeout,
+        )
+        self.spotify_http = httpx.AsyncClient(
+            base_url=SPOTIFY_API,
+            transport=self.core.transports["spotify"].async_transport(limits),
+            timeout=timeout,
+        )
+
+        # Vision : seulement si le moteur synchrone a trouvé des credentials
+        if self.core.vision_client is not None:
+            self.vision_client = vision.ImageAnnotatorAsyncClient(credentials=self.core.google_credentials)
+
+    async def aclose(self):
+        """Ferme proprement les pools (à appeler à l'arrêt de l'application)"""
+        if self.discogs_http:
+            await self.discogs_http.aclose()
+        if self.spotify_http:
+            await self.spotify_http.aclose()
+        if self.vision_client:
+            await self.vision_client.transport.close()
+
+    async def _discogs_get(self, path, **params):
+        """
+        GET sur l'API Discogs ; lève la même HTTPError que discogs_client en cas d'échec.
+        Passe par l'ordonnanceur du moteur (débit, priorité) ; deux GET identiques simultanés
+        partagent la même réponse (chacun relit son JSON).
+        """
+        key = (path, tuple(sorted(params.items())))
+        response = await self.core.discogs_scheduler.acall(key, lambda: self._discogs_fetch(path, params))
+        if not 200 <= response.status_code < 300:
+            try:
+                message = response.json().get('message', response.text)
+            except ValueError:
+                message = response.text
+            raise HTTPError(message, response.status_code)
+        return response.json()
+
+    async def _discogs_fetch(self, path, params):
+        probe_phase("sent")
+        with upstream_call("discogs", discogs_operation(path)) as call:
+            response = await self.discogs_http.get(path, params=params)
+            call["outcome"] = http_outcome(response.status_code)
+        return response
+
+    async def _search_page(self, query, per_page, **fields):
+        """Première page brute de /database/search (une seule requête, copie locale d'abord en mode local_first)"""
+        if self.core.discogs_mirror:
+            local = await asyncio.to_thread(self.core._mirror_search, query, per_page, **fields)
+            if local:
+                return local
+        data = await self._discogs_get("/database/search", q=query, page=1, per_page=per_page, **fields)
+        return data.get('results', [])
+
+    async def _fetch_release(self, release_id):
+        """Hydrate une release en une seule requête (cf. ReleaseHydrator), copie locale d'abord"""
+        if self.core.discogs_mirror:
+            local = await asyncio.to_thread(self.core._mirror_release, release_id)
+            if local:
+                return local
+        with count_requests() as sent:
+            data = await self._discogs_get(f"/releases/{release_id}")
+        return ReleaseRecord.from_json(data, http_calls=sent["requests"])
+
+    async def _match_release(self, text, normalized=None, typed=False):
+        """Release la plus proche d'un texte : (hit, confiance) ou (None, confiance) (cf. KissaCore._match_release)"""
+        match = self.core._release_match(text, normalized, typed)
+        for query, fields in match:
+            match.add(fields, await self._search_page(query, per_page=self.core.ocr_matcher.per_query, type='release', **fields))
+        return match.result()
+
+    async def _main_release(self, master_id):
+        """ID de la release principale d'un master : copie locale d'abord, sinon /masters/{id}"""
+        if self.core.discogs_mirror:
+            local = await asyncio.to_thread(self.core._mirror_main_release, master_id)
+            if local:
+                return local
+        master = await self._discogs_get(f"/masters/{master_id}")
+        return master["main_release"]
+
+    async def step_1_ocr(self, image_path):
+        """Lit le texte sur la pochette à partir d'un fichier (enveloppe de step_1_ocr_bytes)"""
+        print(f"Analyse visuelle de {image_path}...")
+
+        try:
+            content = await asyncio.to_thread(_read_bytes, image_path)
+        except Exception as e:
+            print(f"ERREUR OCR : {e}")
+            return None
+
+        return await self.step_1_ocr_bytes(content)
+
+    @instrumented("step_1_ocr")
+    async def step_1_ocr_bytes(self, content, timings=None):
+        """Lit le texte depuis les octets de l'image (Google Vision asyncio, sauf si l'image est dans le cache OCR)"""
+        try:
+            content = _as_bytes(content)
+
+            # Hash + décodage de la miniature : CPU, donc hors de la boucle d'événements
+            fingerprint, cached_text = await asyncio.to_thread(self.core._ocr_cache_lookup, content)
+            if cached_text:
+                return cached_text
+
+            if not self.vision_client:
+                print("ATTENTION : OCR non disponible : Google Vision credentials manquants")
+                return None
+
+            # Réduction de l'image (CPU) dans un thread avant l'envoi
+            prepared = await asyncio.to_thread(self.core._preprocess_image, content, timings)
+
+            with upstream_call("vision", "batch_annotate"):
+                batch = await self.vision_client.batch_annotate_images(requests=[self.core._vision_request(prepared)])
+
+            detected_text = self.core._text_from_vision_response(batch.responses[0])
+            if detected_text:
+                await asyncio.to_thread(self.core.ocr_cache.store_text, fingerprint, detected_text)
+            return detected_text
+
+        except Exception as e:
+            record_error("step_1_ocr")
+            print(f"ERREUR OCR : {e}")
+            return None
+
+    @instrumented("step_1_ocr_batch")
+    async def step_1_ocr_batch(self, contents, timings=None):
+        """OCR de plusieurs images, un batch_annotate_images par lot (cf. KissaCore.step_1_ocr_batch)"""
+        texts = [None] * len(contents)
+        pending = []
+
+        for index, content in enumerate(contents):
+            content = _as_bytes(content)
+            fingerprint, cached_text = await asyncio.to_thread(self.core._ocr_cache_lookup, content)
+            if cached_text:
+                texts[index] = cached_text
+            else:
+                pending.append((index, content, fingerprint))
+
+        if pending and not self.vision_client:
+            print("ATTENTION : OCR non disponible : Google Vision credentials manquants")
+            return texts
+
+        async def annotate(chunk):
+            print(f"Analyse visuelle par lot de {len(chunk)} images...")
+            try:
+                prepared = await asyncio.to_thread(
+                    lambda: [self.core._preprocess_image(content) for _, content, _ in chunk]
+                )
+                with upstream_call("vision", "batch_annotate"):
+                    batch = await self.vision_client.batch_annotate_images(
+                        requests=[self.core._vision_request(p) for p in prepared]
+                    )
+            except Exception as e:
+                record_error("step_1_ocr_batch")
+                print(f"ERREUR OCR (lot) : {e}")
+                return
+
+            for (index, _, fingerprint), response in zip(chunk, batch.responses):
+                detected_text = self.core._text_from_vision_response(response)
+                texts[index] = detected_text
+                if detected_text:
+                    await asyncio.to_thread(self.core.ocr_cache.store_text, fingerprint, detected_text)
+
+        # Les lots partent en même temps (peu nombreux : 16 images par lot)
+        await asyncio.gather(*(annotate(chunk) for chunk in self.core._batch_chunks(pending)))
+        return texts
+
+    @instrumented("step_3_spotify")
+    async def step_3_spotify(self, artist, album_title):
+        """Récupère le lien audio et la cover HD (Spotify)"""
+        if not self.core.sp:
+            return None
+
+        print("Recherche Spotify...")
+
+        q = f"artist:{artist} album:{album_title}"
+
+        try:
+            # Le jeton est mis en cache par spotipy : le réseau n'est sollicité qu'au renouvellement
+            token = await asyncio.to_thread(self.core.sp.auth_manager.get_access_token, False)
+
+            with upstream_call("spotify", "search") as call:
+                response = await self.spotify_http.get(
+                    "/search",
+                    params={"q": q, "type": "album", "limit": 1},
+                    headers={"Authorization": f"Bearer {token}"},
+                )
+                call["outcome"] = http_outcome(response.status_code)
+            response.raise_for_status()
+
+            items = response.json()['albums']['items']
+
+            if items:
+                return self.core._format_spotify_album(items[0])
+
+            return None
+
+        except Exception as e:
+            record_error("step_3_spotify")
+            print(f"ATTENTION : Erreur Spotify (non bloquant) : {e}")
+            return None
+
+    async def _stored_record(self, discogs_id, timings=None):
+        """Album déjà présent dans la bibliothèque pour cette release, sinon None"""
+        if not self.library_lookup or not discogs_id:
+            return None
+
+        try:
+            with stage(timings, "library_lookup"):
+                stored = await self.library_lookup(discogs_id)
+        except Exception as e:
+            # Bibliothèque injoignable : on continue comme un nouvel album
+            print(f"ATTENTION : vérification bibliothèque impossible ({e})")
+            return None
+
+        if stored:
+            print(f"Release {discogs_id} déjà dans la bibliothèque : Discogs et Spotify ignorés")
+        return stored
+
+    @instrumented("resolve_query")
+    async def _resolve_query(self, query, timings=None, original_photo=None, normalized=None, typed=False):
+        """
+        Résout une requête texte en enregistrement final (None si Discogs ne trouve rien).
+        Même déroulé que KissaCore._discogs_and_spotify, avec un court-circuit dès que l'ID
+        de la release est connu : si elle est déjà dans la bibliothèque, on renvoie l'album
+        enregistré sans hydrater la release ni interroger Spotify.
+
+        L'étape "step_2_discogs" (/metrics) va de la recherche à la release hydratée, Spotify et
+        vérification bibliothèque exclus.
+        """
+        cache_key = self.core._query_cache_key(query)
+        discogs_data = await asyncio.to_thread(self.metadata_cache.get, cache_key)
+
+        if discogs_data:
+            print("Discogs : résultat servi depuis le cache")
+            stored = await self._stored_record(discogs_data.get('discogs_id'), timings)
+            if stored:
+                return stored
+            spotify_data = await timed_await(timings, "spotify", self.step_3_spotify(discogs_data['artist'], discogs_data['album_title']))
+            return self.core._build_final_record(discogs_data, spotify_data, original_photo=original_photo)
+
+        print("Recherche Discogs...")
+
+        spotify_task = None
+        try:
+            with track("step_2_discogs") as clock:
+                with stage(timings, "discogs_search"):
+                    hit, confidence = await self._match_release(query, normalized, typed)
+
+                if not hit:
+                    return None
+
+                # Vérification bibliothèque : pas une attente Discogs
+                with clock.excluded():
+                    stored = await self._stored_record(hit['id'], timings)
+                if stored:
+                    return stored
+
+                hit_artist, hit_album = split_search_title(hit.get('title', ''))
+                parallel = self.core.parallel_pipeline and hit_artist
+
+                # Spotify n'a besoin que de l'artiste et du titre du hit : on n'attend pas la release
+                if parallel:
+                    spotify_task = asyncio.ensure_future(timed_await(timings, "spotify", self.step_3_spotify(hit_artist, hit_album)))
+
+                album = await timed_await(timings, "discogs_release", self._fetch_release(hit['id']))
+
+            if parallel:
+                spotify_data = await spotify_task
+
+        except Exception as e:
+            record_error("resolve_query")
+            print(f"ERREUR Discogs: {e}")
+            return None
+        finally:
+            # Échec ou annulation de l'hydratation : la recherche Spotify lancée en parallèle n'a plus d'objet
+            if spotify_task is not None and not spotify_task.done():
+                spotify_task.cancel()
+
+        discogs_data = dict(self.core._format_discogs_data(album), match_confidence=confidence)
+        await asyncio.to_thread(self.metadata_cache.set, cache_key, discogs_data)
+
+        # Mode séquentiel : Spotify attend les infos précises de la release
+        if not parallel:
+            spotify_data = await timed_await(timings, "spotify", self.step_3_spotify(discogs_data['artist'], discogs_data['album_title']))
+
+        return self.core._build_final_record(discogs_data, spotify_data, original_photo=original_photo)
+
+    async def process(self, image_path, timings=None):
+        """Orchestre tout le processus à partir d'un fichier image (enveloppe de process_bytes)"""
+        try:
+            content = await asyncio.to_thread(_read_bytes, image_path)
+        except OSError as e:
+            print(f"ERREUR OCR : {e}")
+            return {"status": "error", "message": "Texte illisible sur la photo."}
+
+        return await self.process_bytes(content, timings=timings, original_photo=image_path)
+
+    async def process_bytes(self, content, timings=None, original_photo=None):
+        """Orchestre tout le processus depuis les octets de l'image, sans fichier temporaire (cf. KissaCore.process_bytes)"""
+        with stage(timings, "ocr"):
+            detected_text = await self.step_1_ocr_bytes(content, timings)
+        if not detected_text:
+            return {"status": "error", "message": "Texte illisible sur la photo."}
+
+        final_record = await self._resolve_query(detected_text, timings, original_photo=original_photo)
+        if not final_record:
+            return {"status": "error", "message": "Album introuvable sur Discogs avec ce texte."}
+
+        return final_record
+
+    async def process_batch(self, contents, filenames=None, timings=None, max_concurrency=None):
+        """Traite un lot d'images, résultats dans l'ordre (cf. KissaCore.process_batch)"""
+        filenames = filenames or [None] * len(contents)
+
+        with stage(timings, "ocr"):
+            texts = await self.step_1_ocr_batch(contents, timings)
+
+        # Normalisation de tous les textes du lot en une passe
+        with stage(timings, "normalize"):
+            normalized = self.core.ocr_normalizer.normalize_batch(texts)
+
+        semaphore = asyncio.Semaphore(max_concurrency or self.core.batch_concurrency)
+
+        async def resolve(detected_text, filename, normalized_text):
+            if not detected_text:
+                return {"status": "error", "message": "Texte illisible sur la photo.", "filename": filename}
+
+            # Scan par lots : les appels Discogs passent après la recherche interactive
+            async with semaphore:
+                with discogs_priority(BATCH):
+                    final_record = await self._resolve_query(detected_text, original_photo=filename, normalized=normalized_text)
+
+            if not final_record:
+                return {"status": "error", "message": "Album introuvable sur Discogs avec ce texte.", "filename": filename}
+
+            return final_record
+
+        with stage(timings, "resolve"):
+            return await asyncio.gather(*(resolve(*item) for item in zip(texts, filenames, normalized)))
+
+    async def search_by_text(self, text_query, timings=None):
+        """Recherche manuelle sans image (texte -> Discogs -> Spotify)"""
+        print(f"Recherche manuelle pour : {text_query}")
+
+        final_record = await self._resolve_query(text_query, timings, typed=True)
+        if not final_record:
+            return {"status": "error", "message": "Album introuvable sur Discogs."}
+
+        return final_record
+
+    @instrumented("search_candidates")
+    async def search_candidates(self, query, search_type="release"):
+        """Recherche de candidats : une seule requête Discogs (cf. KissaCore.search_candidates)"""
+        fields, per_page = self.core._search_fields(search_type)
+
+        cached = self.core.candidate_cache.get(query, search_type)
+        if cached is not None:
+            return cached
+
+        print(f"Recherche robuste pour : {query} (type={search_type})")
+
+        # Une annulation (requête remplacée, client parti) n'est pas une Exception :
+        # elle ferme la requête httpx en cours et remonte, sans rien mettre en cache
+        try:
+            # Recherche au fil de la saisie : prioritaire sur les scans par lots
+            with discogs_priority(INTERACTIVE):
+                page = await self._search_page(query, per_page=per_page, **fields)
+            candidates = self.core._candidates_from_page(page, search_type, query)
+            self.core.candidate_cache.set(query, search_type, candidates)
+            return candidates
+
+        except Exception as e:
+            record_error("search_candidates")
+            print(f"ERREUR critique recherche globale : {e}")
+            return []
+
+    async def probe_discogs(self, canary_query):
+        """Sonde de santé : recherche canari sur Discogs ("degraded" si elle ne renvoie rien)"""
+        # Toujours l'API : en mode local_first, _search_page répondrait depuis la copie locale.
+        # Prioritaire sur les scans par lots ; l'attente d'un jeton est signalée à UpstreamHealth
+        probe_phase("queued")
+        with discogs_priority(INTERACTIVE):
+            data = await self._discogs_get("/database/search", q=canary_query, page=1, per_page=1, type='release')
+        results = data.get('results', [])
+        return {"status": "ok" if results else "degraded", "canary": canary_query, "results": len(results)}
+
+    async def probe_spotify(self, canary_query):
+        """Sonde de santé : jeton + recherche canari sur Spotify"""
+        token = await asyncio.to_thread(self.core.sp.auth_manager.get_access_token, False)
+        response = await self.spotify_http.get(
+            "/search",
+            params={"q": canary_query, "type": "album", "limit": 1},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        response.raise_for_status()
+        return {"canary": canary_query, "results": len(response.json()['albums']['items'])}
+
+    @instrumented("process_by_id")
+    async def process_by_id(self, discogs_id, entity_type="release", hint_title=None, timings=None):
+        """
+        Ajoute un album via son ID Discogs précis (cf. KissaCore.process_by_id pour `hint_title`).
+        Si la release est déjà dans la bibliothèque, l'album enregistré est renvoyé tel quel.
+        """
+        cache_key = self.core._id_cache_key(discogs_id, entity_type)
+        cached = await asyncio.to_thread(self.metadata_cache.get, cache_key)
+
+        # Pour un master, l'ID de la release principale n'est connu que par le cache (ou l'appel /masters)
+        known_release_id = discogs_id if entity_type != "master" else (cached or {}).get("details", {}).get("discogs_id")
+        stored = await self._stored_record(known_release_id, timings)
+        if stored:
+            return stored
+
+        if cached:
+            print(f"ID Discogs {discogs_id} : résultat servi depuis le cache")
+            return cached
+
+        print(f"Recuperation ID Discogs : {discogs_id}")
+
+        try:
+            release_id = discogs_id
+            if entity_type == "master":
+                with stage(timings, "discogs_master"):
+                    release_id = await self._main_release(discogs_id)
+
+                stored = await self._stored_record(release_id, timings)
+                if stored:
+                    return stored
+
+            hint_artist, hint_album = split_search_title(hint_title or "")
+
+            if self.core.parallel_pipeline and hint_artist:
+                # Spotify en parallèle, avec l'artiste et le titre du candidat choisi
+                album, spotify_data = await asyncio.gather(
+                    timed_await(timings, "discogs_release", self._fetch_release(release_id)),
+                    timed_await(timings, "spotify", self.step_3_spotify(hint_artist, hint_album)),
+                )
+            else:
+                album = await timed_await(timings, "discogs_release", self._fetch_release(release_id))
+                spotify_data = await timed_await(timings, "spotify", self.step_3_spotify(album.artist_name or "Inconnu", album.title))
+
+            final_record = self.core._format_release_record(album, spotify_data)
+            await asyncio.to_thread(self.metadata_cache.set, cache_key, final_record)
+            return final_record
+
+        except Exception as e:
+            record_error("process_by_id")
+            print(f"Erreur process ID: {e}")
+            return {"status": "error", "message": str(e)}
+
+
+def _read_bytes(path):
+    with open(path, "rb") as image_file:
+        return image_file.read()
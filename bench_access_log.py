@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Benchmark du journal des requêtes : surcoût par requête de chaque mode de KISSA_ACCESS_LOG.
+
+On monte une petite application (mêmes types de routes que l'API : GET JSON, POST JSON,
+upload multipart de plusieurs Mo) et on mesure le temps moyen par requête :
+  - off      : aucun middleware (référence)
+  - verbose  : LoggingMiddleware historique (en-têtes + lecture du corps)
+  - sampled  : AccessLogMiddleware (JSON échantillonné, file de logging)
+
+Les modes sont mesurés en alternance sur plusieurs tours (médiane), pour lisser le bruit.
+Une seconde mesure appelle directement l'application ASGI (sans client HTTP) : elle isole
+le coût propre du middleware, en microsecondes.
+
+Les logs sont écrits dans /dev/null : on mesure le coût côté serveur, pas le terminal.
+
+Usage :
+    python bench_access_log.py            # 100 requêtes par route et par tour, 5 tours
+    python bench_access_log.py 300 7      # requêtes par tour, nombre de tours
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import statistics
+
+import httpx
+from fastapi import FastAPI, File, UploadFile
+from pydantic import BaseModel
+
+from access_log import AccessLogMiddleware, LoggingMiddleware, start_queue_logging
+
+
+class Query(BaseModel):
+    query: str
+
+
+def build_app(mode):
+    app = FastAPI()
+
+    @app.get("/library")
+    async def library():
+        return {"items": [{"id": i, "artist": "Apparat", "title": f"Album {i}"} for i in range(50)], "next_cursor": None}
+
+    @app.post("/search-candidates")
+    async def candidates(request: Query):
+        return [{"discogs_id": 1, "title": request.query}]
+
+    @app.post("/scan")
+    async def scan(file: UploadFile = File(...)):
+        contents = await file.read()
+        return {"size": len(contents)}
+
+    if mode == "verbose":
+        app.add_middleware(LoggingMiddleware)
+    elif mode == "sampled":
+        app.add_middleware(AccessLogMiddleware, sample_rate=0.1)
+    return app
+
+
+MODES = ("off", "verbose", "sampled")
+
+
+async def run_http(apps, count, rounds, upload):
+    """Temps moyen par requête (µs), médiane des tours, via un client HTTP in-process"""
+    samples = {}
+
+    for _ in range(rounds):
+        for mode, app in apps.items():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+                requests = {
+                    "GET /library": lambda: client.get("/library"),
+                    "POST /search-candidates": lambda: client.post("/search-candidates", json={"query": "Apparat"}),
+                    "POST /scan (4 Mo)": lambda: client.post("/scan", files={"file": ("photo.jpg", upload, "image/jpeg")}),
+                }
+                for name, send in requests.items():
+                    await send()  # échauffement
+                    start = time.perf_counter()
+                    for _ in range(count):
+                        await send()
+                    elapsed = (time.perf_counter() - start) / count * 1e6
+                    samples.setdefault(name, {}).setdefault(mode, []).append(elapsed)
+
+    return {name: {mode: statistics.median(values) for mode, values in modes.items()} for name, modes in samples.items()}
+
+
+async def run_asgi(count):
+    """Coût propre du middleware (µs par requête) autour d'une application ASGI minimale"""
+    async def endpoint(scope, receive, send):
+        await receive()
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    scope = {
+        "type": "http", "method": "POST", "path": "/search-candidates", "raw_path": b"/search-candidates",
+        "query_string": b"", "headers": [(b"content-type", b"application/json"), (b"content-length", b"2")],
+        "scheme": "http", "server": ("bench", 80), "client": ("127.0.0.1", 1234), "root_path": "",
+        "http_version": "1.1", "app": None,
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"{}", "more_body": False}
+
+    async def send(message):
+        pass
+
+    apps = {"off": endpoint, "verbose": LoggingMiddleware(endpoint), "sampled": AccessLogMiddleware(endpoint, sample_rate=0.1)}
+    timings = {}
+    for mode, app in apps.items():
+        for _ in range(100):
+            await app(dict(scope), receive, send)
+        start = time.perf_counter()
+        for _ in range(count):
+            await app(dict(scope), receive, send)
+        timings[mode] = (time.perf_counter() - start) / count * 1e6
+    return timings
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    upload = os.urandom(4 * 1024 * 1024)
+
+    # Logs vers /dev/null, via la file (comme dans l'API)
+    start_queue_logging(stream=open(os.devnull, "w"))
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    asgi = asyncio.run(run_asgi(20000))
+    print("Middleware seul (appel ASGI direct, µs par requête)")
+    for mode in MODES:
+        print(f"  {mode:<10}{asgi[mode]:>10.1f}   surcoût {asgi[mode] - asgi['off']:+.1f}")
+
+    apps = {mode: build_app(mode) for mode in MODES}
+    results = asyncio.run(run_http(apps, count, rounds, upload))
+
+    print(f"\nRequêtes HTTP in-process (µs par requête, médiane de {rounds} tours)")
+    print(f"{'route':<26}{'off':>10}{'verbose':>10}{'sampled':>10}{'surcoût verbose':>18}{'surcoût sampled':>18}")
+    for name, timings in results.items():
+        baseline = timings["off"]
+        print(
+            f"{name:<26}{baseline:>10.0f}{timings['verbose']:>10.0f}{timings['sampled']:>10.0f}"
+            f"{timings['verbose'] - baseline:>+18.0f}{timings['sampled'] - baseline:>+18.0f}"
+        )
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la normalisation des textes OCR (ocr_normalize) : précision et latence.
+
+On génère des textes de pochette réalistes (artiste, titre, label, numéro de catalogue,
+code-barres, mentions légales, mots répétés) à partir d'un petit catalogue connu, puis on
+compare la requête envoyée à Discogs avant (texte brut, cf. KissaCore._clean_text) et après
+normalisation :
+  - précision : part des mots de la requête qui viennent de l'artiste, du titre ou du label
+  - rappel    : part des mots de l'artiste et du titre conservés
+  - longueur moyenne de la requête (mots)
+  - code-barres / numéro de catalogue correctement détectés
+  - faux numéros de catalogue tirés de l'artiste ou du titre ("MAROON 5") et mots de l'artiste conservés
+
+Latence : temps par texte, en appels unitaires (normalize) et par lots (normalize_batch).
+
+Usage :
+    python bench_ocr_normalize.py            # 2000 textes
+    python bench_ocr_normalize.py 10000
+"""
+
+import sys
+import time
+import random
+import statistics
+
+from ocr_normalize import OcrNormalizer, _valid_check_digit
+from ocr_matcher import tokens
+
+
+CATALOGUE = [
+    ("Apparat", "The Devil's Walk", "Mute", "STUMM 332"),
+    ("Björk", "Homogénic", "One Little Indian", "TPLP71"),
+    ("Floating Points, Pharoah Sanders", "Promises", "Luaka Bop", "LB-1"),
+    ("Miles Davis", "Kind Of Blue", "Columbia", "CL 1355"),
+    ("Daft Punk", "Discovery", "Virgin", "V2940"),
+    ("Boards Of Canada", "Music Has The Right To Children", "Warp Records", "WARPLP55"),
+    ("Françoise Hardy", "Comment Te Dire Adieu", "Disques Vogue", "CLD 733"),
+    ("Portishead", "Dummy", "Go! Beat", "828 553-1"),
+    ("Aphex Twin", "Selected Ambient Works 85-92", "Apollo", "AMB 3922"),
+    ("Massive Attack", "Mezzanine", "Circa", "WBRLP4"),
+    # Noms d'artiste en capitales suivis d'un nombre : ne doivent pas être pris pour un numéro de catalogue
+    ("Maroon 5", "Songs About Jane", "Octone Records", "OCT 50001"),
+    ("Blink 182", "Enema Of The State", "MCA Records", "MCD 11950"),
+    ("Sum 41", "All Killer No Filler", "Island", "314 548 662-2"),
+]
+
+BOILERPLATE = [
+    "All Rights Reserved. Unauthorised copying, public performance and broadcasting prohibited.",
+    "Made in England",
+    "Manufactured and distributed by {label}",
+    "(P) {year} {label} Ltd. (C) {year} {label}",
+    "Side A 33 RPM Stereo",
+    "www.{site}.com",
+    "LP Vinyl Remastered Edition",
+]
+
+
+def ean13(rng):
+    """Code-barres EAN-13 valide (clé de contrôle calculée)"""
+    body = "".join(str(rng.randint(0, 9)) for _ in range(12))
+    for check in "0123456789":
+        if _valid_check_digit(body + check):
+            return body + check
+
+
+def make_sample(rng):
+    artist, title, label, catno = rng.choice(CATALOGUE)
+    year = str(rng.randint(1960, 2024))
+    barcode = ean13(rng) if rng.random() < 0.6 else None
+    printed_barcode = f"{barcode[0]} {barcode[1:7]} {barcode[7:]}" if barcode else ""
+
+    lines = [artist.upper(), title.upper()]
+    if rng.random() < 0.5:
+        lines.append(artist)  # répété au dos de la pochette
+    lines.append(f"{label} {catno}")
+    lines.extend(
+        line.format(label=label, year=year, site=label.split()[0].lower())
+        for line in rng.sample(BOILERPLATE, rng.randint(2, 5))
+    )
+    if printed_barcode:
+        lines.append(printed_barcode)
+    rng.shuffle(lines[2:])
+
+    return {
+        "text": " ".join(lines),
+        "signal": set(tokens(f"{artist} {title} {label}")) | {year},
+        "wanted": set(tokens(f"{artist} {title}")),
+        "artist": set(tokens(artist)),
+        "title_words": set(tokens(f"{artist} {title}")),
+        "barcode": barcode,
+        "catno": catno,
+    }
+
+
+def raw_query(text):
+    """Requête historique : le texte OCR entier (KissaCore._clean_text)"""
+    return tokens(text.replace("\n", " ").strip())
+
+
+def quality(samples, queries):
+    precision, recall, lengths = [], [], []
+    for sample, query in zip(samples, queries):
+        words = tokens(" ".join(query))
+        if words:
+            precision.append(sum(1 for w in words if w in sample["signal"]) / len(words))
+        recall.append(len(sample["wanted"] & set(words)) / len(sample["wanted"]))
+        lengths.append(len(words))
+    return statistics.mean(precision), statistics.mean(recall), statistics.mean(lengths)
+
+
+def timed(func, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rng = random.Random(42)
+    samples = [make_sample(rng) for _ in range(count)]
+    texts = [s["text"] for s in samples]
+    normalizer = OcrNormalizer()
+
+    normalized = normalizer.normalize_batch(texts)
+
+    raw = quality(samples, [raw_query(t) for t in texts])
+    new = quality(samples, [n["tokens"] for n in normalized])
+    barcode_ok = sum(1 for s, n in zip(samples, normalized) if n["barcode"] == s["barcode"]) / count
+    barcode_found = sum(1 for s, n in zip(samples, normalized) if s["barcode"] and n["barcode"] == s["barcode"])
+    barcode_total = sum(1 for s in samples if s["barcode"])
+    catno_ok = sum(
+        1 for s, n in zip(samples, normalized)
+        if n["catno"] and tokens(n["catno"]) == tokens(s["catno"])
+    ) / count
+    # Numéro de catalogue détecté dont tous les mots viennent de l'artiste ou du titre
+    false_catno = sum(
+        1 for s, n in zip(samples, normalized)
+        if n["catno"] and set(tokens(n["catno"])) <= s["title_words"]
+    ) / count
+    artist_kept = statistics.mean(len(s["artist"] & set(n["tokens"])) / len(s["artist"]) for s, n in zip(samples, normalized))
+
+    print(f"Qualité de la requête ({count} textes)")
+    print(f"{'':<22}{'précision':>12}{'rappel':>10}{'mots':>8}")
+    print(f"{'texte brut':<22}{raw[0]:>12.1%}{raw[1]:>10.1%}{raw[2]:>8.1f}")
+    print(f"{'normalisé':<22}{new[0]:>12.1%}{new[1]:>10.1%}{new[2]:>8.1f}")
+    print(f"\nCode-barres : {barcode_found}/{barcode_total} détectés, {barcode_ok:.1%} de textes corrects (présence ou absence)")
+    print(f"Numéro de catalogue : {catno_ok:.1%} détectés, {false_catno:.1%} de faux (artiste / titre)")
+    print(f"Mots de l'artiste conservés dans la requête : {artist_kept:.1%}")
+
+    single = timed(lambda: [normalizer.normalize(t) for t in texts])
+    batch = timed(lambda: normalizer.normalize_batch(texts))
+    print("\nLatence (µs par texte, meilleur de 5)")
+    print(f"  normalize (unitaire)   {single / count * 1e6:>8.1f}")
+    print(f"  normalize_batch (lot)  {batch / count * 1e6:>8.1f}")
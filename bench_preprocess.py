@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark du prétraitement des photos avant Google Vision : latence de bout en bout de l'OCR.
+
+Pour chaque photo, deux variantes : l'original envoyé tel quel, et l'image préparée par
+ImagePreprocessor (coût du prétraitement compris). Le temps compté est celui de
+step_1_ocr_bytes hors cache : prétraitement + appel Vision (envoi, OCR, réponse).
+
+Par défaut, le benchmark tourne hors-ligne : l'appel Vision est remplacé par l'envoi des
+octets à un serveur local bridé à `--uplink` Mbit/s (débit montant d'un téléphone), sans OCR.
+Avec --live, il interroge la vraie API Vision (GOOGLE_APPLICATION_CREDENTIALS requis) et
+vérifie que le texte lu est le même dans les deux variantes.
+
+Usage :
+    python bench_preprocess.py                          # hors-ligne, photo synthétique 12 Mpx
+    python bench_preprocess.py --uplink 5 photo.jpg     # hors-ligne, vos photos
+    python bench_preprocess.py --live photo.jpg         # vraie API Vision
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import statistics
+import threading
+
+# Cache OCR en mémoire : on mesure l'appel Vision, pas le cache
+os.environ.setdefault("KISSA_CACHE_PATH", ":memory:")
+
+from PIL import Image, ImageDraw
+
+from main import KissaCore
+
+
+def synthetic_photo(width=4032, height=3024):
+    """Photo de téléphone factice (12 Mpx, bruit de capteur, texte de pochette)"""
+    img = Image.effect_noise((width, height), 40).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for i in range(12):
+        draw.text((300, 300 + i * 200), f"FLOATING POINTS PROMISES LUAKA BOP {random.randint(1, 99)}", fill="white")
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+class ThrottledVision:
+
+    """Remplaçant hors-ligne de vision_client : envoie l'image à un serveur local au débit `uplink_mbps`"""
+
+    def __init__(self, uplink_mbps):
+        self.rate = uplink_mbps * 1_000_000 / 8
+        self._server = socket.create_server(("127.0.0.1", 0))
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            conn, _ = self._server.accept()
+            with conn:
+                size = int.from_bytes(conn.recv(8), "big")
+                while size > 0:
+                    size -= len(conn.recv(min(size, 65536)))
+                conn.sendall(b"ok")
+
+    def text_detection(self, image):
+        content = image.content
+        with socket.create_connection(self._server.getsockname()) as conn:
+            conn.sendall(len(content).to_bytes(8, "big"))
+            start = time.perf_counter()
+            for i in range(0, len(content), 65536):
+                chunk = content[i:i + 65536]
+                conn.sendall(chunk)
+                # Bridage : chaque bloc prend le temps qu'il mettrait sur le lien montant
+                time.sleep(max(0.0, start + (i + len(chunk)) / self.rate - time.perf_counter()))
+            conn.recv(2)
+        return None
+
+
+def run(photos, live=False, uplink=10.0, repeat=3):
+    kissa = KissaCore()
+    if not live:
+        kissa.vision_client = ThrottledVision(uplink)
+        kissa._text_from_vision_response = lambda response: None
+    elif not kissa.vision_client:
+        sys.exit("--live : Google Vision indisponible (GOOGLE_APPLICATION_CREDENTIALS)")
+
+    print()
+    print("=" * 60)
+    print(f"BENCHMARK OCR ({'API Vision réelle' if live else f'hors-ligne, lien montant {uplink} Mbit/s'})")
+    print("=" * 60)
+
+    report = []
+    for name, content in photos:
+        durations = {"original": [], "preprocessed": []}
+        texts = {}
+        sizes = {"original": len(content), "preprocessed": len(kissa.image_preprocessor.prepare(content)[0])}
+        for _ in range(repeat):
+            # Ordre alterné d'un tour à l'autre : pas d'avantage systématique (connexion déjà chaude)
+            for variant in random.sample(list(durations), 2):
+                kissa.image_preprocessor.enabled = variant == "preprocessed"
+                kissa.ocr_cache.lookup = lambda fingerprint: None
+                start = time.perf_counter()
+                texts[variant] = kissa.step_1_ocr_bytes(content)
+                durations[variant].append(time.perf_counter() - start)
+
+        original_ms = 1000 * statistics.median(durations["original"])
+        preprocessed_ms = 1000 * statistics.median(durations["preprocessed"])
+        row = {
+            "photo": name,
+            "original_bytes": sizes["original"],
+            "sent_bytes": sizes["preprocessed"],
+            "ocr_original_ms": round(original_ms, 1),
+            "ocr_preprocessed_ms": round(preprocessed_ms, 1),
+            "delta_ms": round(preprocessed_ms - original_ms, 1),
+        }
+        if live:
+            row["same_text"] = texts["original"] == texts["preprocessed"]
+        report.append(row)
+
+    print()
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("photos", nargs="*")
+    parser.add_argument("--live", action="store_true", help="vraie API Google Vision")
+    parser.add_argument("--uplink", type=float, default=10.0, help="débit montant simulé hors-ligne (Mbit/s)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    photos = [(path, open(path, "rb").read()) for path in args.photos] or [("synthetique-12mpx.jpg", synthetic_photo())]
+    run(photos, live=args.live, uplink=args.uplink, repeat=args.repeat)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la recherche de candidats : nombre d'appels Discogs par requête.
+
+Par défaut, le benchmark tourne hors-ligne sur une page de résultats figée
+(aucun token requis). Avec --live, il interroge la vraie API Discogs.
+
+Usage :
+    python bench_search.py                 # hors-ligne, fixture locale
+    python bench_search.py --live Apparat  # vraie API (DISCOGS_TOKEN requis)
+"""
+
+import os
+import sys
+import json
+import time
+
+# Cache en mémoire : on mesure le coût réseau, pas le cache
+os.environ.setdefault("KISSA_CACHE_PATH", ":memory:")
+
+from discogs_client.fetchers import Fetcher, LoggingDelegator
+
+from main import KissaCore, CANDIDATE_TYPES
+
+
+def _fixture_item(i, kind):
+    item = {
+        "id": 1000 + i,
+        "type": kind,
+        "title": f"Apparat - Album {i}" if kind in ("release", "master") else "Apparat",
+        "thumb": f"https://i.discogs.com/thumb_{i}.jpg",
+        "resource_url": f"https://api.discogs.com/{kind}s/{1000 + i}",
+    }
+    if kind in ("release", "master"):
+        item.update({"year": "2019", "label": ["Mute"], "genre": ["Electronic"], "catno": f"STUMM{i}"})
+    return item
+
+
+class FixtureFetcher(Fetcher):
+    """Répond aux recherches et aux releases avec des données figées"""
+
+    def fetch(self, client, method, url, data=None, headers=None, json=True):
+        from urllib.parse import urlparse, parse_qs
+        import json as json_lib
+
+        parsed = urlparse(url)
+        params = parse_qs(parsed.query)
+
+        if parsed.path.endswith("/database/search"):
+            kinds = ["artist", "label"] + ["release", "master"] * 20
+            items = [_fixture_item(i, kind) for i, kind in enumerate(kinds)]
+            wanted = params.get("type", [None])[0]
+            if wanted:
+                items = [item for item in items if item["type"] == wanted]
+            per_page = int(params.get("per_page", [50])[0])
+            body = {
+                "pagination": {"page": 1, "pages": 1, "per_page": per_page, "items": len(items), "urls": {}},
+                "results": items[:per_page],
+            }
+            return json_lib.dumps(body).encode("utf8"), 200
+
+        # Release / master complet (déclenché par un accès paresseux)
+        release_id = int(parsed.path.rstrip("/").split("/")[-1])
+        body = {
+            "id": release_id,
+            "title": f"Album {release_id}",
+            "artists": [{"id": 1, "name": "Apparat"}],
+            "labels": [{"id": 2, "name": "Mute"}],
+            "images": [{"uri": "https://i.discogs.com/full.jpg"}],
+            "tracklist": [],
+            "year": 2019,
+            "main_release": release_id,
+        }
+        return json_lib.dumps(body).encode("utf8"), 200
+
+
+def run(queries, live=False, repeat=1):
+    kissa = KissaCore()
+
+    # On enveloppe le fetcher (réel ou fixture) pour compter chaque requête HTTP
+    base_fetcher = kissa.discogs._fetcher if live else FixtureFetcher()
+    delegator = LoggingDelegator(base_fetcher)
+    kissa.discogs._fetcher = delegator
+
+    print()
+    print("=" * 60)
+    print(f"BENCHMARK search_candidates ({'API réelle' if live else 'fixture hors-ligne'})")
+    print("=" * 60)
+
+    report = []
+    for search_type in CANDIDATE_TYPES:
+        for query in queries:
+            timings = []
+            calls = []
+            found = 0
+            for _ in range(repeat):
+                # Cache des candidats vidé à chaque tour : on mesure la recherche, pas le cache
+                kissa.candidate_cache.clear()
+                before = len(delegator.requests)
+                start = time.perf_counter()
+                results = kissa.search_candidates(query, search_type=search_type)
+                timings.append(time.perf_counter() - start)
+                calls.append(len(delegator.requests) - before)
+                found = len(results)
+
+            # Même requête juste après : servie par le cache, mesurée à part
+            start = time.perf_counter()
+            kissa.search_candidates(query, search_type=search_type)
+            cached_ms = 1000 * (time.perf_counter() - start)
+
+            report.append({
+                "type": search_type,
+                "query": query,
+                "candidates": found,
+                "upstream_calls_per_query": max(calls),
+                "avg_ms": round(1000 * sum(timings) / len(timings), 2),
+                "cached_ms": round(cached_ms, 3),
+            })
+
+    print()
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return report
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    live = "--live" in args
+    queries = [a for a in args if not a.startswith("--")] or ["Apparat"]
+    run(queries, live=live, repeat=1 if live else 5)
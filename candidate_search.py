@@ -0,0 +1,142 @@
+import time
+
+import asyncio
+
+import threading
+
+import unicodedata
+
+from collections import OrderedDict
+
+
+
+class CandidateCache:
+
+    """
+    Cache court (en mémoire) des résultats de KissaCore.search_candidates, pour la saisie au fil de l'eau.
+
+    Clé : (type, requête normalisée). Une entrée expire après `ttl` secondes (les résultats
+    Discogs bougent peu, mais on ne veut pas servir une recherche de la veille).
+
+    Seules les requêtes identiques sont servies : une liste en cache pour "daft pu" ne dit rien
+    de "daft punk" (la recherche Discogs porte aussi sur des champs absents des candidats :
+    catno, pistes, crédits..., et sa pertinence change avec la requête).
+    """
+
+    def __init__(self, ttl=120, max_entries=512):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query, search_type):
+        """Candidats en cache (copie) pour cette requête ; None sinon"""
+        with self._lock:
+            entry = self._live(search_type, normalize_query(query), time.time())
+            if entry is not None:
+                self.hits += 1
+                return list(entry[1])
+
+            self.misses += 1
+            return None
+
+    def set(self, query, search_type, candidates):
+        with self._lock:
+            key = (search_type, normalize_query(query))
+            self._entries[key] = (time.time() + self.ttl, list(candidates))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _live(self, search_type, normalized, now):
+        key = (search_type, normalized)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def normalize_query(query):
+    """Requête normalisée : minuscules, sans accents, espaces simples"""
+    return " ".join(_fold(query).split())
+
+
+def _fold(text):
+    decomposed = unicodedata.normalize("NFKD", str(text).lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+class SearchSuperseded(Exception):
+
+    """La recherche a été abandonnée : requête plus récente de la même session, ou client parti"""
+
+
+class SearchSessions:
+
+    """
+    Une seule recherche en vol par session de saisie.
+
+    Quand une nouvelle requête arrive pour une session, la recherche précédente est annulée :
+    la tâche asyncio est interrompue et la requête HTTP vers Discogs est fermée, au lieu
+    d'aller au bout pour une réponse que plus personne n'attend. La route de la requête
+    périmée reçoit SearchSuperseded.
+
+    `disconnected` (ex : request.is_disconnected) est interrogé toutes les `poll_interval`
+    secondes : si le client a abandonné sa requête (AbortController), on annule aussi.
+    """
+
+    def __init__(self, poll_interval=0.1):
+        self.poll_interval = poll_interval
+        self.cancelled = 0
+        self._inflight = {}
+
+    async def run(self, session, coro, disconnected=None):
+        task = asyncio.ensure_future(coro)
+
+        if session:
+            previous = self._inflight.get(session)
+            if previous is not None and not previous.done():
+                previous.cancel()
+            self._inflight[session] = task
+
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=self.poll_interval)
+                if done:
+                    break
+                if disconnected is not None and await disconnected():
+                    task.cancel()
+                    await asyncio.wait({task})
+                    break
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            if session and self._inflight.get(session) is task:
+                del self._inflight[session]
+
+        if task.cancelled():
+            self.cancelled += 1
+            raise SearchSuperseded()
+        return task.result()
+
+    def stats(self):
+        return {"in_flight": len(self._inflight), "cancelled": self.cancelled}
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+Copie locale du catalogue Discogs, construite depuis les dumps XML mensuels.
+
+Import (https://data.discogs.com/) :
+    python discogs_mirror.py discogs_20261001_releases.xml.gz \\
+        --masters discogs_20261001_masters.xml.gz --out .kissa_cache/discogs_mirror.sqlite3 --formats Vinyl
+
+Le dump est lu en flux (iterparse) : chaque release est convertie puis libérée, la mémoire
+reste bornée quelle que soit la taille du fichier (plusieurs dizaines de Go décompressés).
+La base est construite dans un fichier temporaire puis mise en place d'un coup : l'API sert
+l'ancienne copie pendant l'import, puis rouvre la nouvelle à la lecture suivante (DiscogsMirror).
+
+Stockage compact (SQLite) :
+  - releases : JSON minimal au format de l'API Discogs (compressé zlib), lu par ReleaseRecord.from_json
+  - masters  : release principale, artiste, titre, année
+  - releases_fts / masters_fts : index plein texte sans contenu (artiste, titre, label, catno)
+
+Les dumps ne contiennent plus les URLs des images : la pochette vient alors de Spotify.
+"""
+
+import os
+
+import re
+
+import gzip
+
+import json
+
+import zlib
+
+import sqlite3
+
+import argparse
+
+import threading
+
+import xml.etree.ElementTree as ET
+
+
+
+RELEASE_URL = "https://www.discogs.com/release/{}"
+
+MASTER_URL = "https://www.discogs.com/master/{}"
+
+# Poids bm25 : artiste et titre d'abord (releases : artist, title, label, catno)
+RELEASE_RANK = "bm25(releases_fts, 10.0, 10.0, 2.0, 1.0)"
+
+MASTER_RANK = "bm25(masters_fts, 10.0, 10.0)"
+
+
+
+class DiscogsMirror:
+
+    """
+    Lecture de la copie locale : mêmes formes de données que l'API Discogs.
+
+    `release(id)` renvoie le JSON d'une release (comme /releases/{id}), `main_release(id)` la
+    release principale d'un master, `search(...)` une page de résultats (comme /database/search).
+    None / [] signifie "absent de la copie" : l'appelant passe alors par l'API.
+
+    Un nouvel import remplace le fichier d'un bloc (os.replace, autre inode) : chaque lecture
+    compare l'inode et la date du fichier à ceux de la connexion ouverte et rouvre la copie
+    s'ils ont changé, sans redémarrer l'API.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._signature = None
+        with self._lock:
+            self._current()
+
+    @classmethod
+    def open(cls, path):
+        """Ouvre la copie locale, ou renvoie None (avec un avertissement) si le fichier n'existe pas"""
+        if not path or not os.path.exists(path):
+            print(f"ATTENTION : copie locale Discogs introuvable ({path}) : API Discogs uniquement")
+            return None
+        return cls(path)
+
+    def reload(self):
+        """Rouvre la copie si le fichier a été remplacé depuis la dernière lecture"""
+        with self._lock:
+            self._current()
+
+    def _current(self):
+        """Connexion sur le fichier actuel (appelé sous le verrou)"""
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_ino, stat.st_mtime_ns)
+        except OSError:
+            # Fichier momentanément absent : on garde la copie déjà ouverte
+            if self._conn is None:
+                raise
+            return self._conn
+
+        if signature != self._signature:
+            # Lecture seule : la copie n'est modifiée que par l'import (fichier remplacé d'un bloc)
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            if self._conn is not None:
+                self._conn.close()
+                self.reloads += 1
+                print(f"Copie locale Discogs rechargée ({self.path})")
+            self._conn, self._signature = conn, signature
+        return self._conn
+
+    def release(self, release_id):
+        with self._lock:
+            row = self._current().execute("SELECT data FROM releases WHERE id = ?", (int(release_id),)).fetchone()
+        return _unpack(row[0]) if row else None
+
+    def main_release(self, master_id):
+        with self._lock:
+            row = self._current().execute("SELECT main_release FROM masters WHERE id = ?", (int(master_id),)).fetchone()
+        return row[0] if row else None
+
+    def search(self, query, per_page=10, type=None, catno=None):
+        """
+        Page de résultats au format /database/search (type : 'release', 'master' ou None pour les deux).
+        `catno` filtre sur le numéro de catalogue (releases uniquement, comme le filtre de l'API).
+        """
+        match = _match_expression(query)
+        if catno:
+            match = " AND ".join(filter(None, [match, _catno_expression(catno)]))
+        if not match:
+            return []
+
+        results = []
+        with self._lock:
+            conn = self._current()
+            if type in (None, "master") and not catno:
+                rows = conn.execute(
+                    "SELECT m.id, m.main_release, m.artist, m.title, m.year FROM masters_fts "
+                    "JOIN masters m ON m.id = masters_fts.rowid "
+                    f"WHERE masters_fts MATCH ? ORDER BY {MASTER_RANK} LIMIT ?",
+                    (match, per_page),
+                ).fetchall()
+                results.extend(_master_result(*row) for row in rows)
+
+            if type in (None, "release"):
+                # À pertinence égale (pressages d'un même album), la release principale d'abord
+                rows = conn.execute(
+                    "SELECT r.data FROM releases_fts JOIN releases r ON r.id = releases_fts.rowid "
+                    f"WHERE releases_fts MATCH ? ORDER BY {RELEASE_RANK}, r.is_main DESC, r.id LIMIT ?",
+                    (match, per_page),
+                ).fetchall()
+                results.extend(_release_result(_unpack(data)) for (data,) in rows)
+
+        return results[:per_page]
+
+    def stats(self):
+        with self._lock:
+            conn = self._current()
+            (releases,) = conn.execute("SELECT count(*) FROM releases").fetchone()
+            (masters,) = conn.execute("SELECT count(*) FROM masters").fetchone()
+        return {"path": self.path, "releases": releases, "masters": masters, "reloads": self.reloads}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _match_expression(query):
+    """Texte libre -> requête FTS5 : tous les mots, le dernier en préfixe (saisie en cours)"""
+    tokens = [token.replace('"', '""') for token in str(query).split() if token.strip('"')]
+    if not tokens:
+        return ""
+    return " ".join(f'"{token}"' for token in tokens[:-1]) + f' "{tokens[-1]}"*'
+
+
+def _catno_expression(catno):
+    """Filtre FTS5 sur le numéro de catalogue, avec ou sans séparateurs ("TPLP 71" = "TPLP71")"""
+    spaced = " ".join(re.findall(r"\w+", catno))
+    compact = "".join(re.findall(r"\w+", catno))
+    variants = " OR ".join(f'"{v}"' for v in dict.fromkeys([spaced, compact]) if v)
+    return f"catno : ({variants})" if variants else ""
+
+
+def _pack(data):
+    return zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def _unpack(blob):
+    return json.loads(zlib.decompress(blob))
+
+
+def _release_result(data):
+    """Release locale -> élément de page /database/search (cf. candidate_from_search_result)"""
+    artist = ", ".join(a["name"] for a in data.get("artists") or [])
+    return {
+        "id": data["id"],
+        "type": "release",
+        "title": f"{artist} - {data.get('title', '')}" if artist else data.get("title", ""),
+        "year": str(data.get("year") or ""),
+        "label": [l["name"] for l in data.get("labels") or []],
+        "catno": next((l["catno"] for l in data.get("labels") or [] if l.get("catno")), ""),
+        "master_id": data.get("master_id"),
+        "thumb": "",
+        "cover_image": "",
+        "uri": data.get("uri"),
+    }
+
+
+def _master_result(master_id, main_release, artist, title, year):
+    return {
+        "id": master_id,
+        "type": "master",
+        "title": f"{artist} - {title}" if artist else title,
+        "year": str(year or ""),
+        "label": [],
+        "main_release": main_release,
+        "thumb": "",
+        "cover_image": "",
+        "uri": MASTER_URL.format(master_id),
+    }
+
+
+# --- IMPORT DES DUMPS ---
+
+SCHEMA = (
+    "CREATE TABLE releases (id INTEGER PRIMARY KEY, master_id INTEGER, is_main INTEGER NOT NULL, data BLOB NOT NULL)",
+    "CREATE TABLE masters (id INTEGER PRIMARY KEY, main_release INTEGER, artist TEXT, title TEXT, year INTEGER)",
+    "CREATE VIRTUAL TABLE releases_fts USING fts5("
+    "artist, title, label, catno, content='', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE VIRTUAL TABLE masters_fts USING fts5("
+    "artist, title, content='', tokenize='unicode61 remove_diacritics 2')",
+)
+
+
+def iter_elements(path, tag):
+    """
+    Parcourt un dump (.xml ou .xml.gz) et renvoie un à un les éléments `tag` de premier niveau.
+    Chaque élément est vidé après usage : la mémoire ne dépend pas de la taille du dump.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as source:
+        depth = 0
+        root = None
+        for event, elem in ET.iterparse(source, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = elem
+                depth += 1
+                continue
+
+            depth -= 1
+            if depth == 1 and elem.tag == tag:
+                yield elem
+                # On libère l'élément et tout ce que la racine a accumulé
+                root.clear()
+
+
+def _text(elem, path):
+    found = elem.find(path)
+    return found.text.strip() if found is not None and found.text else ""
+
+
+def _year(value):
+    return int(value[:4]) if value[:4].isdigit() and value[:4] != "0000" else None
+
+
+def release_from_element(elem):
+    """<release> du dump -> JSON minimal au format de l'API (/releases/{id})"""
+    release_id = int(elem.get("id"))
+    master = elem.find("master_id")
+    return {
+        "id": release_id,
+        "title": _text(elem, "title"),
+        "artists": [{"name": _text(a, "name")} for a in elem.findall("artists/artist")],
+        "year": _year(_text(elem, "released")),
+        "labels": [{"name": l.get("name", ""), "catno": l.get("catno", "")} for l in elem.findall("labels/label")],
+        "genres": [g.text for g in elem.findall("genres/genre") if g.text],
+        "formats": sorted({f.get("name", "") for f in elem.findall("formats/format")}),
+        "tracklist": [
+            {"position": _text(t, "position"), "title": _text(t, "title")} for t in elem.findall("tracklist/track")
+        ],
+        "master_id": int(master.text) if master is not None and master.text else None,
+        "is_main_release": master is None or master.get("is_main_release") == "true",
+        "uri": RELEASE_URL.format(release_id),
+    }
+
+
+def master_from_element(elem):
+    artists = [_text(a, "name") for a in elem.findall("artists/artist")]
+    main_release = _text(elem, "main_release")
+    return {
+        "id": int(elem.get("id")),
+        "main_release": int(main_release) if main_release.isdigit() else None,
+        "artist": ", ".join(artists),
+        "title": _text(elem, "title"),
+        "year": _year(_text(elem, "year")),
+    }
+
+
+def import_dumps(releases_path, out_path, masters_path=None, formats=None, main_only=False, batch_size=2000, limit=None):
+    """
+    Construit la copie locale dans `out_path` (remplacée à la fin, d'un seul bloc).
+
+    `formats` : ne garder que les releases ayant un de ces formats (ex : {"Vinyl"}).
+    `main_only` : ne garder que les releases principales de leur master (et les releases sans master).
+    """
+    tmp_path = out_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    folder = os.path.dirname(out_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    for statement in SCHEMA:
+        conn.execute(statement)
+
+    kept = skipped = 0
+    batch = []
+    for elem in iter_elements(releases_path, "release"):
+        if elem.get("status", "Accepted") != "Accepted":
+            skipped += 1
+            continue
+
+        release = release_from_element(elem)
+        if (formats and not formats.intersection(release["formats"])) or (main_only and not release["is_main_release"]):
+            skipped += 1
+            continue
+
+        batch.append(release)
+        kept += 1
+        if len(batch) >= batch_size:
+            _insert_releases(conn, batch)
+            batch = []
+            print(f"  {kept} releases importées ({skipped} ignorées)", end="\r", flush=True)
+        if limit and kept >= limit:
+            break
+    _insert_releases(conn, batch)
+    print(f"{kept} releases importées ({skipped} ignorées)")
+
+    masters = 0
+    if masters_path:
+        batch = []
+        for elem in iter_elements(masters_path, "master"):
+            batch.append(master_from_element(elem))
+            masters += 1
+            if len(batch) >= batch_size:
+                _insert_masters(conn, batch)
+                batch = []
+        _insert_masters(conn, batch)
+        print(f"{masters} masters importés")
+
+    conn.execute("INSERT INTO releases_fts(releases_fts) VALUES ('optimize')")
+    conn.execute("INSERT INTO masters_fts(masters_fts) VALUES ('optimize')")
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+
+    os.replace(tmp_path, out_path)
+    return {"releases": kept, "skipped": skipped, "masters": masters}
+
+
+def _insert_releases(conn, releases):
+    conn.executemany(
+        "INSERT OR REPLACE INTO releases (id, master_id, is_main, data) VALUES (?, ?, ?, ?)",
+        [
+            (
+                r["id"], r["master_id"], int(r["is_main_release"]),
+                _pack({k: v for k, v in r.items() if k not in ("formats", "is_main_release")}),
+            )
+            for r in releases
+        ],
+    )
+    conn.executemany(
+        "INSERT INTO releases_fts (rowid, artist, title, label, catno) VALUES (?, ?, ?, ?, ?)",
+        [
+            (
+                r["id"], " ".join(a["name"] for a in r["artists"]), r["title"],
+                " ".join(l["name"] for l in r["labels"]), " ".join(l["catno"] for l in r["labels"]),
+            )
+            for r in releases
+        ],
+    )
+
+
+def _insert_masters(conn, masters):
+    conn.executemany(
+        "INSERT OR REPLACE INTO masters (id, main_release, artist, title, year) VALUES (?, ?, ?, ?, ?)",
+        [(m["id"], m["main_release"], m["artist"], m["title"], m["year"]) for m in masters],
+    )
+    conn.executemany(
+        "INSERT INTO masters_fts (rowid, artist, title) VALUES (?, ?, ?)",
+        [(m["id"], m["artist"], m["title"]) for m in masters],
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import des dumps XML Discogs dans la copie locale (SQLite)")
+    parser.add_argument("releases", help="dump des releases (.xml ou .xml.gz)")
+    parser.add_argument("--masters", help="dump des masters (.xml ou .xml.gz)")
+    parser.add_argument("--out", default=os.getenv("KISSA_DISCOGS_MIRROR_PATH", ".kissa_cache/discogs_mirror.sqlite3"))
+    parser.add_argument("--formats", help="formats à garder, séparés par des virgules (ex : Vinyl)")
+    parser.add_argument("--main-only", action="store_true", help="releases principales uniquement")
+    parser.add_argument("--limit", type=int, help="nombre maximum de releases (essais)")
+    args = parser.parse_args()
+
+    formats = {f.strip() for f in args.formats.split(",")} if args.formats else None
+    summary = import_dumps(
+        args.releases, args.out, masters_path=args.masters, formats=formats, main_only=args.main_only, limit=args.limit
+    )
+    print(f"Copie locale prête : {args.out} ({summary})")
@@ -0,0 +1,193 @@
+import re
+
+from urllib.parse import urlparse
+
+from metrics import upstream_call, http_outcome
+
+from upstream_transport import count_requests
+
+
+class ReleaseRecord:
+
+    """
+    Vue immuable et "à plat" d'une release Discogs.
+
+    Construite une seule fois depuis le JSON de /releases/{id} : toutes les lectures
+    de champs sont ensuite de simples accès locaux (aucune requête HTTP paresseuse
+    comme avec les objets discogs_client).
+    """
+
+    __slots__ = (
+        "discogs_id",
+        "title",
+        "artists",
+        "year",
+        "labels",
+        "genres",
+        "images",
+        "tracklist",
+        "url",
+        "http_calls",
+    )
+
+    def __init__(self, discogs_id, title, artists, year, labels, genres, images, tracklist, url, http_calls=0):
+        object.__setattr__(self, "discogs_id", discogs_id)
+        object.__setattr__(self, "title", title)
+        object.__setattr__(self, "artists", tuple(artists))
+        object.__setattr__(self, "year", year)
+        object.__setattr__(self, "labels", tuple(labels))
+        object.__setattr__(self, "genres", tuple(genres))
+        object.__setattr__(self, "images", tuple(images))
+        object.__setattr__(self, "tracklist", tuple(tracklist))
+        object.__setattr__(self, "url", url)
+        object.__setattr__(self, "http_calls", http_calls)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ReleaseRecord est immuable")
+
+    def __delattr__(self, name):
+        raise AttributeError("ReleaseRecord est immuable")
+
+    def __repr__(self):
+        return f"<ReleaseRecord {self.discogs_id!r} {self.artist_name!r} - {self.title!r}>"
+
+    @classmethod
+    def from_json(cls, data, http_calls=0):
+        """Construit le record depuis la réponse brute de l'API Discogs"""
+        return cls(
+            discogs_id=data.get("id"),
+            title=data.get("title", ""),
+            artists=[a.get("name", "") for a in data.get("artists") or []],
+            year=data.get("year") or None,
+            labels=[l.get("name", "") for l in data.get("labels") or []],
+            genres=data.get("genres") or [],
+            images=[img.get("uri") for img in data.get("images") or [] if img.get("uri")],
+            # On garde (position, titre) : la position vide signale un titre de face ("Side A")
+            tracklist=[(t.get("position", ""), t.get("title", "")) for t in data.get("tracklist") or []],
+            url=data.get("uri"),
+            http_calls=http_calls,
+        )
+
+    @property
+    def artist_name(self):
+        """Tous les artistes joints (ex: "Floating Points, Pharoah Sanders, LSO"), ou None"""
+        return ", ".join(self.artists) if self.artists else None
+
+    @property
+    def label_name(self):
+        return self.labels[0] if self.labels else None
+
+    @property
+    def cover_url(self):
+        return self.images[0] if self.images else None
+
+    @property
+    def clean_tracklist(self):
+        """Tracklist sans les titres de faces (ex: "Side A")"""
+        return [title for position, title in self.tracklist if position]
+
+
+class ReleaseHydrator:
+
+    """
+    Récupère le JSON d'une release en UNE requête et le fige dans un ReleaseRecord.
+
+    `http_calls` compte toutes les requêtes émises par l'hydrateur ; chaque record porte
+    aussi son propre compteur : requêtes réellement envoyées pour lui (réessais compris,
+    0 si la réponse a été partagée avec un appel identique déjà en vol).
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.http_calls = 0
+
+    def fetch(self, release_id):
+        """Télécharge /releases/{id} (une seule requête) et renvoie un ReleaseRecord"""
+        with count_requests() as sent:
+            data = self.client._get(f"{self.client._base_url}/releases/{release_id}")
+        self.http_calls += sent["requests"]
+        return ReleaseRecord.from_json(data, http_calls=sent["requests"])
+
+
+class InstrumentedFetcher:
+
+    """
+    Enveloppe le fetcher d'un discogs_client.Client : chaque requête HTTP vers Discogs
+    est chronométrée et comptée (métriques "discogs", cf. metrics.upstream_call).
+    """
+
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+
+    def fetch(self, client, method, url, data=None, headers=None, json=True):
+        with upstream_call("discogs", discogs_operation(url)) as call:
+            content, status_code = self.fetcher.fetch(client, method, url, data, headers, json)
+            call["outcome"] = http_outcome(status_code)
+        return content, status_code
+
+    def __getattr__(self, name):
+        # Le reste de l'interface (store_token, forget_token...) est celui du fetcher enveloppé
+        return getattr(self.fetcher, name)
+
+
+class SessionFetcher:
+
+    """
+    Fetcher discogs_client sur une requests.Session poolée (cf. upstream_transport) : connexions
+    keep-alive réutilisées, au lieu d'un requests.request (nouvelle connexion TLS) par appel.
+    """
+
+    def __init__(self, session, user_token=None):
+        self.session = session
+        self.user_token = user_token
+
+    def fetch(self, client, method, url, data=None, headers=None, json=True):
+        params = {"token": self.user_token} if self.user_token else None
+        response = self.session.request(method, url, params=params, data=data, headers=headers)
+        return response.content, response.status_code
+
+
+# Premier segment du chemin Discogs -> opération (labels de métriques à faible cardinalité)
+DISCOGS_OPERATIONS = {"database": "search", "releases": "release", "masters": "master"}
+
+
+def discogs_operation(url):
+    """Nom d'opération d'une URL (ou d'un chemin) de l'API Discogs : search, release, master..."""
+    segment = urlparse(url).path.strip("/").split("/", 1)[0]
+    return DISCOGS_OPERATIONS.get(segment, segment or "other")
+
+
+def split_search_title(title):
+    """
+    Sépare un titre de résultat de recherche Discogs ("Artist - Album").
+
+    Renvoie (artiste, album) ; l'artiste est None si le titre n'a pas ce format.
+    Le suffixe de désambiguïsation Discogs ("Apparat (2)") et l'astérisque
+    des variations de nom ("Apparat*") sont retirés de l'artiste.
+    """
+    if " - " not in title:
+        return None, title
+    artist, album = title.split(" - ", 1)
+    artist = re.sub(r"\s*\(\d+\)$", "", artist.strip()).rstrip("*")
+    return artist, album.strip()
+
+
+def candidate_from_search_result(data):
+    """
+    Construit un candidat directement depuis un élément de la page de recherche brute.
+
+    Titre, année, label, vignette et ID sont tous dans la page : aucune requête
+    supplémentaire. La release complète n'est hydratée qu'au choix de l'utilisateur.
+    """
+    title = data.get("title", "")
+    artist, _ = split_search_title(title)
+    labels = data.get("label") or []
+    return {
+        "discogs_id": data["id"],
+        "type": data.get("type", "release"),
+        "title": title,  # Souvent "Artist - Album"
+        "artist": artist or "Artiste Divers",
+        "year": str(data.get("year") or ""),
+        "label": labels[0] if labels else "",
+        "thumb": data.get("thumb") or data.get("cover_image") or "",
+    }
@@ -0,0 +1,352 @@
+import os
+
+import json
+
+import time
+
+import heapq
+
+import asyncio
+
+import itertools
+
+import threading
+
+import contextvars
+
+from concurrent.futures import Future
+
+from contextlib import contextmanager
+
+
+
+# Priorités (la plus petite passe en premier) : recherche au fil de la saisie, scan unitaire, scans par lots
+INTERACTIVE = 0
+NORMAL = 1
+BATCH = 2
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", NORMAL: "normal", BATCH: "batch"}
+
+# Priorité des appels Discogs du contexte courant (tâche asyncio ou thread)
+_priority = contextvars.ContextVar("discogs_priority", default=NORMAL)
+
+
+@contextmanager
+def discogs_priority(level):
+    """Priorité des appels Discogs faits dans le bloc (propagée aux tâches asyncio et asyncio.to_thread)"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+
+class TokenBucket:
+
+    """
+    Seau à jetons en mémoire (un seul worker) : `capacity` jetons, `rate` jetons par seconde.
+
+    `take()` prend un jeton et renvoie 0, ou renvoie le délai (secondes) avant le prochain jeton.
+    `blocking` : take() fait des entrées/sorties (fichier, réseau) et ne doit pas tourner dans la boucle d'événements.
+    """
+
+    backend = "memory"
+    blocking = False
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            self._tokens, self._updated, wait = _take(self._tokens, self._updated, time.monotonic(), self.rate, self.capacity)
+        return wait
+
+
+class FileTokenBucket:
+
+    """Seau à jetons partagé entre les workers d'une machine : état JSON sous verrou de fichier (portalocker)"""
+
+    backend = "file"
+    blocking = True
+
+    def __init__(self, rate, capacity, path):
+        import portalocker
+
+        self.rate = rate
+        self.capacity = capacity
+        self.path = path
+        self._portalocker = portalocker
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def take(self):
+        with self._portalocker.Lock(f"{self.path}.lock", timeout=5):
+            try:
+                with open(self.path) as f:
+                    state = json.load(f)
+                tokens, updated = state["tokens"], state["updated"]
+            except (OSError, ValueError, KeyError):
+                tokens, updated = float(self.capacity), time.time()
+
+            tokens, updated, wait = _take(tokens, updated, time.time(), self.rate, self.capacity)
+
+            with open(self.path, "w") as f:
+                json.dump({"tokens": tokens, "updated": updated}, f)
+        return wait
+
+
+# Même calcul que _take, atomique côté Redis (l'horloge est celle du serveur Redis)
+REDIS_TAKE = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+
+class RedisTokenBucket:
+
+    """Seau à jetons partagé entre workers et machines : script Lua atomique sur Redis"""
+
+    backend = "redis"
+    blocking = True
+
+    def __init__(self, rate, capacity, redis_url, key="kissa:discogs:bucket"):
+        import redis
+
+        self.rate = rate
+        self.capacity = capacity
+        self.key = key
+        self._script = redis.from_url(redis_url).register_script(REDIS_TAKE)
+
+    def take(self):
+        return float(self._script(keys=[self.key], args=[self.rate, self.capacity]))
+
+
+def _take(tokens, updated, now, rate, capacity):
+    """(jetons, horodatage, délai) après une tentative de prise de jeton"""
+    tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, now, 0.0
+    return tokens, now, (1 - tokens) / rate
+
+
+
+class DiscogsScheduler:
+
+    """
+    Ordonnanceur des appels à l'API Discogs (sync et async), devant le transport HTTP.
+
+    1. Débit : chaque requête prend un jeton du seau (`bucket`). Le seau peut être en mémoire,
+       dans un fichier verrouillé (workers d'une machine) ou dans Redis (plusieurs machines).
+    2. Priorité : les appels en attente de jeton passent par ordre de priorité (INTERACTIVE,
+       puis NORMAL, puis BATCH), dans l'ordre d'arrivée à priorité égale. La priorité vient du
+       contexte (`discogs_priority`), pas des signatures. Elle s'applique dans un worker ; entre
+       workers, seul le seau est partagé.
+    3. Regroupement : un GET identique (même URL) déjà en vol n'est pas relancé ; les appels
+       suivants attendent et reçoivent la même réponse, sans prendre de jeton.
+
+    En cas de rafale, les requêtes attendent leur tour au lieu d'échouer en 429.
+    """
+
+    def __init__(self, bucket, coalesce=True, poll_interval=0.05):
+        self.bucket = bucket
+        self.coalesce = coalesce
+        self.poll_interval = poll_interval
+        self._lock = threading.Condition()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._inflight = {}
+        self._async_inflight = {}
+        self.granted = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.waited = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self.coalesced = 0
+        self.bucket_errors = 0
+
+    # --- APPELS ---
+
+    def call(self, key, func):
+        """Exécute func() (requête Discogs) à son tour ; `key` : clé de regroupement (None = jamais regroupé)"""
+        if not (self.coalesce and key is not None):
+            self._wait_turn()
+            return func()
+
+        with self._lock:
+            leader = self._inflight.get(key)
+            if leader is None:
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if leader is not None:
+            return leader.result()
+
+        try:
+            self._wait_turn()
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def acall(self, key, func):
+        """Version asynchrone de `call` : func() renvoie une coroutine"""
+        if not (self.coalesce and key is not None):
+            await self._await_turn()
+            return await func()
+
+        while True:
+            leader = self._async_inflight.get(key)
+            if leader is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(leader)
+            except asyncio.CancelledError:
+                # Meneur annulé (recherche remplacée, client parti) : cet appel reprend la main
+                if not leader.cancelled():
+                    raise
+
+        future = self._async_inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            await self._await_turn()
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # pas d'avertissement "exception never retrieved" sans suiveur
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._async_inflight.pop(key, None)
+
+    # --- FILE D'ATTENTE ---
+
+    def _wait_turn(self):
+        ticket, start = self._enqueue()
+        try:
+            while True:
+                wait = self._take() if self._is_head(ticket) else None
+                if wait == 0:
+                    self._grant(ticket)
+                    break
+                with self._lock:
+                    self._lock.wait(timeout=self.poll_interval if wait is None else wait)
+        finally:
+            self._leave(ticket, start)
+
+    async def _await_turn(self):
+        ticket, start = self._enqueue()
+        try:
+            while True:
+                wait = None
+                if self._is_head(ticket):
+                    # Seau partagé (verrou de fichier, Redis) : hors de la boucle d'événements
+                    wait = await asyncio.to_thread(self._take) if self.bucket.blocking else self._take()
+                if wait == 0:
+                    self._grant(ticket)
+                    break
+                await asyncio.sleep(self.poll_interval if wait is None else wait)
+        finally:
+            self._leave(ticket, start)
+
+    def _enqueue(self):
+        ticket = (_priority.get(), next(self._sequence))
+        with self._lock:
+            heapq.heappush(self._queue, ticket)
+        return ticket, time.perf_counter()
+
+    def _is_head(self, ticket):
+        with self._lock:
+            return self._queue[0] == ticket
+
+    def _take(self):
+        """Jeton du seau : 0 s'il est pris, sinon le délai à attendre (appelé sans le verrou de la file)"""
+        try:
+            return self.bucket.take()
+        except Exception as e:
+            # Seau partagé injoignable (Redis, verrou) : on laisse passer, le transport gère les 429
+            with self._lock:
+                self.bucket_errors += 1
+            print(f"ATTENTION : seau à jetons Discogs indisponible ({e})")
+            return 0
+
+    def _grant(self, ticket):
+        """Le ticket a son jeton : il quitte la file, le suivant peut tenter sa chance"""
+        with self._lock:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+            self._lock.notify_all()
+
+    def _leave(self, ticket, start):
+        name = PRIORITY_NAMES.get(ticket[0], "normal")
+        with self._lock:
+            if ticket in self._queue:
+                # Appel annulé pendant l'attente : il libère sa place
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._lock.notify_all()
+            else:
+                self.granted[name] += 1
+                self.waited[name] += time.perf_counter() - start
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": self.bucket.backend,
+                "rate_per_minute": round(self.bucket.rate * 60, 2),
+                "burst": self.bucket.capacity,
+                "queued": len(self._queue),
+                "in_flight_keys": len(self._inflight) + len(self._async_inflight),
+                "coalesced": self.coalesced,
+                "bucket_errors": self.bucket_errors,
+                "granted": dict(self.granted),
+                "avg_wait_seconds": {
+                    name: round(self.waited[name] / count, 3) if count else 0.0
+                    for name, count in self.granted.items()
+                },
+            }
+
+
+class ScheduledFetcher:
+
+    """Fetcher discogs_client passant par le DiscogsScheduler (débit, priorité, regroupement des GET)"""
+
+    def __init__(self, fetcher, scheduler):
+        self.fetcher = fetcher
+        self.scheduler = scheduler
+
+    def fetch(self, client, method, url, data=None, headers=None, json=True):
+        key = url if method == "GET" else None
+        return self.scheduler.call(key, lambda: self.fetcher.fetch(client, method, url, data, headers, json))
+
+    def __getattr__(self, name):
+        return getattr(self.fetcher, name)
@@ -0,0 +1,103 @@
+import io
+
+import time
+
+import threading
+
+from PIL import Image, ImageOps
+
+
+
+# Tag EXIF de l'orientation (1 : image droite)
+ORIENTATION = 0x0112
+
+
+class ImagePreprocessor:
+
+    """
+    Prépare une photo de pochette avant l'envoi à Google Vision.
+
+    1. Orientation EXIF appliquée (les photos de téléphone sont souvent "couchées")
+    2. Redimensionnement borné : `max_edge` px sur le grand côté suffisent à la détection de texte
+    3. Ré-encodage JPEG (`quality`)
+
+    Une image déjà petite (moins de `min_bytes` et dans les bornes) et sans rotation EXIF est
+    envoyée telle quelle, et on garde l'original si le ré-encodage ne fait rien gagner (sauf
+    rotation : Vision lit mal un texte couché, même sur une petite image).
+    """
+
+    def __init__(self, max_edge=1600, quality=85, min_bytes=300_000, enabled=True):
+        self.max_edge = max_edge
+        self.quality = quality
+        self.min_bytes = min_bytes
+        self.enabled = enabled
+        self.scans = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.total_ms = 0.0
+        self._lock = threading.Lock()
+
+    def prepare(self, content):
+        """Renvoie (octets à envoyer à Vision, rapport) ; en cas d'échec, l'original est renvoyé"""
+        start = time.perf_counter()
+        output = content
+
+        if self.enabled:
+            try:
+                output = self._shrink(content)
+            except Exception as e:
+                print(f"ATTENTION : prétraitement image impossible, envoi de l'original ({e})")
+                output = content
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        report = {
+            "original_bytes": len(content),
+            "sent_bytes": len(output),
+            "bytes_saved": len(content) - len(output),
+            "preprocess_ms": round(elapsed_ms, 1),
+        }
+
+        with self._lock:
+            self.scans += 1
+            self.bytes_in += report["original_bytes"]
+            self.bytes_out += report["sent_bytes"]
+            self.total_ms += elapsed_ms
+
+        return output, report
+
+    def _shrink(self, content):
+        with Image.open(io.BytesIO(content)) as img:
+            # Orientation lue avant le seuil de taille : une petite photo couchée est quand même redressée
+            rotated = img.getexif().get(ORIENTATION, 1) != 1
+            if not rotated and len(content) < self.min_bytes and max(img.size) <= self.max_edge:
+                return content
+
+            # JPEG : décodage directement à l'échelle réduite la plus proche de la taille cible
+            # (draft ne descend que tant que les deux côtés restent >= à la cible)
+            ratio = min(1.0, self.max_edge / max(img.size))
+            img.draft("RGB", (int(img.width * ratio), int(img.height * ratio)))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((self.max_edge, self.max_edge), Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+
+            buffer = io.BytesIO()
+            img.save(buffer, format="JPEG", quality=self.quality)
+
+        output = buffer.getvalue()
+        return output if rotated or len(output) < len(content) else content
+
+    def stats(self):
+        """Cumul depuis le démarrage : octets économisés et coût moyen du prétraitement"""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "max_edge": self.max_edge,
+                "quality": self.quality,
+                "scans": self.scans,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out,
+                "avg_preprocess_ms": round(self.total_ms / self.scans, 1) if self.scans else 0.0,
+            }
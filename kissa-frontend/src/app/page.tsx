@@ -1,6 +1,6 @@
 "use client";
 
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 
 import { Loader2, Search, Trash2, Camera, Play, X, Keyboard, Plus, Disc } from "lucide-react";
 
@@ -24,6 +24,8 @@ interface SearchCandidate {
 
   discogs_id: number;
 
+  type?: string;
+
   title: string;
 
   artist: string;
@@ -78,39 +80,65 @@ export default function Home() {
 
 
 
-  const fetchLibrary = async () => {
+  // Colonnes utiles à la grille (le détail complet n'est pas nécessaire ici)
 
-    try {
+  const LIBRARY_FIELDS = "artist,title,cover_image,year,label,genre,spotify_url";
+
+
+
+  const formatLibraryItem = (item: any): Album => ({
+
+    id: item.id,
 
-      const res = await fetch("http://127.0.0.1:8000/library");
+    display: { artist: item.artist, title: item.title, cover_image: item.cover_image },
 
-      const dbData = await res.json();
+    links: { 
 
-      const formattedLibrary: Album[] = dbData.map((item: any) => ({
+      spotify_url: item.spotify_url, 
 
-        id: item.id,
+      discogs_url: item.discogs_url,
 
-        display: { artist: item.artist, title: item.title, cover_image: item.cover_image },
+      spotify_id: item.spotify_url ? item.spotify_url.split('/album/')[1]?.split('?')[0] : null
 
-        links: { 
+    },
 
-          spotify_url: item.spotify_url, 
+    details: { year: item.year, label: item.label, genre: item.genre || [], tracklist: item.tracklist || [] },
 
-          discogs_url: item.discogs_url,
+  });
+
+
+
+  // Chargement page par page : la grille s'affiche dès la première page, les suivantes s'ajoutent au fil de l'eau
 
-          spotify_id: item.spotify_url ? item.spotify_url.split('/album/')[1]?.split('?')[0] : null
+  const fetchLibrary = async () => {
+
+    try {
 
-        },
+      let cursor: string | null = null;
 
-        details: { year: item.year, label: item.label, genre: item.genre || [], tracklist: item.tracklist || [] },
+      let loaded: Album[] = [];
 
-      }));
+      do {
 
-      setLibrary(formattedLibrary);
+        const params = new URLSearchParams({ fields: LIBRARY_FIELDS });
 
-      const allGenres = formattedLibrary.flatMap(a => a.details.genre || []);
+        if (cursor) params.set("cursor", cursor);
 
-      setAvailableGenres(Array.from(new Set(allGenres)).sort());
+        const res = await fetch(`http://127.0.0.1:8000/library?${params}`);
+
+        const page = await res.json();
+
+        loaded = [...loaded, ...page.items.map(formatLibraryItem)];
+
+        setLibrary(loaded);
+
+        const allGenres = loaded.flatMap(a => a.details.genre || []);
+
+        setAvailableGenres(Array.from(new Set(allGenres)).sort());
+
+        cursor = page.next_cursor;
+
+      } while (cursor);
 
     } catch (error) { console.error(error); }
 
@@ -184,28 +212,30 @@ export default function Home() {
 
 
 
-  // Quand on valide le formulaire
+  // Recherche au fil de la saisie : la requête précédente est annulée (AbortController côté
+  // navigateur, et le serveur abandonne l'appel Discogs de la même session)
 
-  const handleSearchSubmit = async (e: React.FormEvent) => {
+  const searchController = useRef<AbortController | null>(null);
 
-    e.preventDefault(); // Bloque le rechargement de page
+  const searchSession = useRef(Math.random().toString(36).slice(2));
 
-    if (!manualSearchQuery.trim()) return;
+  const SEARCH_DEBOUNCE_MS = 300;
 
-    
+  const SEARCH_MIN_LENGTH = 3;
 
-    setIsSearching(true);
 
-    setHasSearched(true); // On indique qu'une recherche a été tentée
 
-    setSearchResults([]); 
+  const runCandidateSearch = async (query: string) => {
 
-    
+    searchController.current?.abort();
 
-    try {
+    const controller = new AbortController();
+
+    searchController.current = controller;
 
-      console.log("🔍 Envoi de la requête de recherche :", manualSearchQuery);
-      console.log("🔍 URL : http://127.0.0.1:8000/search-candidates");
+    setIsSearching(true);
+
+    try {
 
       const response = await fetch("http://127.0.0.1:8000/search-candidates", {
 
@@ -213,11 +243,14 @@ export default function Home() {
 
         headers: { "Content-Type": "application/json" },
 
-        body: JSON.stringify({ query: manualSearchQuery }),
+        body: JSON.stringify({ query, session: searchSession.current }),
+
+        signal: controller.signal,
 
       });
 
-      console.log("✅ Réponse reçue, status:", response.status);
+      // 409 : une requête plus récente a pris le relais
+      if (response.status === 409) return;
 
       if (!response.ok) {
         const errorText = await response.text();
@@ -227,19 +260,21 @@ export default function Home() {
       }
 
       const data = await response.json();
-      console.log("📦 Données reçues:", data);
-      console.log("📦 Nombre de résultats:", data.length);
 
       setSearchResults(data);
 
-    } catch (error) { 
+      setHasSearched(true);
+
+    } catch (error) {
+
+      if ((error as Error).name === "AbortError") return;
 
       console.error("❌ Erreur lors de la recherche:", error);
-      alert(`Erreur technique lors de la recherche: ${error}`); 
+      alert(`Erreur technique lors de la recherche: ${error}`);
 
-    } finally { 
+    } finally {
 
-      setIsSearching(false);
+      if (searchController.current === controller) setIsSearching(false);
 
     }
 
@@ -247,6 +282,34 @@ export default function Home() {
 
 
 
+  useEffect(() => {
+
+    const query = manualSearchQuery.trim();
+
+    if (!showManualSearch || query.length < SEARCH_MIN_LENGTH) return;
+
+    const timer = setTimeout(() => runCandidateSearch(query), SEARCH_DEBOUNCE_MS);
+
+    return () => clearTimeout(timer);
+
+  }, [manualSearchQuery, showManualSearch]);
+
+
+
+  // Quand on valide le formulaire : recherche immédiate, sans attendre la fin de la saisie
+
+  const handleSearchSubmit = async (e: React.FormEvent) => {
+
+    e.preventDefault(); // Bloque le rechargement de page
+
+    if (!manualSearchQuery.trim()) return;
+
+    runCandidateSearch(manualSearchQuery.trim());
+
+  };
+
+
+
   const handleSelectCandidate = async (candidate: SearchCandidate) => {
 
     setIsLoading(true);
@@ -259,7 +322,7 @@ export default function Home() {
 
         headers: { "Content-Type": "application/json" },
 
-        body: JSON.stringify({ discogs_id: candidate.discogs_id }),
+        body: JSON.stringify({ discogs_id: candidate.discogs_id, type: candidate.type ?? "release", title: candidate.title }),
 
       });
 
@@ -285,6 +348,8 @@ export default function Home() {
 
   const closeManualSearch = () => {
 
+    searchController.current?.abort();
+
     setShowManualSearch(false);
 
     setSearchResults([]);
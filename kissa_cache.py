@@ -0,0 +1,132 @@
+import os
+
+import json
+
+import time
+
+import sqlite3
+
+import threading
+
+
+
+class PersistentCache:
+
+    """
+    Cache clé/valeur persistant sur disque (SQLite).
+
+    Chaque entrée expire après `ttl` secondes, et quand le cache dépasse
+    `max_entries` on évince les entrées les moins récemment utilisées (LRU).
+    Les valeurs sont stockées en JSON : on récupère exactement le dict mis en cache.
+    """
+
+    def __init__(self, path, table="cache", ttl=7 * 24 * 3600, max_entries=5000):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        # On crée le dossier parent si besoin (sauf base en mémoire)
+        if path != ":memory:":
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+
+        # Une seule connexion partagée entre les threads de FastAPI, protégée par le verrou
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_lru ON {table} (last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        """Renvoie la valeur en cache, ou None si absente ou expirée"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = row
+            if expires_at < now:
+                # Entrée périmée : on la supprime et on compte un miss
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+
+            # On rafraîchit la date d'accès pour l'éviction LRU
+            self._conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        """Enregistre une valeur (sérialisable en JSON) puis applique l'éviction LRU"""
+        now = time.time()
+        expires_at = now + (ttl if ttl is not None else self.ttl)
+        payload = json.dumps(value, ensure_ascii=False)
+
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, payload, expires_at, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+
+    def keys(self, prefix=""):
+        """Clés non expirées commençant par `prefix`"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key FROM {self.table} WHERE substr(key, 1, ?) = ? AND expires_at >= ?",
+                (len(prefix), prefix, time.time()),
+            ).fetchall()
+        return [key for (key,) in rows]
+
+    def _evict(self):
+        """Supprime les entrées expirées puis les moins récemment utilisées au-delà de max_entries"""
+        self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (time.time(),))
+        (size,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        overflow = size - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY last_access ASC LIMIT ?)",
+                (overflow,),
+            )
+
+    def stats(self):
+        """Statistiques du cache (taille et taux de hit)"""
+        with self._lock:
+            (size,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        total = self.hits + self.misses
+        return {
+            "size": size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
@@ -0,0 +1,133 @@
+import json
+
+import time
+
+import hashlib
+
+from collections import OrderedDict
+
+
+
+class LibraryCache:
+
+    """
+    Cache en lecture des pages de /library (read-through), invalidé à chaque écriture.
+
+    Chaque page est rangée sous une "génération" de la bibliothèque : une insertion ou une
+    suppression change la génération, ce qui rend d'un coup toutes les pages obsolètes.
+    La génération est lue AVANT la requête Supabase : si une écriture arrive pendant la
+    requête, la page (déjà périmée) n'est pas mise en cache.
+
+    Deux stockages :
+      - en mémoire (par défaut) : propre au processus, borné à `max_entries` pages
+      - Redis (`redis_url`) : partagé entre les workers uvicorn ; en cas de panne Redis,
+        on lit directement Supabase (le cache ne doit jamais faire tomber /library)
+
+    Les entrées expirent après `ttl` secondes, ce qui borne aussi le retard d'un worker
+    en mode mémoire quand l'écriture a eu lieu dans un autre worker.
+    """
+
+    def __init__(self, ttl=60, max_entries=256, redis_url=None, prefix="kissa:library"):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._pages = OrderedDict()
+        # Démarre à l'horloge : un redémarrage ne réutilise pas une génération déjà vue
+        self._generation = time.time_ns()
+        self._redis = None
+
+        if redis_url:
+            import redis.asyncio as redis
+            self._redis = redis.from_url(redis_url)
+
+    @property
+    def backend(self):
+        return "redis" if self._redis else "memory"
+
+    async def generation(self):
+        """Génération courante de la bibliothèque (à lire avant d'interroger Supabase)"""
+        if not self._redis:
+            return self._generation
+        try:
+            value = await self._redis.get(f"{self.prefix}:generation")
+            return int(value) if value is not None else 0
+        except Exception as e:
+            print(f"ATTENTION : cache bibliothèque Redis indisponible ({e})")
+            return None
+
+    async def get(self, generation, key):
+        """Page en cache ({"etag", "body"}) pour cette génération, sinon None"""
+        entry = None
+
+        if generation is not None and self._redis:
+            try:
+                raw = await self._redis.get(f"{self.prefix}:{generation}:{key}")
+                entry = json.loads(raw) if raw is not None else None
+            except Exception as e:
+                print(f"ATTENTION : lecture du cache bibliothèque impossible ({e})")
+        elif generation is not None:
+            cached = self._pages.get((generation, key))
+            if cached and cached[0] >= time.time():
+                self._pages.move_to_end((generation, key))
+                entry = cached[1]
+
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    async def set(self, generation, key, entry):
+        if generation is None:
+            return
+
+        if self._redis:
+            try:
+                await self._redis.set(f"{self.prefix}:{generation}:{key}", json.dumps(entry, default=str), ex=self.ttl)
+            except Exception as e:
+                print(f"ATTENTION : écriture du cache bibliothèque impossible ({e})")
+            return
+
+        # Une écriture a eu lieu pendant la requête : la page est déjà périmée
+        if generation != self._generation:
+            return
+        self._pages[(generation, key)] = (time.time() + self.ttl, entry)
+        self._pages.move_to_end((generation, key))
+        while len(self._pages) > self.max_entries:
+            self._pages.popitem(last=False)
+
+    async def invalidate(self):
+        """À appeler après chaque insertion/suppression dans la table albums"""
+        if self._redis:
+            try:
+                await self._redis.incr(f"{self.prefix}:generation")
+            except Exception as e:
+                print(f"ERREUR invalidation du cache bibliothèque Redis : {e}")
+            return
+
+        self._generation += 1
+        self._pages.clear()
+
+    async def aclose(self):
+        if self._redis:
+            await self._redis.aclose()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "size": len(self._pages) if not self._redis else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+def etag_for(body):
+    """ETag fort calculé sur le contenu de la page (stable d'un worker à l'autre)"""
+    payload = json.dumps(body, sort_keys=True, ensure_ascii=False, default=str)
+    return '"' + hashlib.sha1(payload.encode()).hexdigest() + '"'
@@ -0,0 +1,325 @@
+import os
+
+import json
+
+import time
+
+import sqlite3
+
+import asyncio
+
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+
+# Colonnes de la table albums nécessaires à l'index (et renvoyées par /library/search)
+INDEX_COLUMNS = "id,created_at,discogs_id,artist,title,cover_image,year,label,genre,spotify_url"
+
+# Poids bm25 des colonnes indexées : artiste et titre d'abord, puis label, genres, pistes
+RANK_WEIGHTS = (10.0, 10.0, 3.0, 1.0, 1.0)
+
+
+
+class LibraryIndex:
+
+    """
+    Index plein texte local des albums enregistrés (SQLite FTS5) : artiste, titre, label, genres, pistes.
+
+    Tenu à jour au fil de l'eau par les routes d'ajout (`add`, avec la tracklist du résultat,
+    absente de la table albums) et de suppression (`remove`). Les identifiants Supabase des
+    nouveaux albums arrivent avec l'upsert (`add_rows`, branché sur AlbumRepository.on_saved).
+
+    `sync` réaligne l'index sur la table (albums ajoutés ou supprimés par un autre worker) ;
+    elle tourne au démarrage puis toutes les `sync_interval` secondes, en tâche de fond, et
+    ne touche pas aux albums ajoutés ou retirés au fil de l'eau pendant sa lecture de la table.
+    Le fichier SQLite garde les tracklists d'un redémarrage à l'autre.
+
+    Une recherche est une requête SQLite locale : aucun appel à Supabase.
+
+    Tout passe par un seul thread d'écriture, dans l'ordre d'arrivée : `add`, `add_rows` et
+    `remove` y sont mis en file et rendent la main tout de suite, `search` et les lots de `sync`
+    y sont attendus. La boucle d'événements n'attend donc jamais le verrou de l'index.
+    """
+
+    def __init__(self, path=":memory:", sync_interval=300):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.searches = 0
+        self.syncs = 0
+        self.last_sync_at = None
+        self._lock = threading.Lock()
+        self._task = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="library-index")
+        # Pendant une synchronisation : clés ajoutées ou retirées au fil de l'eau depuis son début
+        # (lues et écrites dans le thread de l'index seulement)
+        self._touched = None
+
+        if path != ":memory:":
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS albums ("
+            "rowid INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, album_id TEXT, discogs_id INTEGER, "
+            "artist TEXT, title TEXT, cover_image TEXT, year TEXT, label TEXT, genre TEXT, "
+            "spotify_url TEXT, tracklist TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS albums_album_id ON albums (album_id)")
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS albums_fts USING fts5("
+            "artist, title, label, genre, tracklist, tokenize='unicode61 remove_diacritics 2')"
+        )
+        self._conn.commit()
+
+    # --- MISE À JOUR ET RECHERCHE (appelées depuis la boucle) ---
+
+    def add(self, row, tracklist=None):
+        """Album ajouté (ligne AlbumRepository.row_from_result, avec la tracklist du résultat) ; sans attendre"""
+        return self._submit(self._add, dict(row), tracklist)
+
+    def add_rows(self, rows):
+        """Lignes renvoyées par Supabase (avec leur id) : on complète l'index sans perdre les tracklists ; sans attendre"""
+        return self._submit(self._add_rows, list(rows))
+
+    def remove(self, album_id=None, discogs_id=None):
+        """Album supprimé ; sans attendre"""
+        return self._submit(self._remove, album_id, discogs_id)
+
+    async def search(self, text, limit=20):
+        """Albums correspondant à tous les mots (préfixes acceptés : "daft pu"), les plus pertinents d'abord"""
+        return await self._call(self._search, text, limit)
+
+    async def find(self, discogs_id):
+        """Album indexé pour cette release (ligne au format de la table albums, tracklist comprise), ou None"""
+        return await self._call(self._find, discogs_id)
+
+    def _submit(self, func, *args):
+        future = self._writer.submit(func, *args)
+        future.add_done_callback(_log_failure)
+        return future
+
+    async def _call(self, func, *args):
+        return await asyncio.wrap_future(self._writer.submit(func, *args))
+
+    # --- THREAD DE L'INDEX ---
+
+    def _add(self, row, tracklist=None):
+        with self._lock:
+            self._upsert(row, tracklist)
+            self._touch(row)
+            self._conn.commit()
+
+    def _add_rows(self, rows):
+        with self._lock:
+            for row in rows:
+                self._upsert(row)
+                self._touch(row)
+            self._conn.commit()
+
+    def _remove(self, album_id=None, discogs_id=None):
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT rowid, key FROM albums WHERE album_id = ? OR (discogs_id IS NOT NULL AND discogs_id = ?)",
+                (album_id, discogs_id),
+            ).fetchall()
+            for rowid, key in found:
+                self._delete(rowid)
+                if self._touched is not None:
+                    self._touched.add(key)
+            self._conn.commit()
+
+    def _touch(self, row):
+        if self._touched is not None and (row.get("discogs_id") is not None or row.get("id") is not None):
+            self._touched.add(_key(row))
+
+    def _upsert(self, row, tracklist=None):
+        if row.get("discogs_id") is None and row.get("id") is None:
+            return  # sans release ni id Supabase : indexé au retour de l'upsert (add_rows)
+
+        key = _key(row)
+        existing = self._conn.execute(
+            "SELECT rowid, album_id, tracklist FROM albums WHERE key = ?", (key,)
+        ).fetchone()
+
+        if existing is None and row.get("id") is not None:
+            # Album ajouté sans discogs_id puis retrouvé par son id Supabase
+            existing = self._conn.execute(
+                "SELECT rowid, album_id, tracklist FROM albums WHERE album_id = ?", (row["id"],)
+            ).fetchone()
+
+        album_id = row.get("id")
+        tracklist_text = "\n".join(tracklist) if tracklist else None
+        if existing is not None:
+            rowid, previous_id, previous_tracklist = existing
+            album_id = album_id or previous_id
+            tracklist_text = tracklist_text or previous_tracklist
+            self._delete(rowid)
+
+        genre = row.get("genre") or []
+        cursor = self._conn.execute(
+            "INSERT INTO albums (key, album_id, discogs_id, artist, title, cover_image, year, label, genre, "
+            "spotify_url, tracklist) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                key, album_id, row.get("discogs_id"), row.get("artist"), row.get("title"),
+                row.get("cover_image"), _text(row.get("year")), row.get("label"),
+                json.dumps(genre, ensure_ascii=False), row.get("spotify_url"), tracklist_text,
+            ),
+        )
+        self._conn.execute(
+            "INSERT INTO albums_fts (rowid, artist, title, label, genre, tracklist) VALUES (?, ?, ?, ?, ?, ?)",
+            (cursor.lastrowid, row.get("artist"), row.get("title"), row.get("label"), " ".join(genre), tracklist_text),
+        )
+
+    def _delete(self, rowid):
+        self._conn.execute("DELETE FROM albums WHERE rowid = ?", (rowid,))
+        self._conn.execute("DELETE FROM albums_fts WHERE rowid = ?", (rowid,))
+
+    def _find(self, discogs_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT album_id, discogs_id, artist, title, cover_image, year, label, genre, spotify_url, tracklist "
+                "FROM albums WHERE key = ?",
+                (_key({"discogs_id": discogs_id}),),
+            ).fetchone()
+        if row is None:
+            return None
+
+        album_id, discogs_id, artist, title, cover_image, year, label, genre, spotify_url, tracklist = row
+        return {
+            "id": album_id, "discogs_id": discogs_id, "artist": artist, "title": title,
+            "cover_image": cover_image, "year": year, "label": label,
+            "genre": json.loads(genre) if genre else [], "spotify_url": spotify_url,
+            "discogs_url": f"https://www.discogs.com/release/{discogs_id}",
+            "tracklist": tracklist.split("\n") if tracklist else [],
+        }
+
+    def _search(self, text, limit):
+        match = _match_expression(text)
+        if not match:
+            return []
+
+        weights = ", ".join(str(w) for w in RANK_WEIGHTS)
+        with self._lock:
+            self.searches += 1
+            rows = self._conn.execute(
+                "SELECT a.album_id, a.discogs_id, a.artist, a.title, a.cover_image, a.year, a.label, "
+                "a.genre, a.spotify_url FROM albums_fts JOIN albums a ON a.rowid = albums_fts.rowid "
+                f"WHERE albums_fts MATCH ? ORDER BY bm25(albums_fts, {weights}) LIMIT ?",
+                (match, limit),
+            ).fetchall()
+
+        return [
+            {
+                "id": album_id, "discogs_id": discogs_id, "artist": artist, "title": title,
+                "cover_image": cover_image, "year": year, "label": label,
+                "genre": json.loads(genre) if genre else [], "spotify_url": spotify_url,
+            }
+            for album_id, discogs_id, artist, title, cover_image, year, label, genre, spotify_url in rows
+        ]
+
+    # --- SYNCHRONISATION AVEC SUPABASE ---
+
+    async def start(self, repository):
+        self._task = asyncio.create_task(self._run(repository))
+
+    async def aclose(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        # Écritures encore en file : appliquées avant la fermeture
+        await asyncio.to_thread(self._writer.shutdown)
+        with self._lock:
+            self._conn.close()
+
+    async def _run(self, repository):
+        while True:
+            try:
+                await self.sync(repository)
+            except Exception as e:
+                print(f"ATTENTION : synchronisation de l'index de la bibliothèque en échec ({e})")
+            await asyncio.sleep(self.sync_interval)
+
+    async def sync(self, repository, page_size=500):
+        """Relit toute la table albums (par pages) et aligne l'index : ajouts, mises à jour, suppressions"""
+        await self._call(self._track_changes, True)
+        try:
+            # Les albums encore en file d'écriture partent d'abord, sinon on les retirerait de l'index
+            await repository.flush()
+
+            rows, after = [], None
+            while True:
+                page = await repository.page(INDEX_COLUMNS, page_size, after=after)
+                rows.extend(page)
+                if len(page) < page_size:
+                    break
+                after = (page[-1]["created_at"], page[-1]["id"])
+
+            # Écritures SQLite en masse dans le thread de l'index, par lots : les ajouts et
+            # recherches au fil de l'eau passent entre deux lots
+            for start in range(0, len(rows), page_size):
+                await self._call(self._apply, rows[start:start + page_size])
+            stale = await self._call(self._remove_stale, {_key(row) for row in rows})
+        finally:
+            await self._call(self._track_changes, False)
+
+        self.syncs += 1
+        self.last_sync_at = time.time()
+        print(f"🔎 Index de la bibliothèque : {len(rows)} album(s), {stale} retiré(s)")
+
+    def _track_changes(self, enabled):
+        self._touched = set() if enabled else None
+
+    def _apply(self, rows):
+        """Lignes lues dans la table, sauf celles ajoutées ou retirées depuis le début de la synchronisation"""
+        with self._lock:
+            for row in rows:
+                if _key(row) not in self._touched:
+                    self._upsert(row)
+            self._conn.commit()
+
+    def _remove_stale(self, stored):
+        """Retire les albums absents de la table ; un album ajouté pendant la synchronisation reste"""
+        with self._lock:
+            stale = [
+                rowid for rowid, key in self._conn.execute("SELECT rowid, key FROM albums").fetchall()
+                if key not in stored and key not in self._touched
+            ]
+            for rowid in stale:
+                self._delete(rowid)
+            self._conn.commit()
+        return len(stale)
+
+    def stats(self):
+        with self._lock:
+            (size,) = self._conn.execute("SELECT count(*) FROM albums").fetchone()
+        return {"albums": size, "searches": self.searches, "syncs": self.syncs, "last_sync_at": self.last_sync_at}
+
+
+def _key(row):
+    """Clé d'un album dans l'index : sa release Discogs, à défaut son id Supabase"""
+    if row.get("discogs_id") is not None:
+        return f"discogs:{row['discogs_id']}"
+    return f"id:{row.get('id')}"
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"ATTENTION : mise à jour de l'index de la bibliothèque en échec ({future.exception()})")
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def _match_expression(text):
+    """Texte libre -> requête FTS5 : chaque mot entre guillemets (pas de syntaxe FTS5 injectée), en préfixe"""
+    tokens = [token.replace('"', '""') for token in str(text).split()]
+    return " ".join(f'"{token}"*' for token in tokens if token.strip('"'))
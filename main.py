@@ -2,6 +2,10 @@ import os
 
 import json
 
+import contextvars
+
+from concurrent.futures import ThreadPoolExecutor
+
 from dotenv import load_dotenv
 
 
@@ -13,10 +17,38 @@ from google.oauth2 import service_account
 
 import discogs_client
 
+from discogs_client.utils import update_qs
+
 import spotipy
 
 from spotipy.oauth2 import SpotifyClientCredentials
 
+from kissa_cache import PersistentCache
+
+from ocr_cache import OcrCache
+
+from ocr_layout import OcrLayout
+
+from candidate_search import CandidateCache
+
+from ocr_matcher import OcrMatcher
+
+from ocr_normalize import OcrNormalizer
+
+from image_preprocess import ImagePreprocessor
+
+from discogs_records import InstrumentedFetcher, ReleaseHydrator, SessionFetcher, ReleaseRecord, candidate_from_search_result, split_search_title
+
+from discogs_mirror import DiscogsMirror
+
+from upstream_transport import UpstreamTransport
+
+from discogs_scheduler import BATCH, INTERACTIVE, DiscogsScheduler, FileTokenBucket, RedisTokenBucket, ScheduledFetcher, TokenBucket, discogs_priority
+
+from pipeline_timing import stage, timed_call
+
+from metrics import instrumented, record_error, upstream_call
+
 
 
 # Chargement des variables d'environnement
@@ -25,6 +57,21 @@ load_dotenv()
 
 
 
+# Recherche de candidats : types d'entités Discogs acceptés selon le mode demandé
+# ('all' = releases + masters, les artistes et labels sont filtrés sur la page brute)
+CANDIDATE_TYPES = {
+    "release": ("release",),
+    "master": ("master",),
+    "all": ("release", "master"),
+}
+
+CANDIDATE_LIMIT = 10
+
+# Google Vision accepte au plus 16 images par requête batch_annotate_images
+VISION_BATCH_LIMIT = 16
+
+
+
 class KissaCore:
 
     """
@@ -44,6 +91,8 @@ class KissaCore:
         # --- 1. GOOGLE VISION (SETUP HYBRIDE) ---
         # On vérifie si on a le JSON brut dans une variable (Cas Render/Prod)
         google_json = os.environ.get("GOOGLE_CREDENTIALS_JSON")
+        # None = credentials par défaut (GOOGLE_APPLICATION_CREDENTIALS), réutilisées par AsyncKissaCore
+        self.google_credentials = None
         
         if google_json:
             print("Mode Cloud : Chargement Google depuis variable d'environnement")
@@ -51,6 +100,7 @@ class KissaCore:
                 info = json.loads(google_json)
                 creds = service_account.Credentials.from_service_account_info(info)
                 self.vision_client = vision.ImageAnnotatorClient(credentials=creds)
+                self.google_credentials = creds
             except Exception as e:
                 print(f"ERREUR chargement Google JSON: {e}")
                 self.vision_client = None
@@ -73,16 +123,61 @@ class KissaCore:
 
         
 
+        # 1 bis. Transport HTTP partagé par service : pools keep-alive, plafond de requêtes
+        # simultanées, réessais avec backoff à gigue (Retry-After respecté). Cf. upstream_transport.py
+        self.transports = {
+            name: UpstreamTransport(
+                name,
+                max_concurrency=int(os.getenv(f'KISSA_{name.upper()}_MAX_CONCURRENCY', default_concurrency)),
+                pool_size=int(os.getenv('KISSA_HTTP_MAX_KEEPALIVE', 10)),
+                retries=int(os.getenv('KISSA_HTTP_RETRIES', 3)),
+                backoff_base=float(os.getenv('KISSA_HTTP_BACKOFF_BASE', 0.25)),
+                backoff_max=float(os.getenv('KISSA_HTTP_BACKOFF_MAX', 8)),
+                max_retry_after=float(os.getenv('KISSA_HTTP_MAX_RETRY_AFTER', 30)),
+                timeout=float(os.getenv('KISSA_HTTP_TIMEOUT', 15)),
+            )
+            for name, default_concurrency in (("discogs", 4), ("spotify", 8), ("supabase", 8))
+        }
+
+        
+
         # 2. Setup Discogs
 
         user_token = os.getenv('DISCOGS_TOKEN')
 
+        self.discogs_token = user_token
+
         if not user_token:
 
             print("ATTENTION : DISCOGS_TOKEN manquant dans le .env")
 
         self.discogs = discogs_client.Client('KissaApp/1.0', user_token=user_token)
 
+        # Ordonnanceur devant l'API (seau à jetons, priorités, regroupement des GET identiques),
+        # puis session poolée (keep-alive, réessais) ; chaque requête HTTP est chronométrée et comptée (/metrics)
+        self.discogs_scheduler = DiscogsScheduler(
+            self._discogs_bucket(authenticated=bool(user_token)),
+            coalesce=os.getenv('KISSA_DISCOGS_COALESCE', '1') == '1',
+        )
+
+        self.discogs._fetcher = ScheduledFetcher(
+            InstrumentedFetcher(SessionFetcher(self.transports["discogs"].session(), user_token)),
+            self.discogs_scheduler,
+        )
+
+        # Hydratation en une seule requête des releases (évite les refresh paresseux de discogs_client)
+        self.release_hydrator = ReleaseHydrator(self.discogs)
+
+        # Mode "local_first" : recherche, releases et masters lus d'abord dans la copie locale
+        # du catalogue (dumps XML, cf. discogs_mirror.py), l'API n'est appelée qu'en cas d'absence
+        self.discogs_mirror = None
+
+        if os.getenv('KISSA_DISCOGS_BACKEND', 'live') == 'local_first':
+
+            self.discogs_mirror = DiscogsMirror.open(
+                os.getenv('KISSA_DISCOGS_MIRROR_PATH', os.path.join('.kissa_cache', 'discogs_mirror.sqlite3'))
+            )
+
         
 
         # 3. Setup Spotify
@@ -93,9 +188,18 @@ class KissaCore:
 
         if client_id and client_secret:
 
-            auth_manager = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret)
+            # Jetons et appels API sur les sessions poolées du transport Spotify (réessais gérés par le transport)
+            auth_manager = SpotifyClientCredentials(
+                client_id=client_id,
+                client_secret=client_secret,
+                requests_session=self.transports["spotify"].session(),
+            )
 
-            self.sp = spotipy.Spotify(auth_manager=auth_manager)
+            self.sp = spotipy.Spotify(
+                auth_manager=auth_manager,
+                requests_session=self.transports["spotify"].session(),
+                requests_timeout=float(os.getenv('KISSA_HTTP_TIMEOUT', 15)),
+            )
 
         else:
 
@@ -103,6 +207,109 @@ class KissaCore:
 
             self.sp = None
 
+        # 4. Cache des métadonnées Discogs (persistant, survit aux redémarrages)
+        # Clés : "release:<discogs_id>" et "query:<requête normalisée>"
+        cache_path = os.getenv('KISSA_CACHE_PATH', os.path.join('.kissa_cache', 'metadata.sqlite3'))
+        self.metadata_cache = PersistentCache(
+            cache_path,
+            table="discogs_metadata",
+            ttl=int(os.getenv('KISSA_CACHE_TTL', 7 * 24 * 3600)),
+            max_entries=int(os.getenv('KISSA_CACHE_MAX_ENTRIES', 5000)),
+        )
+
+        # 4 bis. Cache OCR : texte détecté, indexé par le hash des octets et un hash perceptuel
+        # (une nouvelle photo de la même pochette ne repasse pas par Google Vision)
+        self.ocr_cache = OcrCache(
+            PersistentCache(
+                cache_path,
+                table="ocr_text",
+                ttl=int(os.getenv('KISSA_OCR_CACHE_TTL', 30 * 24 * 3600)),
+                max_entries=int(os.getenv('KISSA_OCR_CACHE_MAX_ENTRIES', 2000)),
+            ),
+            max_distance=int(os.getenv('KISSA_OCR_PHASH_DISTANCE', 2)),
+            near_duplicates=os.getenv('KISSA_OCR_NEAR_DUPLICATES', '0') == '1',
+        )
+
+        # 4 bis bis. Cache court des recherches de candidats (saisie au fil de l'eau)
+        self.candidate_cache = CandidateCache(
+            ttl=int(os.getenv('KISSA_CANDIDATE_CACHE_TTL', 120)),
+            max_entries=int(os.getenv('KISSA_CANDIDATE_CACHE_MAX_ENTRIES', 512)),
+        )
+
+        # 4 bis ter. Choix de la release pour un texte OCR : quelques requêtes ciblées, hits notés localement
+        self.ocr_matcher = OcrMatcher(
+            max_queries=int(os.getenv('KISSA_MATCH_MAX_QUERIES', 3)),
+            per_query=int(os.getenv('KISSA_MATCH_HITS_PER_QUERY', 5)),
+            accept=float(os.getenv('KISSA_MATCH_ACCEPT', 0.8)),
+            min_confidence=float(os.getenv('KISSA_MATCH_MIN_CONFIDENCE', 0.34)),
+        )
+
+        # 4 bis quater. Texte OCR -> requête courte (mentions légales retirées, code-barres / catalogue à part)
+        self.ocr_normalizer = OcrNormalizer(max_tokens=int(os.getenv('KISSA_OCR_QUERY_MAX_TOKENS', 8)))
+
+        # 4 bis quinquies. Mode OCR : "layout" (blocs Vision pondérés par taille et position) ou "flat"
+        # (texte brut de la première annotation, ordre de lecture)
+        self.ocr_mode = os.getenv('KISSA_OCR_MODE', 'layout')
+        self.ocr_layout = OcrLayout(
+            key_ratio=float(os.getenv('KISSA_OCR_LAYOUT_KEY_RATIO', 0.5)),
+            position_weight=float(os.getenv('KISSA_OCR_LAYOUT_POSITION_WEIGHT', 0.5)),
+        )
+
+        # 4 ter. Prétraitement des photos avant Vision (orientation EXIF, redimensionnement, JPEG)
+        self.image_preprocessor = ImagePreprocessor(
+            max_edge=int(os.getenv('KISSA_OCR_MAX_EDGE', 1600)),
+            quality=int(os.getenv('KISSA_OCR_JPEG_QUALITY', 85)),
+            min_bytes=int(os.getenv('KISSA_OCR_PREPROCESS_MIN_BYTES', 300_000)),
+            enabled=os.getenv('KISSA_OCR_PREPROCESS', '1') == '1',
+        )
+
+        # 4 quater. Scan par lots : taille des lots Vision et résolutions Discogs/Spotify simultanées
+        self.vision_batch_size = min(int(os.getenv('KISSA_VISION_BATCH_SIZE', VISION_BATCH_LIMIT)), VISION_BATCH_LIMIT)
+        self.batch_concurrency = int(os.getenv('KISSA_BATCH_CONCURRENCY', 4))
+
+        # 5. Pipeline parallèle : dès que le hit de recherche donne artiste + titre,
+        # la recherche Spotify et l'hydratation de la release Discogs partent en même temps
+        self.parallel_pipeline = os.getenv('KISSA_PARALLEL_PIPELINE', '1') == '1'
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('KISSA_PIPELINE_WORKERS', 4)),
+            thread_name_prefix="kissa-pipeline",
+        )
+
+
+
+    def _discogs_bucket(self, authenticated):
+
+        """
+        Seau à jetons Discogs (KISSA_DISCOGS_BUCKET : memory, file ou redis).
+
+        Discogs compte les requêtes sur une fenêtre glissante d'une minute (60 authentifié, 25 sinon) :
+        la rafale de `burst` jetons est retranchée du débit, pour ne jamais dépasser la limite sur 60 s.
+        """
+
+        limit = int(os.getenv('KISSA_DISCOGS_RATE_LIMIT', 60 if authenticated else 25))
+
+        burst = int(os.getenv('KISSA_DISCOGS_BURST', 5))
+
+        rate = max(limit - burst, 1) / 60
+
+        backend = os.getenv('KISSA_DISCOGS_BUCKET', 'memory')
+
+        if backend == 'redis' and os.getenv('REDIS_URL'):
+
+            return RedisTokenBucket(rate, burst, os.getenv('REDIS_URL'))
+
+        if backend == 'file':
+
+            return FileTokenBucket(
+                rate, burst, os.getenv('KISSA_DISCOGS_BUCKET_PATH', os.path.join('.kissa_cache', 'discogs_bucket.json'))
+            )
+
+        if backend != 'memory':
+
+            print(f"ATTENTION : seau à jetons Discogs '{backend}' non disponible, seau en mémoire (un seul worker)")
+
+        return TokenBucket(rate, burst)
+
 
 
     def _clean_text(self, text):
@@ -113,643 +320,905 @@ class KissaCore:
 
 
 
-    def step_1_ocr(self, image_path):
+    def _normalize_query(self, query):
+        """Normalise une requête pour la clé de cache (casse et espaces)"""
+        return " ".join(query.lower().split())
 
-        """Lit le texte sur la pochette (Google Vision)"""
 
-        if not self.vision_client:
-            print("ATTENTION : OCR non disponible : Google Vision credentials manquants")
-            return None
 
-        print(f"Analyse visuelle de {image_path}...")
+    def _format_discogs_data(self, album):
 
-        try:
+        """Formate un ReleaseRecord pour le pipeline scan / recherche manuelle"""
 
-            with open(image_path, "rb") as image_file:
+        return {
+            "discogs_id": album.discogs_id,
+            "artist": album.artist_name or "Artiste Inconnu",
+            "album_title": album.title,
+            "year": str(album.year) if album.year else "Année inconnue",
+            "label": album.label_name or "Label Inconnu",
+            "genre": list(album.genres),
+            # Tracklist filtrée pour éviter les titres de faces (ex: "Side A")
+            "tracklist": album.clean_tracklist,
+            "discogs_url": album.url,
+            "discogs_image": album.cover_url
+        }
 
-                content = image_file.read()
 
-            image = vision.Image(content=content)
 
-            response = self.vision_client.text_detection(image=image)
-            
-            # Vérification des erreurs de l'API
-            if response.error.message:
-                print(f"ERREUR Google Vision : {response.error.message}")
-                return None
+    def _format_spotify_album(self, spotify_album):
 
-            texts = response.text_annotations
+        """Extrait lien, URI et cover HD d'un album Spotify (réponse brute de /search)"""
 
-            if texts:
+        # Spotify classe les images par taille, index 0 = la plus grande (640x640)
+        hd_cover = spotify_album['images'][0]['url'] if spotify_album['images'] else None
 
-                raw_text = texts[0].description
+        return {
+            "spotify_link": spotify_album['external_urls']['spotify'],
+            "spotify_uri": spotify_album['uri'],
+            "cover_hd": hd_cover
+        }
 
-                clean_query = self._clean_text(raw_text)
 
-                print(f"Texte détecté : {clean_query}")
 
-                return clean_query
+    def _merge_spotify(self, default_cover, spotify_data):
 
-            else:
+        """Renvoie (cover, spotify_link, spotify_uri) : on préfère l'image Spotify (souvent plus propre/carrée)"""
 
-                return None
+        if not spotify_data:
+            return default_cover, None, None
 
-        except Exception as e:
+        final_cover = spotify_data['cover_hd'] or default_cover
 
-            print(f"ERREUR OCR : {e}")
+        return final_cover, spotify_data['spotify_link'], spotify_data['spotify_uri']
+
+
+
+    def _build_final_record(self, discogs_data, spotify_data, original_photo=None):
+
+        """Structure optimisée pour le Frontend React (scan et recherche manuelle)"""
+
+        final_cover, spotify_link, spotify_uri = self._merge_spotify(discogs_data['discogs_image'], spotify_data)
+
+        return {
+            "status": "success",
+            "display": {
+                "artist": discogs_data['artist'],
+                "title": discogs_data['album_title'],
+                "cover_image": final_cover, # L'image officielle propre
+                "original_photo": original_photo # On garde la trace locale si besoin
+            },
+            "details": {
+                "year": discogs_data['year'],
+                "label": discogs_data['label'],
+                "genre": discogs_data['genre'],
+                "tracklist": discogs_data['tracklist'],
+                "discogs_id": discogs_data.get('discogs_id'),
+                "match_confidence": discogs_data.get('match_confidence')
+            },
+            "links": {
+                "spotify_url": spotify_link,
+                "spotify_uri": spotify_uri,
+                "discogs_url": discogs_data['discogs_url']
+            }
+        }
+
+
+
+    def _format_release_record(self, album, spotify_data):
+
+        """Objet final pour un ajout par ID Discogs (sélection utilisateur)"""
+
+        final_cover, spotify_link, spotify_uri = self._merge_spotify(album.cover_url, spotify_data)
 
+        return {
+            "status": "success",
+            "display": {
+                "artist": album.artist_name or "Inconnu",
+                "title": album.title,
+                "cover_image": final_cover,
+            },
+            "details": {
+                "year": str(album.year) if album.year else "",
+                "label": album.label_name or "",
+                "genre": list(album.genres),
+                "tracklist": album.clean_tracklist,
+                "discogs_id": album.discogs_id
+            },
+            "links": {
+                "spotify_url": spotify_link,
+                "spotify_uri": spotify_uri,
+                "discogs_url": album.url
+            }
+        }
+
+
+
+    def _text_from_vision_response(self, response):
+
+        """Extrait la requête de recherche d'une réponse Google Vision (None si rien de lisible)"""
+
+        # Vérification des erreurs de l'API
+        if response.error.message:
+            print(f"ERREUR Google Vision : {response.error.message}")
             return None
 
+        # Mode "layout" : le plus gros texte (artiste, titre) en tête, les petites mentions ensuite
+        if self.ocr_mode == 'layout':
 
+            layout_text = self.ocr_layout.text(response.full_text_annotation)
 
-    def step_2_discogs(self, query):
+            if layout_text:
 
-        """Récupère les métadonnées (Discogs)"""
+                clean_query = self._clean_text(layout_text)
 
-        print("Recherche Discogs...")
+                print(f"Texte détecté (mise en page) : {clean_query}")
 
-        try:
+                return clean_query
 
-            results = self.discogs.search(query, type='release')
+        texts = response.text_annotations
 
-            
+        if not texts:
+            return None
 
-            if not results:
+        clean_query = self._clean_text(texts[0].description)
 
-                return None
+        print(f"Texte détecté : {clean_query}")
 
-            
+        return clean_query
 
-            # On prend le premier résultat pertinent
 
-            album = results[0]
 
-            
+    def _run_parallel(self, timings, *calls):
 
-            # Sécurisation des champs (au cas où il manque une info)
+        """Exécute des appels (nom, fonction, args...) en parallèle dans le pool et renvoie leurs résultats"""
 
-            if album.artists:
+        # Chaque appel garde le contexte de l'appelant (priorité Discogs d'un scan par lots, cf. discogs_scheduler)
+        futures = [
+            self._executor.submit(contextvars.copy_context().run, timed_call, timings, name, func, *args)
+            for name, func, *args in calls
+        ]
 
-                # On joint tous les noms trouvés (ex: "Floating Points, Pharoah Sanders, LSO")
+        return [future.result() for future in futures]
 
-                artist_name = ", ".join([artist.name for artist in album.artists])
 
-            else:
 
-                artist_name = "Artiste Inconnu"
+    def _discogs_and_spotify(self, query, timings=None, normalized=None, typed=False):
 
-            label_name = album.labels[0].name if album.labels else "Label Inconnu"
+        """
+        Résout une requête texte en (discogs_data, spotify_data).
 
-            cover_url = album.images[0]['uri'] if album.images else None
+        Le hit de recherche Discogs contient déjà "Artiste - Album" : on lance alors
+        la recherche Spotify en même temps que l'hydratation de la release complète.
+        Renvoie (None, None) si Discogs ne trouve rien. `normalized` : texte déjà passé
+        par ocr_normalizer (scan par lots), sinon il est normalisé ici. `typed` : requête
+        saisie par l'utilisateur (jamais rejetée pour confiance trop faible, cf. OcrMatcher).
+        """
 
-            
+        spotify_future = None
 
-            # On filtre la tracklist pour éviter les titres de faces (ex: "Side A")
+        def start_spotify(artist, album):
 
-            clean_tracklist = [t.title for t in album.tracklist if t.position]
+            # Spotify part dans le pool pendant que ce thread hydrate la release
+            nonlocal spotify_future
 
+            spotify_future = self._executor.submit(
+                contextvars.copy_context().run, timed_call, timings, "spotify", self.step_3_spotify, artist, album
+            )
 
+        discogs_data = self.step_2_discogs(
+            query, timings, normalized, typed, on_hit=start_spotify if self.parallel_pipeline else None
+        )
 
-            return {
+        if not discogs_data:
+            return None, None
 
-                "artist": artist_name,
+        if spotify_future:
+            return discogs_data, spotify_future.result()
 
-                "album_title": album.title,
+        # Mode séquentiel (ou résultat en cache) : Spotify attend les infos précises de la release
+        spotify_data = timed_call(timings, "spotify", self.step_3_spotify, discogs_data['artist'], discogs_data['album_title'])
 
-                "year": str(album.year) if album.year else "Année inconnue",
+        return discogs_data, spotify_data
 
-                "label": label_name,
 
-                "genre": album.genres,
 
-                "tracklist": clean_tracklist,
+    def _ocr_cache_lookup(self, content):
 
-                "discogs_url": album.url,
+        """Renvoie (empreinte, texte en cache ou None) pour les octets d'une image"""
 
-                "discogs_image": cover_url
+        fingerprint = self.ocr_cache.fingerprint(content)
 
-            }
+        cached_text = self.ocr_cache.lookup(fingerprint)
 
-        except Exception as e:
+        if cached_text:
+            print(f"OCR : texte servi depuis le cache : {cached_text}")
 
-            print(f"ERREUR Discogs: {e}")
+        return fingerprint, cached_text
 
-            return None
 
 
+    def step_1_ocr(self, image_path):
 
-    def step_3_spotify(self, artist, album_title):
+        """Lit le texte sur la pochette à partir d'un fichier (enveloppe de step_1_ocr_bytes)"""
 
-        """Récupère le lien audio et la cover HD (Spotify)"""
+        print(f"Analyse visuelle de {image_path}...")
 
-        if not self.sp:
+        try:
+
+            with open(image_path, "rb") as image_file:
+
+                content = image_file.read()
+
+        except Exception as e:
+
+            print(f"ERREUR OCR : {e}")
 
             return None
 
-            
+        return self.step_1_ocr_bytes(content)
 
-        print("Recherche Spotify...")
 
-        q = f"artist:{artist} album:{album_title}"
 
-        
+    def _preprocess_image(self, content, timings=None):
 
-        try:
+        """Réduit l'image avant Vision et trace les octets économisés (étape "preprocess")"""
 
-            results = self.sp.search(q=q, type='album', limit=1)
+        with stage(timings, "preprocess"):
+            prepared, report = self.image_preprocessor.prepare(content)
 
-            items = results['albums']['items']
+        if report["bytes_saved"]:
+            print(
+                f"Image : {report['original_bytes'] // 1024} Ko -> {report['sent_bytes'] // 1024} Ko "
+                f"({report['bytes_saved'] // 1024} Ko économisés en {report['preprocess_ms']} ms)"
+            )
 
-            
+        return prepared
 
-            if items:
 
-                spotify_album = items[0]
 
-                # Spotify classe les images par taille, index 0 = la plus grande (640x640)
+    @instrumented("step_1_ocr")
+    def step_1_ocr_bytes(self, content, timings=None):
 
-                hd_cover = spotify_album['images'][0]['url'] if spotify_album['images'] else None
+        """
+        Lit le texte sur la pochette directement depuis les octets de l'image (bytes ou memoryview).
 
-                
+        Google Vision, sauf si l'image est déjà dans le cache OCR. Aucun fichier intermédiaire.
+        L'image est réduite (cf. ImagePreprocessor) avant l'envoi.
+        """
 
-                return {
+        try:
 
-                    "spotify_link": spotify_album['external_urls']['spotify'],
+            content = _as_bytes(content)
 
-                    "spotify_uri": spotify_album['uri'],
+            fingerprint, cached_text = self._ocr_cache_lookup(content)
 
-                    "cover_hd": hd_cover
+            if cached_text:
+                return cached_text
 
-                }
+            if not self.vision_client:
+                print("ATTENTION : OCR non disponible : Google Vision credentials manquants")
+                return None
 
-            return None
+            image = vision.Image(content=self._preprocess_image(content, timings))
+
+            with upstream_call("vision", "text_detection"):
+                response = self.vision_client.text_detection(image=image)
+
+            detected_text = self._text_from_vision_response(response)
+
+            if detected_text:
+                self.ocr_cache.store_text(fingerprint, detected_text)
+
+            return detected_text
 
         except Exception as e:
 
-            print(f"ATTENTION : Erreur Spotify (non bloquant) : {e}")
+            record_error("step_1_ocr")
+
+            print(f"ERREUR OCR : {e}")
 
             return None
 
 
 
-    def process(self, image_path):
+    def _vision_request(self, content):
 
-        """Orchestre tout le processus et formate pour le Frontend"""
+        """Requête Vision (détection de texte) pour une image déjà prétraitée"""
 
-        
+        return vision.AnnotateImageRequest(
+            image=vision.Image(content=content),
+            features=[vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)],
+        )
 
-        # 1. VISION
 
-        detected_text = self.step_1_ocr(image_path)
 
-        if not detected_text:
+    def _batch_chunks(self, items):
 
-            return {"status": "error", "message": "Texte illisible sur la photo."}
+        """Découpe une liste en lots de vision_batch_size éléments"""
 
-            
+        return [items[i:i + self.vision_batch_size] for i in range(0, len(items), self.vision_batch_size)]
 
-        # 2. DATA
 
-        discogs_data = self.step_2_discogs(detected_text)
 
-        if not discogs_data:
+    @instrumented("step_1_ocr_batch")
+    def step_1_ocr_batch(self, contents, timings=None):
 
-            return {"status": "error", "message": "Album introuvable sur Discogs avec ce texte."}
+        """
+        OCR de plusieurs images : un seul appel batch_annotate_images par lot de 16.
 
-            
+        Les images déjà connues du cache OCR ne sont pas envoyées. Renvoie la liste
+        des textes détectés (None si illisible), dans l'ordre des images.
+        """
 
-        # 3. AUDIO & VISUAL
+        texts = [None] * len(contents)
 
-        spotify_data = self.step_3_spotify(discogs_data['artist'], discogs_data['album_title'])
+        pending = []
 
-        
+        for index, content in enumerate(contents):
+            content = _as_bytes(content)
+            fingerprint, cached_text = self._ocr_cache_lookup(content)
+            if cached_text:
+                texts[index] = cached_text
+            else:
+                pending.append((index, content, fingerprint))
 
-        # 4. CONSTRUCTION DE L'OBJET FINAL
+        if pending and not self.vision_client:
+            print("ATTENTION : OCR non disponible : Google Vision credentials manquants")
+            return texts
 
-        # Logique : On préfère l'image Spotify (souvent plus propre/carrée), sinon Discogs
+        for chunk in self._batch_chunks(pending):
+            print(f"Analyse visuelle par lot de {len(chunk)} images...")
+            try:
+                requests = [self._vision_request(self._preprocess_image(content)) for _, content, _ in chunk]
+                with upstream_call("vision", "batch_annotate"):
+                    batch = self.vision_client.batch_annotate_images(requests=requests)
+            except Exception as e:
+                record_error("step_1_ocr_batch")
+                print(f"ERREUR OCR (lot) : {e}")
+                continue
 
-        final_cover = discogs_data['discogs_image']
+            for (index, _, fingerprint), response in zip(chunk, batch.responses):
+                detected_text = self._text_from_vision_response(response)
+                texts[index] = detected_text
+                if detected_text:
+                    self.ocr_cache.store_text(fingerprint, detected_text)
 
-        spotify_link = None
+        return texts
 
-        spotify_uri = None
 
-        
 
-        if spotify_data:
+    @instrumented("step_2_discogs")
+    def step_2_discogs(self, query, timings=None, normalized=None, typed=False, on_hit=None):
 
-            spotify_link = spotify_data['spotify_link']
+        """
+        Récupère les métadonnées (Discogs) : de la recherche à la release hydratée, ou None.
 
-            spotify_uri = spotify_data['spotify_uri']
+        `on_hit(artiste, album)` est appelé dès que le hit de recherche est choisi, avant l'hydratation
+        (ex : lancer Spotify en parallèle) ; pas d'appel pour un résultat servi depuis le cache.
+        """
 
-            if spotify_data['cover_hd']:
+        cache_key = self._query_cache_key(query)
+        cached = self.metadata_cache.get(cache_key)
 
-                final_cover = spotify_data['cover_hd']
+        if cached:
+            print("Discogs : résultat servi depuis le cache")
+            return cached
 
+        print("Recherche Discogs...")
 
+        try:
 
-        # Structure optimisée pour ton Frontend React
+            with stage(timings, "discogs_search"):
+                hit, confidence = self._match_release(query, normalized, typed)
 
-        final_record = {
+            if not hit:
+                return None
 
-            "status": "success",
+            hit_artist, hit_album = split_search_title(hit.get('title', ''))
 
-            "display": {
+            if on_hit and hit_artist:
+                on_hit(hit_artist, hit_album)
 
-                "artist": discogs_data['artist'],
+            # On hydrate la release retenue en une seule requête (tous les champs deviennent des accès locaux)
+            album = timed_call(timings, "discogs_release", self._fetch_release, hit['id'])
 
-                "title": discogs_data['album_title'],
+            discogs_data = dict(self._format_discogs_data(album), match_confidence=confidence)
 
-                "cover_image": final_cover, # L'image officielle propre
+            self.metadata_cache.set(cache_key, discogs_data)
 
-                "original_photo": image_path # On garde la trace locale si besoin
+            return discogs_data
 
-            },
+        except Exception as e:
 
-            "details": {
+            record_error("step_2_discogs")
 
-                "year": discogs_data['year'],
+            print(f"ERREUR Discogs: {e}")
 
-                "label": discogs_data['label'],
+            return None
 
-                "genre": discogs_data['genre'],
 
-                "tracklist": discogs_data['tracklist']
 
-            },
+    @instrumented("step_3_spotify")
+    def step_3_spotify(self, artist, album_title):
 
-            "links": {
+        """Récupère le lien audio et la cover HD (Spotify)"""
 
-                "spotify_url": spotify_link,
+        if not self.sp:
 
-                "spotify_uri": spotify_uri,
+            return None
 
-                "discogs_url": discogs_data['discogs_url']
+            
 
-            }
+        print("Recherche Spotify...")
 
-        }
+        q = f"artist:{artist} album:{album_title}"
 
         
 
-        return final_record
+        try:
 
+            with upstream_call("spotify", "search"):
+                results = self.sp.search(q=q, type='album', limit=1)
 
+            items = results['albums']['items']
 
-    def search_by_text(self, text_query):
+            
 
-        """Recherche manuelle sans image (texte -> Discogs -> Spotify)"""
+            if items:
 
-        print(f"Recherche manuelle pour : {text_query}")
+                return self._format_spotify_album(items[0])
 
-        
+            return None
 
-        # 1. Discogs (Directement avec le texte utilisateur)
+        except Exception as e:
 
-        discogs_data = self.step_2_discogs(text_query)
+            record_error("step_3_spotify")
 
-        if not discogs_data:
+            print(f"ATTENTION : Erreur Spotify (non bloquant) : {e}")
 
-            return {"status": "error", "message": "Album introuvable sur Discogs."}
+            return None
 
-            
 
-        # 2. Spotify
 
-        spotify_data = self.step_3_spotify(discogs_data['artist'], discogs_data['album_title'])
+    def process(self, image_path, timings=None):
 
-        
+        """Orchestre tout le processus à partir d'un fichier image (enveloppe de process_bytes)"""
 
-        # 3. Construction objet final (Idem process classique)
+        try:
 
-        final_cover = discogs_data['discogs_image']
+            with open(image_path, "rb") as image_file:
 
-        spotify_link = None
+                content = image_file.read()
 
-        spotify_uri = None
+        except OSError as e:
 
-        
+            print(f"ERREUR OCR : {e}")
 
-        if spotify_data:
+            return {"status": "error", "message": "Texte illisible sur la photo."}
 
-            spotify_link = spotify_data['spotify_link']
+        return self.process_bytes(content, timings=timings, original_photo=image_path)
 
-            spotify_uri = spotify_data['spotify_uri']
 
-            if spotify_data['cover_hd']:
 
-                final_cover = spotify_data['cover_hd']
+    def process_bytes(self, content, timings=None, original_photo=None):
 
-        return {
+        """
+        Orchestre tout le processus à partir des octets de l'image et formate pour le Frontend.
 
-            "status": "success",
+        `content` peut être un bytes ou une memoryview (buffer d'upload) : il part tel quel
+        vers Vision, sans fichier temporaire. Si `timings` est un dict, il est rempli avec
+        la durée (ms) de chaque étape.
+        """
 
-            "display": {
 
-                "artist": discogs_data['artist'],
 
-                "title": discogs_data['album_title'],
+        # 1. VISION
 
-                "cover_image": final_cover,
+        with stage(timings, "ocr"):
 
-                "original_photo": None # Pas de photo en mode manuel
+            detected_text = self.step_1_ocr_bytes(content, timings)
 
-            },
+        if not detected_text:
 
-            "details": {
+            return {"status": "error", "message": "Texte illisible sur la photo."}
 
-                "year": discogs_data['year'],
+            
 
-                "label": discogs_data['label'],
+        # 2. DATA + 3. AUDIO & VISUAL (en parallèle si possible)
 
-                "genre": discogs_data['genre'],
+        discogs_data, spotify_data = self._discogs_and_spotify(detected_text, timings)
 
-                "tracklist": discogs_data['tracklist']
+        if not discogs_data:
 
-            },
+            return {"status": "error", "message": "Album introuvable sur Discogs avec ce texte."}
 
-            "links": {
 
-                "spotify_url": spotify_link,
 
-                "spotify_uri": spotify_uri,
+        # 4. CONSTRUCTION DE L'OBJET FINAL
 
-                "discogs_url": discogs_data['discogs_url']
+        final_record = self._build_final_record(discogs_data, spotify_data, original_photo=original_photo)
 
-            }
+        return final_record
 
-        }
+
+
+    def process_batch(self, contents, filenames=None, timings=None, max_concurrency=None):
+
+        """
+        Traite un lot d'images (ex : une caisse entière de vinyles).
+
+        OCR groupé via step_1_ocr_batch, puis résolution Discogs/Spotify de chaque texte
+        avec au plus `max_concurrency` résolutions simultanées. Renvoie un résultat par
+        image, dans l'ordre (même format que process, ou un objet d'erreur).
+        """
+
+        filenames = filenames or [None] * len(contents)
+
+        with stage(timings, "ocr"):
+            texts = self.step_1_ocr_batch(contents, timings)
+
+        # Normalisation de tous les textes du lot en une passe
+        with stage(timings, "normalize"):
+            normalized = self.ocr_normalizer.normalize_batch(texts)
+
+        def resolve(index):
+            # Scan par lots : les appels Discogs passent après la recherche interactive
+            with discogs_priority(BATCH):
+                return self._resolve_batch_item(texts[index], filenames[index], normalized[index])
+
+        # Pool dédié : _discogs_and_spotify utilise déjà self._executor pour ses appels parallèles
+        with stage(timings, "resolve"):
+            with ThreadPoolExecutor(max_workers=max_concurrency or self.batch_concurrency) as pool:
+                return list(pool.map(resolve, range(len(contents))))
 
 
 
-    def search_candidates(self, query):
+    def _resolve_batch_item(self, detected_text, filename, normalized=None):
 
-        """Recherche 'Google Style' : Tolérante et robuste"""
+        """Discogs + Spotify pour une image d'un lot (même format que process)"""
+
+        if not detected_text:
+            return {"status": "error", "message": "Texte illisible sur la photo.", "filename": filename}
+
+        discogs_data, spotify_data = self._discogs_and_spotify(detected_text, normalized=normalized)
+
+        if not discogs_data:
+            return {"status": "error", "message": "Album introuvable sur Discogs avec ce texte.", "filename": filename}
+
+        return self._build_final_record(discogs_data, spotify_data, original_photo=filename)
 
-        print(f"Recherche robuste pour : {query}")
+
+
+    def search_by_text(self, text_query, timings=None):
+
+        """Recherche manuelle sans image (texte -> Discogs -> Spotify)"""
+
+        print(f"Recherche manuelle pour : {text_query}")
 
         
 
-        try:
+        # 1. Discogs (Directement avec le texte utilisateur) + 2. Spotify
 
-            # 1. Recherche large sur Discogs
+        discogs_data, spotify_data = self._discogs_and_spotify(text_query, timings, typed=True)
 
-            # On demande explicitement les types 'release' et 'master' pour éviter
+        if not discogs_data:
 
-            # de récupérer trop d'artistes ou de labels qui polluent, 
+            return {"status": "error", "message": "Album introuvable sur Discogs."}
 
-            # mais on reste assez large pour trouver les albums par nom d'artiste.
 
-            results = self.discogs.search(query, type='release')
 
-            # Note: Si on met type='all', Discogs renvoie l'artiste en premier.
+        # 3. Construction objet final (Idem process classique, pas de photo en mode manuel)
 
-            # En mettant type='release', si tu tapes "Apparat", Discogs renvoie les albums d'Apparat.
+        return self._build_final_record(discogs_data, spotify_data, original_photo=None)
 
-            # Si cela ne suffit pas, on peut retirer le paramètre type, mais il faudra filtrer plus bas.
 
-            
 
-            # TEST : On essaie sans filtre de type pour voir tout, et on triera nous-mêmes
+    def _search_page(self, query, per_page, **fields):
 
-            results = self.discogs.search(query)
+        """Première page brute de /database/search (une seule requête, aucun objet paresseux)"""
 
-            candidates = []
+        local = self._mirror_search(query, per_page, **fields)
 
-            count = 0
+        if local:
+            return local
 
-            total_items = 0
+        params = dict(fields, q=query, page=1, per_page=per_page)
 
-            
+        url = update_qs(f"{self.discogs._base_url}/database/search", params)
 
-            # On itère sur les résultats
+        return self.discogs._get(url).get('results', [])
 
-            for item in results:
 
-                total_items += 1
 
-                if count >= 10:
+    def _match_release(self, text, normalized=None, typed=False):
 
-                    break
+        """
+        Release Discogs la plus proche d'un texte (OCR ou saisi) : (hit, confiance) ou (None, confiance).
 
-                # --- 1. FILTRAGE INTELLIGENT ---
+        Le choix (recherches, notes, seuils) est dans ocr_matcher.ReleaseMatch ; ici, seulement les recherches.
+        """
 
-                # On vérifie si c'est un album (Master/Release) en testant la présence d'attributs clés
+        match = self._release_match(text, normalized, typed)
 
-                # Les Artist/Label n'ont généralement pas de 'title' ou 'artists' comme les albums
+        for query, fields in match:
 
-                # On utilise une approche permissive : si ça ressemble à un album, on le prend
+            match.add(fields, self._search_page(query, per_page=self.ocr_matcher.per_query, type='release', **fields))
 
-                
+        return match.result()
 
-                # Vérification : si l'objet n'a pas de titre, on le saute
 
-                # (les Artist/Label n'ont généralement pas de title, mais les albums oui)
 
-                if not hasattr(item, 'title') or not item.title:
+    def _release_match(self, text, normalized=None, typed=False):
 
-                    continue
+        """Choix de release pour un texte (normalisé ici s'il ne l'a pas été avec son lot), partagé avec AsyncKissaCore"""
 
-                # --- 2. EXTRACTION SÉCURISÉE (Airbag) ---
+        return self.ocr_matcher.match(text, normalized or self.ocr_normalizer.normalize(text), typed=typed)
 
-                try:
 
-                    # Titre
 
-                    title = item.title # Souvent "Artist - Album"
+    def _query_cache_key(self, query):
 
-                    
+        """Clé du cache des métadonnées pour une requête texte"""
 
-                    # Artiste (Extraction propre)
+        return f"query:{self._normalize_query(query)}"
 
-                    artist = "Artiste Divers"
 
-                    if hasattr(item, 'artists') and item.artists:
 
-                        artist = item.artists[0].name
+    def _id_cache_key(self, discogs_id, entity_type="release"):
 
-                    
+        """Clé du cache des métadonnées pour un ajout par ID (release ou master)"""
 
-                    # Si le titre contient déjà l'artiste (format Discogs classique "Artist - Title")
+        return f"master:{discogs_id}" if entity_type == "master" else f"release:{discogs_id}"
 
-                    # On peut nettoyer pour l'affichage si besoin, mais gardons brut pour l'instant
 
-                    
 
-                    # Année
+    def _mirror_search(self, query, per_page, **fields):
 
-                    year = ""
+        """Page de recherche servie par la copie locale (mode local_first), ou None si absente"""
 
-                    if hasattr(item, 'year'):
+        # Les codes-barres ne sont pas dans la copie locale : recherche directe sur l'API
+        if not self.discogs_mirror or fields.get('barcode'):
+            return None
 
-                        year = str(item.year)
+        with upstream_call("discogs_mirror", "search") as call:
+            results = self.discogs_mirror.search(query, per_page=per_page, type=fields.get('type'), catno=fields.get('catno'))
+            call["outcome"] = "hit" if results else "miss"
 
-                    
+        return results
 
-                    # Label
 
-                    label = ""
 
-                    if hasattr(item, 'labels') and item.labels:
+    def _mirror_release(self, release_id):
 
-                        label = item.labels[0].name
+        """ReleaseRecord lu dans la copie locale (mode local_first), ou None si absente"""
 
-                        
+        if not self.discogs_mirror:
+            return None
 
-                    # Image (Thumb) - Gère tous les cas de figure
+        with upstream_call("discogs_mirror", "release") as call:
+            data = self.discogs_mirror.release(release_id)
+            call["outcome"] = "hit" if data else "miss"
 
-                    thumb = ""
+        return ReleaseRecord.from_json(data, http_calls=0) if data else None
 
-                    if hasattr(item, 'thumb'):
 
-                        thumb = item.thumb
 
-                    elif hasattr(item, 'images') and item.images:
+    def _mirror_main_release(self, master_id):
 
-                        thumb = item.images[0].get('uri', '')
+        """Release principale d'un master d'après la copie locale, ou None"""
 
-                    
+        if not self.discogs_mirror:
+            return None
 
-                    # ID
+        with upstream_call("discogs_mirror", "master") as call:
+            release_id = self.discogs_mirror.main_release(master_id)
+            call["outcome"] = "hit" if release_id else "miss"
 
-                    discogs_id = item.id
+        return release_id
 
-                    candidates.append({
 
-                        "discogs_id": discogs_id,
 
-                        "title": title,
+    def _fetch_release(self, release_id):
 
-                        "artist": artist,
+        """Release complète : copie locale d'abord, sinon une requête /releases/{id}"""
 
-                        "year": year,
+        return self._mirror_release(release_id) or self.release_hydrator.fetch(release_id)
 
-                        "label": label,
 
-                        "thumb": thumb
 
-                    })
+    def _main_release(self, master_id):
 
-                    count += 1
+        """ID de la release principale d'un master : copie locale d'abord, sinon /masters/{id}"""
 
-                    
+        local = self._mirror_main_release(master_id)
 
-                except Exception as item_error:
+        if local:
+            return local
 
-                    # Si UN élément est mal formé, on l'affiche dans la console mais on ne plante pas la liste
+        return self.discogs._get(f"{self.discogs._base_url}/masters/{master_id}")["main_release"]
 
-                    print(f"ATTENTION : Element ignore (Erreur de donnee) : {item_error}")
 
-                    continue
 
-            print(f"SUCCES : {len(candidates)} resultats trouves sur {total_items} elements examines pour '{query}'")
+    def _candidates_from_page(self, page, search_type, query):
 
-            return candidates
+        """Filtre la page brute par type d'entité et construit jusqu'à CANDIDATE_LIMIT candidats"""
 
-        except Exception as e:
+        allowed_types = CANDIDATE_TYPES[search_type]
 
-            print(f"ERREUR critique recherche globale : {e}")
+        candidates = []
 
-            return []
+        total_items = 0
 
+        for item in page:
 
+            total_items += 1
 
-    def process_by_id(self, discogs_id):
+            if len(candidates) >= CANDIDATE_LIMIT:
+                break
 
-        """Ajoute un album via son ID Discogs précis (Sélection utilisateur)"""
+            # --- 1. FILTRAGE PAR TYPE D'ENTITÉ ---
+            # Le type est présent dans le JSON brut de la page : aucun accès réseau
+            if item.get('type') not in allowed_types or not item.get('title'):
+                continue
 
-        print(f"Recuperation ID Discogs : {discogs_id}")
+            # --- 2. EXTRACTION DEPUIS LA PAGE (Airbag) ---
+            # Titre, année, label, vignette et ID sont dans la page de résultats :
+            # la release complète ne sera hydratée que via /add-by-id
+            try:
+                candidates.append(candidate_from_search_result(item))
+            except Exception as item_error:
+                # Si UN élément est mal formé, on l'affiche dans la console mais on ne plante pas la liste
+                print(f"ATTENTION : Element ignore (Erreur de donnee) : {item_error}")
+                continue
 
-        try:
+        print(f"SUCCES : {len(candidates)} resultats trouves sur {total_items} elements examines pour '{query}'")
 
-            # 1. On récupère l'objet précis via l'ID
+        return candidates
 
-            album = self.discogs.release(discogs_id)
 
-            
 
-            # Extraction des données (similaire au scan)
+    def _search_fields(self, search_type):
 
-            artist_name = album.artists[0].name if album.artists else "Inconnu"
+        """Paramètres de recherche Discogs et taille de page pour un mode de candidats"""
 
-            if album.artists and len(album.artists) > 1:
+        if search_type not in CANDIDATE_TYPES:
+            raise ValueError(f"Type de recherche inconnu : {search_type} (attendu : {', '.join(CANDIDATE_TYPES)})")
 
-                artist_name = ", ".join([a.name for a in album.artists])
+        # Avec type='release' ou 'master', Discogs filtre lui-même.
+        # En mode 'all', on ne passe pas de type (Discogs renvoie aussi artistes et labels)
+        # et on garde une page plus large pour compenser le filtrage sur la page brute.
+        if search_type == "all":
+            return {}, CANDIDATE_LIMIT * 3
 
-            # 2. Spotify (On utilise les infos précises de Discogs)
+        return {"type": search_type}, CANDIDATE_LIMIT
 
-            spotify_data = self.step_3_spotify(artist_name, album.title)
 
-            
 
-            # 3. Construction objet final
+    @instrumented("search_candidates")
+    def search_candidates(self, query, search_type="release"):
 
-            final_cover = album.images[0]['uri'] if album.images else None
+        """
+        Recherche 'Google Style' : Tolérante et robuste.
 
-            spotify_link = None
+        Une seule requête Discogs par appel. `search_type` choisit les entités :
+        'release', 'master' ou 'all' (releases + masters, filtrés sur la page brute).
+        """
 
-            spotify_uri = None
+        fields, per_page = self._search_fields(search_type)
 
-            
+        cached = self.candidate_cache.get(query, search_type)
 
-            if spotify_data:
+        if cached is not None:
 
-                spotify_link = spotify_data['spotify_link']
+            return cached
 
-                spotify_uri = spotify_data['spotify_uri']
+        print(f"Recherche robuste pour : {query} (type={search_type})")
 
-                if spotify_data['cover_hd']:
+        try:
 
-                    final_cover = spotify_data['cover_hd']
+            # UNE seule recherche Discogs : première page brute, pas de pagination implicite,
+            # prioritaire sur les scans par lots (recherche au fil de la saisie)
+            with discogs_priority(INTERACTIVE):
 
-            clean_tracklist = [t.title for t in album.tracklist if t.position]
+                page = self._search_page(query, per_page=per_page, **fields)
 
-            return {
+            candidates = self._candidates_from_page(page, search_type, query)
 
-                "status": "success",
+            # Seules les recherches abouties sont mises en cache (pas les listes vides sur erreur)
+            self.candidate_cache.set(query, search_type, candidates)
 
-                "display": {
+            return candidates
+
+        except Exception as e:
+
+            record_error("search_candidates")
+
+            print(f"ERREUR critique recherche globale : {e}")
 
-                    "artist": artist_name,
+            return []
 
-                    "title": album.title,
 
-                    "cover_image": final_cover,
 
-                },
+    @instrumented("process_by_id")
+    def process_by_id(self, discogs_id, entity_type="release", hint_title=None, timings=None):
 
-                "details": {
+        """
+        Ajoute un album via son ID Discogs précis (Sélection utilisateur).
 
-                    "year": str(album.year) if album.year else "",
+        Si l'ID est celui d'un master (candidat de type 'master'), on le résout
+        d'abord vers sa release principale. `hint_title` est le titre du candidat
+        choisi ("Artiste - Album") : s'il est fourni, Spotify part en parallèle
+        de l'hydratation de la release.
+        """
 
-                    "label": album.labels[0].name if album.labels else "",
+        cache_key = self._id_cache_key(discogs_id, entity_type)
+        cached = self.metadata_cache.get(cache_key)
+        if cached:
+            print(f"ID Discogs {discogs_id} : résultat servi depuis le cache")
+            return cached
 
-                    "genre": album.genres,
+        print(f"Recuperation ID Discogs : {discogs_id}")
 
-                    "tracklist": clean_tracklist
+        try:
 
-                },
+            # 1. On récupère l'objet précis via l'ID (une seule requête HTTP)
 
-                "links": {
+            release_id = discogs_id
 
-                    "spotify_url": spotify_link,
+            if entity_type == "master":
 
-                    "spotify_uri": spotify_uri,
+                with stage(timings, "discogs_master"):
 
-                    "discogs_url": album.url
+                    release_id = self._main_release(discogs_id)
 
-                }
+            hint_artist, hint_album = split_search_title(hint_title or "")
 
-            }
+            if self.parallel_pipeline and hint_artist:
+
+                # 2. Spotify en parallèle, avec l'artiste et le titre du candidat choisi
+
+                album, spotify_data = self._run_parallel(
+                    timings,
+                    ("discogs_release", self._fetch_release, release_id),
+                    ("spotify", self.step_3_spotify, hint_artist, hint_album),
+                )
+
+            else:
+
+                album = timed_call(timings, "discogs_release", self._fetch_release, release_id)
+
+                # 2. Spotify (On utilise les infos précises de Discogs)
+
+                spotify_data = timed_call(timings, "spotify", self.step_3_spotify, album.artist_name or "Inconnu", album.title)
+
+
+
+            # 3. Construction objet final
+
+            final_record = self._format_release_record(album, spotify_data)
+
+            self.metadata_cache.set(cache_key, final_record)
+
+            return final_record
 
         except Exception as e:
 
+            record_error("process_by_id")
+
             print(f"Erreur process ID: {e}")
 
             return {"status": "error", "message": str(e)}
 
 
 
+def _as_bytes(content):
+
+    """Vision (protobuf) n'accepte que des bytes : on convertit memoryview / bytearray"""
+
+    return content if isinstance(content, bytes) else bytes(content)
+
+
+
 # --- EXECUTION DE TEST ---
 
 if __name__ == "__main__":
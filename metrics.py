@@ -0,0 +1,222 @@
+import time
+
+import bisect
+
+import functools
+
+import threading
+
+import inspect
+
+from collections import deque
+
+from contextlib import contextmanager
+
+
+
+# Bornes des histogrammes (secondes) : de la lecture cache (ms) aux appels OCR lents
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+
+class Counter:
+
+    """Compteur Prometheus par jeu de labels"""
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{{{_labels(self.labelnames, labels)}}} {value}")
+        return lines
+
+
+class Histogram:
+
+    """
+    Histogramme Prometheus (buckets cumulés, _sum, _count) par jeu de labels.
+
+    Les p50/p95/p99 sont aussi exposés directement (`<name>_quantile`, jauge) : calculés sur
+    les `window` dernières mesures, ils reflètent la latence récente sans requête PromQL.
+    """
+
+    def __init__(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS, window=1024):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.window = window
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {
+                    "buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0, "recent": deque(maxlen=self.window),
+                }
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series["buckets"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+            series["recent"].append(value)
+
+    def quantiles(self, *labels):
+        """{0.5: ..., 0.95: ..., 0.99: ...} sur les mesures récentes (vide si aucune)"""
+        with self._lock:
+            series = self._series.get(labels)
+            recent = sorted(series["recent"]) if series else []
+        if not recent:
+            return {}
+        return {q: recent[min(len(recent) - 1, int(q * len(recent)))] for q in QUANTILES}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        quantile_lines = [
+            f"# HELP {self.name}_quantile {self.documentation} (p50/p95/p99 des {self.window} dernières mesures)",
+            f"# TYPE {self.name}_quantile gauge",
+        ]
+
+        with self._lock:
+            snapshot = {labels: (list(s["buckets"]), s["sum"], s["count"]) for labels, s in self._series.items()}
+
+        for labels, (buckets, total, count) in sorted(snapshot.items()):
+            base = _labels(self.labelnames, labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, buckets):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{base}}} {round(total, 6)}")
+            lines.append(f"{self.name}_count{{{base}}} {count}")
+
+            for q, value in self.quantiles(*labels).items():
+                quantile_lines.append(f'{self.name}_quantile{{{base},quantile="{q}"}} {round(value, 6)}')
+
+        return lines + quantile_lines
+
+
+def _labels(names, values):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# --- MÉTRIQUES DU PIPELINE ---
+
+STAGE_LATENCY = Histogram(
+    "kissa_stage_duration_seconds", "Durée des étapes du pipeline Kissa", ("stage",)
+)
+STAGE_ERRORS = Counter(
+    "kissa_stage_errors_total", "Erreurs par étape du pipeline Kissa", ("stage",)
+)
+UPSTREAM_LATENCY = Histogram(
+    "kissa_upstream_duration_seconds", "Durée des appels aux services externes", ("upstream", "operation")
+)
+UPSTREAM_CALLS = Counter(
+    "kissa_upstream_requests_total", "Appels aux services externes par résultat", ("upstream", "operation", "outcome")
+)
+
+ALL_METRICS = (STAGE_LATENCY, STAGE_ERRORS, UPSTREAM_LATENCY, UPSTREAM_CALLS)
+
+
+class StageClock:
+
+    """Durée exclue d'une étape en cours (`with clock.excluded():` autour d'une attente qui n'en fait pas partie)"""
+
+    def __init__(self):
+        self.excluded_seconds = 0.0
+
+    @contextmanager
+    def excluded(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.excluded_seconds += time.perf_counter() - start
+
+
+@contextmanager
+def track(stage):
+    """Chronomètre une étape ; une exception qui remonte compte comme une erreur de l'étape"""
+    clock = StageClock()
+    start = time.perf_counter()
+    try:
+        yield clock
+    except Exception:
+        STAGE_ERRORS.inc(stage)
+        raise
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - start - clock.excluded_seconds, stage)
+
+
+def record_error(stage):
+    """Erreur rattrapée dans l'étape (l'étape renvoie None / un objet d'erreur au lieu de lever)"""
+    STAGE_ERRORS.inc(stage)
+
+
+def instrumented(stage):
+    """Décorateur : track(stage) autour d'une méthode, synchrone ou coroutine"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with track(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track(stage):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def upstream_call(upstream, operation):
+    """
+    Chronomètre un appel à un service externe (discogs, spotify, vision, supabase) et le compte.
+    L'appelant peut préciser le résultat (ex : code HTTP) via call["outcome"].
+    """
+    call = {"outcome": "ok"}
+    start = time.perf_counter()
+    try:
+        yield call
+    except Exception:
+        call["outcome"] = "error"
+        raise
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - start, upstream, operation)
+        UPSTREAM_CALLS.inc(upstream, operation, call["outcome"])
+
+
+def http_outcome(status_code):
+    """Code HTTP -> résultat compté ("2xx", "4xx", ...)"""
+    return f"{status_code // 100}xx"
+
+
+def render_prometheus():
+    """Toutes les métriques au format texte Prometheus (exposition 0.0.4)"""
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,149 @@
+import io
+
+import hashlib
+
+import threading
+
+from PIL import Image
+
+
+
+class OcrCache:
+
+    """
+    Cache du texte détecté par Google Vision, indexé par le contenu de l'image.
+
+    Deux clés par image :
+      - "sha256:<hex>" : empreinte exacte des octets (re-upload, retry)
+      - "dhash:<hex>"  : hash perceptuel (dHash 64 bits), pour reconnaître une autre
+        photo de la même pochette (distance de Hamming <= `max_distance`)
+
+    Par défaut seule l'empreinte exacte sert : deux pochettes d'une même série (même
+    gabarit, seul le titre change) ont des dHash aussi proches que deux photos de la
+    même pochette, et le texte de l'une serait enregistré pour l'autre. Avec
+    `near_duplicates`, un quasi-doublon n'est repris que s'il a aussi le même format
+    (rapport largeur/hauteur à `max_aspect_delta` près) et un dHash fin (16x16) à moins
+    de `2 * max_distance` bits.
+
+    Le stockage (borné, persistant) est un PersistentCache ; l'index des dHash est
+    gardé en mémoire pour la recherche des quasi-doublons.
+    """
+
+    def __init__(self, store, max_distance=2, near_duplicates=False, max_aspect_delta=0.02):
+        self.store = store
+        self.max_distance = max_distance
+        self.near_duplicates = near_duplicates
+        self.max_aspect_delta = max_aspect_delta
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._dhash_index = {int(key.split(":", 1)[1], 16) for key in store.keys("dhash:")} if near_duplicates else set()
+
+    def fingerprint(self, content):
+        """
+        Renvoie (sha256, signature) de l'image : signature = (dhash, dhash fin, largeur/hauteur),
+        None si les quasi-doublons sont désactivés ou si l'image n'est pas décodable
+        """
+        sha = hashlib.sha256(content).hexdigest()
+        if not self.near_duplicates:
+            return sha, None
+        try:
+            perceptual = signature(content)
+        except Exception as e:
+            print(f"ATTENTION : hash perceptuel impossible ({e})")
+            perceptual = None
+        return sha, perceptual
+
+    def lookup(self, fingerprint):
+        """Texte déjà détecté pour cette image (ou une quasi-copie), sinon None"""
+        sha, perceptual = fingerprint
+
+        text = self.store.get(f"sha256:{sha}")
+        if text is not None:
+            with self._lock:
+                self.exact_hits += 1
+            return text
+
+        if perceptual is not None:
+            coarse, fine, aspect = perceptual
+            with self._lock:
+                distances = [((known ^ coarse).bit_count(), known) for known in self._dhash_index]
+            # Du plus proche au plus lointain, dans la limite de max_distance
+            for distance, known in sorted(d for d in distances if d[0] <= self.max_distance):
+                entry = self.store.get(f"dhash:{known:016x}")
+                if isinstance(entry, dict):
+                    if self._same_image(entry, fine, aspect):
+                        with self._lock:
+                            self.near_hits += 1
+                        return entry["text"]
+                    continue
+                # Entrée évincée, expirée côté SQLite ou sans signature à vérifier : on nettoie l'index
+                with self._lock:
+                    self._dhash_index.discard(known)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _same_image(self, entry, fine, aspect):
+        """Quasi-doublon confirmé : même format et dHash fin proche (une autre pochette du même gabarit échoue ici)"""
+        if abs(entry["aspect"] - aspect) > self.max_aspect_delta * aspect:
+            return False
+        return (int(entry["fine"], 16) ^ fine).bit_count() <= 2 * self.max_distance
+
+    def store_text(self, fingerprint, text):
+        sha, perceptual = fingerprint
+        self.store.set(f"sha256:{sha}", text)
+        if perceptual is not None:
+            coarse, fine, aspect = perceptual
+            self.store.set(f"dhash:{coarse:016x}", {"text": text, "fine": f"{fine:064x}", "aspect": aspect})
+            with self._lock:
+                self._dhash_index.add(coarse)
+
+    def stats(self):
+        """Taux de hit/miss (exacts et quasi-doublons) et taille du stockage"""
+        total = self.exact_hits + self.near_hits + self.misses
+        hits = self.exact_hits + self.near_hits
+        return {
+            "size": self.store.stats()["size"],
+            "max_entries": self.store.max_entries,
+            "exact_hits": self.exact_hits,
+            "near_duplicate_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+        }
+
+
+def signature(content):
+    """Signature perceptuelle d'une image en un seul décodage : (dHash 8x8, dHash 16x16, largeur/hauteur)"""
+    with Image.open(io.BytesIO(content)) as img:
+        aspect = img.width / img.height
+        # JPEG : décodage directement à taille réduite (beaucoup plus rapide sur une photo de 12 Mo)
+        img.draft("L", (17 * 8, 16 * 8))
+        gray = img.convert("L")
+        gray.load()
+    return _dhash(gray, 8), _dhash(gray, 16), round(aspect, 4)
+
+
+def dhash(content, size=8):
+    """
+    Hash perceptuel "difference hash" (size*size bits) d'une image.
+
+    On compare chaque pixel à son voisin de droite sur une miniature en niveaux de gris :
+    recadrage léger, recompression ou changement d'exposition ne modifient que peu de bits.
+    """
+    with Image.open(io.BytesIO(content)) as img:
+        img.draft("L", ((size + 1) * 8, size * 8))
+        return _dhash(img.convert("L"), size)
+
+
+def _dhash(gray, size):
+    pixels = gray.resize((size + 1, size), Image.Resampling.LANCZOS).tobytes()
+
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
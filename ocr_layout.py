@@ -0,0 +1,107 @@
+import statistics
+
+
+
+class OcrLayout:
+
+    """
+    Texte OCR ordonné par importance visuelle, à partir des blocs `full_text_annotation` de Google Vision.
+
+    `text_annotations[0]` aplatit la pochette dans l'ordre de lecture : l'artiste et le titre s'y
+    retrouvent noyés entre mentions légales, crédits et numéro de catalogue. Ici chaque bloc est
+    pondéré par la taille de ses caractères (hauteur médiane des boîtes de mots) et par sa position
+    (le haut et le centre de la pochette comptent plus que les bords) :
+
+      poids = taille relative × (1 + position_weight × centralité)
+
+    Les blocs « clés » (poids >= `key_ratio` × poids maximal) viennent en tête, du plus gros au
+    plus petit ; le reste suit dans l'ordre de lecture. La requête courte (OcrNormalizer, N
+    premiers mots) porte alors sur le plus gros texte, et le code-barres / numéro de catalogue,
+    imprimés en petit, restent dans le texte pour leurs filtres.
+    """
+
+    def __init__(self, key_ratio=0.5, position_weight=0.5, min_confidence=0.5):
+        self.key_ratio = key_ratio
+        self.position_weight = position_weight
+        self.min_confidence = min_confidence
+
+    def text(self, annotation):
+        """Texte réordonné (blocs clés d'abord), ou None si l'annotation n'a aucun bloc"""
+        blocks = self.blocks(annotation)
+        if not blocks:
+            return None
+
+        top = max(block["weight"] for block in blocks)
+        key = sorted(
+            (block for block in blocks if block["weight"] >= self.key_ratio * top),
+            key=lambda block: -block["weight"],
+        )
+        rest = [block for block in blocks if block["weight"] < self.key_ratio * top]
+        return " ".join(block["text"] for block in key + rest)
+
+    def blocks(self, annotation):
+        """Blocs de texte dans l'ordre de lecture : [{"text", "size", "weight"}]"""
+        raw = []
+        for page in getattr(annotation, "pages", None) or []:
+            height = page.height or None
+            width = page.width or None
+            page_blocks = []
+            for block in page.blocks:
+                # Bloc douteux (reflet, texture de la pochette) : on l'écarte s'il est lu avec peu de confiance
+                if block.confidence and block.confidence < self.min_confidence:
+                    continue
+                words = [word for paragraph in block.paragraphs for word in paragraph.words]
+                text = " ".join("".join(symbol.text for symbol in word.symbols) for word in words).strip()
+                if not text:
+                    continue
+                sizes = [_box_height(word.bounding_box) for word in words]
+                page_blocks.append({
+                    "text": text,
+                    "size": statistics.median(sizes),
+                    "center": _box_center(block.bounding_box),
+                })
+
+            # Dimensions absentes (certaines réponses) : l'étendue des blocs en tient lieu
+            if page_blocks and not (height and width):
+                height = max(b["center"][1] for b in page_blocks) * 2 or 1
+                width = max(b["center"][0] for b in page_blocks) * 2 or 1
+            for block in page_blocks:
+                block["centrality"] = _centrality(block.pop("center"), width, height)
+            raw.extend(page_blocks)
+
+        largest = max((block["size"] for block in raw), default=0)
+        if not largest:
+            return []
+
+        for block in raw:
+            block["weight"] = round(
+                block["size"] / largest * (1 + self.position_weight * block.pop("centrality")), 4
+            )
+        return raw
+
+
+def _box_height(box):
+    """Hauteur d'une boîte de mot (côté gauche du polygone : tient compte d'un texte incliné)"""
+    vertices = box.vertices
+    if len(vertices) < 4:
+        return 0.0
+    top, bottom = vertices[0], vertices[3]
+    return ((bottom.x - top.x) ** 2 + (bottom.y - top.y) ** 2) ** 0.5
+
+
+def _box_center(box):
+    vertices = box.vertices
+    if not vertices:
+        return 0.0, 0.0
+    return (
+        sum(v.x for v in vertices) / len(vertices),
+        sum(v.y for v in vertices) / len(vertices),
+    )
+
+
+def _centrality(center, width, height):
+    """Entre 0 et 1 : 1 en haut au centre de la pochette, 0 en bas sur les bords"""
+    x, y = center
+    horizontal = 1 - min(abs(x / width - 0.5) * 2, 1)
+    vertical = 1 - min(max(y / height, 0), 1)
+    return (horizontal + vertical) / 2
@@ -0,0 +1,202 @@
+import re
+
+import unicodedata
+
+from difflib import SequenceMatcher
+
+from discogs_records import split_search_title
+
+
+
+# Mots vides ignorés dans les titres Discogs (ils ne discriminent rien et l'OCR les rate souvent)
+STOPWORDS = {"the", "a", "an", "of", "and", "le", "la", "les", "de", "des", "du", "et", "un", "une"}
+
+# Hit d'une recherche par code-barres : identification exacte, même si le texte OCR est illisible
+EXACT_CONFIDENCE = 0.95
+
+# Deux mots OCR / Discogs sont considérés égaux au-delà de ce ratio (ex : "APPARAI" ~ "apparat")
+FUZZY_TOKEN_RATIO = 0.8
+
+
+
+class OcrMatcher:
+
+    """
+    Choix de la release Discogs pour un texte OCR, au lieu de prendre aveuglément results[0].
+
+    `plan(text)` propose un petit nombre de requêtes ciblées (au plus `max_queries`) : le texte
+    complet tronqué, puis des fenêtres de mots successives (sur une pochette, l'artiste et le
+    titre sont en général en tête de lecture). `rank(hits, text)` note chaque hit localement :
+    part des mots de l'artiste et du titre du hit retrouvés dans le texte OCR (similarité par
+    ensembles de mots, tolérante aux fautes de lecture).
+
+    `match(text, normalized)` déroule le choix (recherches, notes, seuils) sans entrées/sorties :
+    KissaCore et AsyncKissaCore n'ont plus qu'à exécuter les recherches proposées. On arrête
+    d'interroger Discogs dès qu'un hit atteint `accept` ; en dessous de `min_confidence`, aucun
+    hit n'est retenu (mieux vaut proposer la recherche manuelle qu'ajouter le mauvais album).
+    Une requête saisie (`typed`) est cherchée telle quelle en premier et n'est jamais rejetée :
+    "Miles" est une recherche partielle volontaire, pas une lecture douteuse.
+    """
+
+    def __init__(self, max_queries=3, per_query=5, accept=0.8, min_confidence=0.34, max_query_tokens=8):
+        self.max_queries = max_queries
+        self.per_query = per_query
+        self.accept = accept
+        self.min_confidence = min_confidence
+        self.max_query_tokens = max_query_tokens
+
+    def plan(self, text):
+        """Requêtes Discogs à essayer, dans l'ordre (sans doublons)"""
+        words = [w for w in str(text).split() if _informative(w)]
+        if not words:
+            return [str(text).strip()] if str(text).strip() else []
+
+        size = self.max_query_tokens
+        queries = [" ".join(words[:size])]
+        # Fenêtres plus courtes : les premiers mots seuls, puis la suite du texte
+        window = max(2, size // 2)
+        for start in range(0, len(words), window):
+            queries.append(" ".join(words[start:start + window]))
+
+        return list(dict.fromkeys(q for q in queries if q))[:self.max_queries]
+
+    def searches(self, normalized, text=""):
+        """
+        Recherches (requête, filtres) pour un texte normalisé (OcrNormalizer), au plus max_queries :
+        d'abord le code-barres (clé de contrôle vérifiée, identification exacte), puis la première
+        requête texte, puis le numéro de catalogue (détection heuristique) et les autres requêtes
+        texte. Le numéro de catalogue ne sert donc que si la requête texte principale n'a rien donné.
+
+        Si la normalisation a retiré plus de mots qu'elle n'en a gardé (nom fait de mots vides ou
+        de lettres seules : "The The", "R.E.M."), le texte brut `text` passe en première requête.
+        """
+        searches = []
+        if normalized["barcode"]:
+            searches.append(("", {"barcode": normalized["barcode"]}))
+
+        queries = self.plan(normalized["query"])
+        if text and (not queries or normalized.get("dropped", 0) > len(normalized["tokens"])):
+            queries = list(dict.fromkeys(self.plan(text)[:1] + queries))
+        text_searches = [(query, {}) for query in queries]
+        searches.extend(text_searches[:1])
+        if normalized["catno"]:
+            searches.append(("", {"catno": normalized["catno"]}))
+        searches.extend(text_searches[1:])
+
+        return searches[:self.max_queries]
+
+    def match(self, text, normalized, typed=False):
+        """Choix de la release pour un texte OCR (ou saisi : `typed`) et sa forme normalisée, cf. ReleaseMatch"""
+        searches = self.searches(normalized, text)
+        if typed and str(text).strip():
+            raw = (str(text).strip(), {})
+            searches = ([raw] + [search for search in searches if search != raw])[:self.max_queries]
+        return ReleaseMatch(self, text, searches, min_confidence=0.0 if typed else self.min_confidence)
+
+    def rank(self, hits, text, exact=False):
+        """
+        (meilleur hit, confiance entre 0 et 1), ou (None, 0.0) sans hit.
+        `exact` : hits d'une recherche par identifiant (code-barres), confiance au moins EXACT_CONFIDENCE.
+        """
+        ocr_tokens = set(tokens(text))
+        best, best_score = None, 0.0
+        for hit in hits:
+            score = self.score(hit, ocr_tokens)
+            if score > best_score:
+                best, best_score = hit, score
+        if exact and hits:
+            return best or hits[0], max(round(best_score, 3), EXACT_CONFIDENCE)
+        return best, round(best_score, 3)
+
+    def score(self, hit, ocr_tokens):
+        """Moyenne des couvertures artiste / titre (couverture du titre complet si pas d'artiste)"""
+        artist, album = split_search_title(hit.get("title", ""))
+        if artist:
+            # Plusieurs artistes crédités ("A, B & C") : la pochette n'en montre souvent qu'un
+            artist_score = max(_coverage(tokens(name), ocr_tokens) for name in re.split(r",|&", artist))
+            return (artist_score + _coverage(tokens(album), ocr_tokens)) / 2
+        return _coverage(tokens(album), ocr_tokens)
+
+
+class ReleaseMatch:
+
+    """
+    Déroulé du choix d'une release, sans entrées/sorties : l'appelant exécute chaque recherche
+    proposée et rend la page de résultats brute.
+
+        match = matcher.match(text, normalized)
+        for query, fields in match:
+            match.add(fields, search_page(query, per_page=matcher.per_query, type="release", **fields))
+        hit, confidence = match.result()
+
+    L'itération s'arrête dès qu'un hit atteint `accept` ; un hit déjà vu n'est pas renoté.
+    """
+
+    def __init__(self, matcher, text, searches, min_confidence=None):
+        self.matcher = matcher
+        self.text = text
+        self.searches = searches
+        self.min_confidence = matcher.min_confidence if min_confidence is None else min_confidence
+        self.best = None
+        self.confidence = 0.0
+        self._seen = set()
+
+    def __iter__(self):
+        for query, fields in self.searches:
+            if self.confidence >= self.matcher.accept:
+                return
+            yield query, fields
+
+    def add(self, fields, page):
+        hits = [hit for hit in page if hit["id"] not in self._seen]
+        self._seen.update(hit["id"] for hit in hits)
+
+        hit, confidence = self.matcher.rank(hits, self.text, exact="barcode" in fields)
+        if confidence > self.confidence:
+            self.best, self.confidence = hit, confidence
+
+    def result(self):
+        """(hit, confiance), ou (None, confiance) sous le seuil min_confidence"""
+        if self.best and self.confidence < self.min_confidence:
+            print(f"ATTENTION : correspondance trop incertaine ({self.best.get('title')}, confiance {self.confidence})")
+            return None, self.confidence
+
+        if self.best:
+            print(f"Correspondance Discogs : {self.best.get('title')} (confiance {self.confidence})")
+
+        return self.best, self.confidence
+
+
+def tokens(text):
+    """Mots normalisés : minuscules, sans accents ni ponctuation"""
+    decomposed = unicodedata.normalize("NFKD", str(text).lower())
+    folded = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return re.findall(r"[a-z0-9]+", folded)
+
+
+def _informative(word):
+    """Mots utiles à une requête : pas de ponctuation seule ni de longs nombres (catalogue, code-barres)"""
+    cleaned = re.sub(r"\W", "", word)
+    if len(cleaned) < 2:
+        return False
+    return not (cleaned.isdigit() and len(cleaned) > 4)
+
+
+def _coverage(hit_tokens, ocr_tokens):
+    significant = [t for t in hit_tokens if t not in STOPWORDS and len(t) > 1] or hit_tokens
+    if not significant:
+        return 0.0
+    found = sum(1 for token in significant if _token_found(token, ocr_tokens))
+    return found / len(significant)
+
+
+def _token_found(token, ocr_tokens):
+    if token in ocr_tokens:
+        return True
+    if len(token) < 4:
+        return False
+    # Tolérance aux erreurs de lecture, seulement entre mots de longueur voisine
+    return any(
+        abs(len(token) - len(candidate)) <= 2 and SequenceMatcher(None, token, candidate).ratio() >= FUZZY_TOKEN_RATIO
+        for candidate in ocr_tokens
+    )
@@ -0,0 +1,149 @@
+import re
+
+import unicodedata
+
+
+
+# Mentions légales et techniques imprimées sur les pochettes : rien à voir avec l'artiste ou le titre
+BOILERPLATE_PATTERNS = (
+    r"all rights(?: of the [a-z ]+?)? reserved",
+    r"unauthori[sz]ed [a-z ,]*?(?:copying|duplication|reproduction|public performance|broadcasting|hiring|lending)"
+    r"(?: [a-z ,]*?prohibited)?",
+    r"(?:made|printed|manufactured|pressed|distributed|marketed) (?:and [a-z]+ )?(?:in|by) (?:the )?[a-z]+",
+    r"(?:\(p\)|\(c\)|℗|©)\s*(?:\d{4})?",
+    r"\b(?:p|c) \d{4}\b",
+    r"\blicen[sc]ed (?:to|from|by)\b",
+    r"\b(?:side|face|seite) [a-d12]\b",
+    r"\b(?:33|45|78)(?: ?1/3)? ?(?:rpm|tours|t)\b",
+    r"\bwww\.\S+|\bhttps?://\S+|\S+@\S+\.\S+",
+)
+
+BOILERPLATE = re.compile("|".join(f"(?:{p})" for p in BOILERPLATE_PATTERNS))
+
+# Mots de format / d'emballage : présents sur presque toutes les pochettes, inutiles à la recherche
+STOPWORDS = {
+    "lp", "ep", "vinyl", "vinyle", "stereo", "mono", "rpm", "record", "records", "recording", "recordings",
+    "side", "face", "disc", "disque", "album", "edition", "remastered", "ltd", "inc", "gmbh", "sa", "the",
+}
+
+# Codes-barres : EAN-13 / UPC-A, souvent imprimés par groupes ("5 099909 012345 6")
+BARCODE = re.compile(r"(?<!\d)(\d(?:[ -]?\d){11,12})(?!\d)")
+
+# Numéros de catalogue, trois formes :
+#   - lettres et chiffres collés ("TPLP71", "WARPLP55", "V2940")
+#   - séparés par un tiret ("LB-1", "CDSTUMM-332")
+#   - séparés par une espace : préfixe court de label (2 à 4 lettres) et au moins 3 chiffres ("CL 1355", "AMB 3922")
+# Un mot en capitales suivi d'un nombre ("MAROON 5", "SUM 41", "BLINK 182") est presque toujours un nom
+# d'artiste ou un titre : la forme espacée n'accepte donc ni préfixe long ni petit nombre.
+# Les numéros purement numériques ne sont pas détectés.
+CATNO = re.compile(r"\b([A-Z]{1,8}\d{2,5}[A-Z]?|[A-Z]{2,8}-\d{1,5}[A-Z]?|[A-Z]{2,4} \d{3,5}[A-Z]?)\b")
+
+# Préfixes qui ressemblent à un numéro de catalogue mais n'en sont pas ("VOL 2", "NO 9", "LP 2")
+NOT_CATNO = {"VOL", "NO", "NR", "OP", "OPUS", "LP", "EP", "CD", "SIDE", "FACE", "RPM", "PART", "TRACK", "BWV", "KV"}
+
+# Séparateur de lot : ne peut pas apparaître dans un texte OCR
+BATCH_SEPARATOR = "\x1e"
+
+WORD = re.compile(r"[a-z0-9]+(?:['&][a-z0-9]+)*")
+
+
+
+class OcrNormalizer:
+
+    """
+    Réduit un texte OCR brut en requête Discogs courte : {"query", "barcode", "catno", "tokens", "dropped"}.
+
+    1. Repliement Unicode (NFKC, accents retirés), minuscules
+    2. Code-barres (clé de contrôle EAN/UPC vérifiée) retiré du texte ; code-barres et numéro de
+       catalogue renvoyés à part pour les filtres `barcode` / `catno` de la recherche Discogs
+       (les mots du numéro de catalogue restent dans la requête : un faux positif ne coûte
+       alors qu'une recherche, pas le nom de l'artiste)
+    3. Mentions légales, mots de format et mots vides retirés
+    4. Mots dédoublonnés (ordre de lecture conservé), au plus `max_tokens`
+
+    `dropped` compte les mots retirés à l'étape 3 comme mots vides ou trop courts : un nom fait
+    de ces mots ("The The", "R.E.M.") disparaît de la requête (cf. OcrMatcher.searches).
+
+    `normalize_batch` applique les mêmes étapes à une liste de textes, avec une seule passe de
+    chaque expression régulière sur le lot concaténé.
+    """
+
+    def __init__(self, max_tokens=8):
+        self.max_tokens = max_tokens
+
+    def normalize(self, text):
+        return self.normalize_batch([text])[0]
+
+    def normalize_batch(self, texts):
+        raw = BATCH_SEPARATOR.join(unicodedata.normalize("NFKC", str(t or "")) for t in texts)
+
+        # Identifiants cherchés avant repliement : la casse distingue un numéro de catalogue d'un mot
+        barcodes = {}
+        catnos = {}
+        for index, item in enumerate(raw.split(BATCH_SEPARATOR)):
+            barcodes[index] = _find_barcode(item)
+            catnos[index] = _find_catno(item)
+
+        folded = _fold(raw).lower()
+        folded = BARCODE.sub(" ", folded)
+        folded = BOILERPLATE.sub(" ", folded)
+
+        results = []
+        for index, item in enumerate(folded.split(BATCH_SEPARATOR)):
+            words = WORD.findall(item)
+            useful = [w for w in words if _useful(w)]
+            tokens = list(dict.fromkeys(useful))[:self.max_tokens]
+            results.append({
+                "query": " ".join(tokens),
+                "barcode": barcodes[index],
+                "catno": catnos[index],
+                "tokens": tokens,
+                "dropped": len(words) - len(useful),
+            })
+        return results
+
+
+def _fold(text):
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _useful(word):
+    if word in STOPWORDS:
+        return False
+    if word.isdigit():
+        # Les années restent (utiles pour départager les pressages), les autres nombres longs non
+        return len(word) <= 4
+    return len(word) > 1
+
+
+def _find_barcode(text):
+    for match in BARCODE.finditer(text):
+        digits = re.sub(r"\D", "", match.group(1))
+        if len(digits) in (12, 13) and _valid_check_digit(digits):
+            return digits
+    return None
+
+
+def _valid_check_digit(digits):
+    """Clé de contrôle EAN-13 / UPC-A (UPC-A = EAN-13 précédé d'un 0)"""
+    digits = digits.zfill(13)
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits[:12]))
+    return (10 - total % 10) % 10 == int(digits[12])
+
+
+def _find_catno(text):
+    """Numéro de catalogue le plus plausible (le premier à score égal), ou None"""
+    best, best_score = None, -1
+    for match in CATNO.finditer(text):
+        candidate = match.group(1)
+        prefix = re.match(r"[A-Z]+", candidate).group(0)
+        number = re.search(r"\d+", candidate).group(0)
+        # "MUTE 2011", "LTD 1999" : une année, pas un numéro de catalogue
+        if prefix in NOT_CATNO or (len(number) == 4 and number[:2] in ("19", "20")):
+            continue
+        # Lettres et chiffres collés ("TPLP71") ou numéro d'au moins 3 chiffres : forme la plus typique
+        score = (not re.search(r"[ -]", candidate)) + (len(number) >= 3)
+        if score > best_score:
+            best, best_score = candidate, score
+    return best
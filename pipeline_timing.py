@@ -0,0 +1,36 @@
+import time
+
+from contextlib import contextmanager
+
+
+
+@contextmanager
+def stage(timings, name):
+    """
+    Chronomètre une étape du pipeline et range sa durée (ms) dans `timings`.
+
+    `timings` peut être None : l'appelant n'a pas demandé les temps, on ne fait rien.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[name] = round((time.perf_counter() - start) * 1000, 1)
+
+
+def timed_call(timings, name, func, *args):
+    """Appelle func(*args) en chronométrant l'étape (utile dans un thread du pool)"""
+    with stage(timings, name):
+        return func(*args)
+
+
+async def timed_await(timings, name, awaitable):
+    """Attend une coroutine en chronométrant l'étape (utile dans asyncio.gather)"""
+    with stage(timings, name):
+        return await awaitable
+
+
+def server_timing_header(timings):
+    """Formate les temps par étape pour l'en-tête HTTP Server-Timing"""
+    return ", ".join(f"{name};dur={duration}" for name, duration in timings.items())
@@ -0,0 +1,18 @@
+-- Dédoublonnage des albums par release Discogs
+-- (l'API écrit via un upsert on_conflict=discogs_id : la contrainte d'unicité est indispensable)
+
+alter table albums add column if not exists discogs_id bigint;
+
+-- Albums existants : l'ID se retrouve dans l'URL Discogs (https://www.discogs.com/release/<id>-...)
+update albums
+set discogs_id = substring(discogs_url from '/release/([0-9]+)')::bigint
+where discogs_id is null and discogs_url ~ '/release/[0-9]+';
+
+-- Doublons déjà présents : on garde le premier album enregistré pour chaque release
+delete from albums a
+using albums b
+where a.discogs_id = b.discogs_id
+  and (a.created_at, a.id::text) > (b.created_at, b.id::text);
+
+-- Les albums sans discogs_id (NULL) restent autorisés en plusieurs exemplaires
+alter table albums add constraint albums_discogs_id_key unique (discogs_id);
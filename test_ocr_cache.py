@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tests hors-ligne du cache OCR (empreinte exacte et quasi-doublons), sans appel Google Vision.
+
+    python -m pytest test_ocr_cache.py
+"""
+
+import io
+
+from PIL import Image, ImageDraw
+
+from kissa_cache import PersistentCache
+from ocr_cache import OcrCache
+
+
+def _sleeve(title, width=800, height=800, quality=90):
+    """Pochette factice d'une série : même gabarit, seul le titre change"""
+    img = Image.new("RGB", (width, height), (30, 30, 120))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((60, 60, width - 60, height // 2), fill=(230, 200, 40))
+    draw.text((90, height // 2 + 60), title, fill="white", font_size=70)
+    draw.text((90, height // 2 + 180), "BLUE NOTE 1500 SERIES", fill="white", font_size=70)
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def _cache(**options):
+    return OcrCache(PersistentCache(":memory:", table="ocr_text"), **options)
+
+
+def test_same_bytes_hit():
+    cache = _cache()
+    photo = _sleeve("MILES DAVIS")
+    cache.store_text(cache.fingerprint(photo), "MILES DAVIS")
+
+    assert cache.lookup(cache.fingerprint(photo)) == "MILES DAVIS"
+
+
+def test_similar_sleeve_does_not_reuse_text():
+    """Deux pochettes du même gabarit : l'une ne reprend jamais le texte de l'autre"""
+    for cache in (_cache(), _cache(near_duplicates=True)):
+        cache.store_text(cache.fingerprint(_sleeve("MILES DAVIS")), "MILES DAVIS")
+
+        for title in ("ART BLAKEY", "MILES DAVIES", "MILES DAVIS II"):
+            assert cache.lookup(cache.fingerprint(_sleeve(title))) is None
+
+
+def test_other_format_does_not_reuse_text():
+    cache = _cache(near_duplicates=True, max_distance=64)
+    cache.store_text(cache.fingerprint(_sleeve("MILES DAVIS")), "MILES DAVIS")
+
+    assert cache.lookup(cache.fingerprint(_sleeve("MILES DAVIS", height=600))) is None
+
+
+def test_recompressed_photo_is_near_duplicate():
+    """Quasi-doublons activés : la même pochette recompressée reprend le texte"""
+    cache = _cache(near_duplicates=True)
+    cache.store_text(cache.fingerprint(_sleeve("MILES DAVIS")), "MILES DAVIS")
+
+    assert cache.lookup(cache.fingerprint(_sleeve("MILES DAVIS", quality=75))) == "MILES DAVIS"
+    assert cache.stats()["near_duplicate_hits"] == 1
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Tests hors-ligne du choix de release (OcrNormalizer + OcrMatcher), sans appel Discogs.
+
+    python -m pytest test_ocr_matcher.py
+"""
+
+from ocr_matcher import OcrMatcher
+from ocr_normalize import OcrNormalizer
+
+
+def _match(text, page, typed=False):
+    """Déroule le choix comme KissaCore._match_release, avec une page Discogs figée"""
+    matcher = OcrMatcher()
+    match = matcher.match(text, OcrNormalizer().normalize(text), typed=typed)
+    queries = []
+    for query, fields in match:
+        queries.append(query)
+        match.add(fields, page)
+    return queries, match.result()
+
+
+def test_stopword_only_artist_is_searched():
+    """"The The" : la normalisation vide la requête, le texte brut est cherché quand même"""
+    page = [{"id": 1, "title": "The The - Soul Mining"}, {"id": 2, "title": "The The - Infected"}]
+
+    queries, (hit, confidence) = _match("THE THE", page)
+
+    assert queries == ["THE THE"]
+    assert hit is not None and hit["title"].startswith("The The")
+
+
+def test_single_letter_artist_comes_first():
+    """"R.E.M." : lettres seules retirées par la normalisation, le texte brut passe en premier"""
+    normalized = OcrNormalizer().normalize("R.E.M. Automatic for the People")
+
+    searches = OcrMatcher().searches(normalized, "R.E.M. Automatic for the People")
+
+    assert searches[0] == ("R.E.M. Automatic for the People", {})
+
+
+def test_cover_text_keeps_normalized_query():
+    """Texte de pochette ordinaire : la requête normalisée reste la première"""
+    text = "FLOATING POINTS PROMISES LUAKA BOP (P) 2021 All rights reserved"
+
+    searches = OcrMatcher().searches(OcrNormalizer().normalize(text), text)
+
+    assert searches[0] == ("floating points promises luaka bop", {})
+
+
+def test_partial_typed_query_is_not_rejected():
+    """Recherche manuelle partielle ("Miles") : le meilleur hit est rendu malgré une confiance faible"""
+    queries, (hit, confidence) = _match("Miles", [{"id": 3, "title": "Miles Davis - Kind Of Blue"}], typed=True)
+
+    assert queries[0] == "Miles"
+    assert hit["id"] == 3 and confidence < OcrMatcher().min_confidence
+
+
+def test_partial_ocr_text_is_rejected():
+    """Même texte lu par l'OCR : sous le seuil, aucun album n'est retenu"""
+    queries, (hit, confidence) = _match("Miles", [{"id": 3, "title": "Miles Davis - Kind Of Blue"}])
+
+    assert hit is None
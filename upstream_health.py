@@ -0,0 +1,128 @@
+import time
+
+import asyncio
+
+import contextvars
+
+
+# Avancement de la sonde en cours (dict partagé avec la tâche de la sonde), cf. probe_phase
+_progress = contextvars.ContextVar("upstream_probe_progress", default=None)
+
+
+def probe_phase(phase):
+    """Note l'avancement de la sonde en cours : "queued" (attente côté client), "sent" (requête partie)"""
+    progress = _progress.get()
+    if progress is not None:
+        progress["phase"] = phase
+
+
+class UpstreamHealth:
+
+    """
+    Sondes de santé des services externes, exécutées en tâche de fond.
+
+    Toutes les `interval` secondes, chaque sonde (coroutine sans argument) est lancée avec
+    un délai max de `timeout` secondes. Le résultat est gardé en mémoire : /health/upstreams
+    et les routes ne font que lire ce statut, elles ne paient jamais l'appel de diagnostic.
+
+    Une sonde renvoie un dict de détails (éventuellement avec "status": "degraded"),
+    ou lève une exception ("down"). Une sonde None est marquée "disabled" (non configurée).
+
+    Une sonde encore en file d'attente côté client à l'expiration du délai (probe_phase("queued"),
+    ex : ordonnanceur Discogs saturé par un scan par lots) n'a rien appris du service : le
+    dernier statut est gardé et l'entrée porte "probe": "queued_timeout", pas "down".
+    """
+
+    def __init__(self, probes, interval=60, timeout=10):
+        self.probes = probes
+        self.interval = interval
+        self.timeout = timeout
+        self._status = {
+            name: {"status": "disabled" if probe is None else "unknown"}
+            for name, probe in probes.items()
+        }
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def aclose(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            await self.check_all()
+            await asyncio.sleep(self.interval)
+
+    async def check_all(self):
+        """Lance toutes les sondes en parallèle et met à jour le statut en cache"""
+        active = {name: probe for name, probe in self.probes.items() if probe is not None}
+        await asyncio.gather(*(self._check(name, probe) for name, probe in active.items()))
+
+    async def _check(self, name, probe):
+        previous = self._status.get(name, {})
+        start = time.perf_counter()
+        progress = {}
+        token = _progress.set(progress)
+
+        try:
+            details = await asyncio.wait_for(probe(), timeout=self.timeout) or {}
+            status = details.pop("status", "ok")
+            error = None
+        except asyncio.TimeoutError:
+            if progress.get("phase") == "queued":
+                self._queued_timeout(name, previous, time.perf_counter() - start)
+                return
+            details, status, error = {}, "down", f"pas de réponse en {self.timeout}s"
+        except Exception as e:
+            details, status, error = {}, "down", str(e)
+        finally:
+            _progress.reset(token)
+
+        now = time.time()
+        entry = {
+            "status": status,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            "checked_at": now,
+            "last_ok_at": now if status == "ok" else previous.get("last_ok_at"),
+            "consecutive_failures": 0 if status == "ok" else previous.get("consecutive_failures", 0) + 1,
+            **details,
+        }
+        if error:
+            entry["error"] = error
+            print(f"ATTENTION : sonde {name} en échec ({error})")
+
+        self._status[name] = entry
+
+    def _queued_timeout(self, name, previous, elapsed):
+        print(f"ATTENTION : sonde {name} restée en file d'attente {self.timeout}s : statut inchangé")
+        self._status[name] = {
+            **previous,
+            "status": previous.get("status", "unknown"),
+            "probe": "queued_timeout",
+            "error": f"délai dépassé en file d'attente ({self.timeout}s), requête non envoyée",
+            "latency_ms": round(elapsed * 1000, 1),
+            "checked_at": time.time(),
+        }
+
+    def status(self, name):
+        """Dernier statut connu d'un service ("ok", "degraded", "down", "unknown", "disabled")"""
+        return self._status.get(name, {}).get("status", "unknown")
+
+    def snapshot(self):
+        """Statut global + détail par service (lecture seule, aucun appel réseau)"""
+        statuses = {entry["status"] for entry in self._status.values()}
+        if "down" in statuses:
+            overall = "down"
+        elif "degraded" in statuses:
+            overall = "degraded"
+        elif "unknown" in statuses:
+            overall = "unknown"
+        else:
+            overall = "ok"
+        return {"status": overall, "interval_s": self.interval, "upstreams": dict(self._status)}
@@ -0,0 +1,312 @@
+import time
+
+import random
+
+import asyncio
+
+import threading
+
+import contextvars
+
+from contextlib import contextmanager, asynccontextmanager
+
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+
+
+# Codes réessayés : 429 (trop de requêtes, jamais traitée) quelle que soit la méthode,
+# erreurs serveur transitoires seulement pour les méthodes idempotentes
+THROTTLED = 429
+TRANSIENT_ERRORS = {500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+# Compteurs ouverts par count_requests dans le contexte courant (tâche asyncio ou thread)
+_counters = contextvars.ContextVar("upstream_request_counters", default=())
+
+
+@contextmanager
+def count_requests():
+    """
+    Compte les requêtes HTTP réellement émises dans le bloc, tous services confondus : counter["requests"].
+    Chaque réessai compte ; un appel regroupé sur une requête déjà en vol (DiscogsScheduler) ne compte pas.
+    """
+    counter = {"requests": 0}
+    token = _counters.set(_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _counters.reset(token)
+
+
+
+class UpstreamTransport:
+
+    """
+    Couche de transport HTTP partagée pour un service externe (discogs, spotify, supabase).
+
+    Fournit, pour ce service :
+      - `session()` : une requests.Session poolée (keep-alive) pour les clients synchrones
+        (fetcher discogs_client, spotipy et son gestionnaire de jetons)
+      - `async_transport(limits)` : un transport httpx pour les clients asynchrones
+        (AsyncKissaCore, client Supabase)
+
+    Les deux appliquent la même politique :
+      - au plus `max_concurrency` requêtes en vol vers le service (par mode, sync et async :
+        l'attente d'une place est comptée dans `wait_seconds`)
+      - réessais avec backoff exponentiel à gigue complète (uniforme entre 0 et
+        min(backoff_max, backoff_base × 2^tentative)), au plus `retries` fois
+      - en-tête Retry-After respecté (secondes ou date HTTP) ; au-delà de `max_retry_after`
+        secondes on rend la réponse plutôt que de bloquer la requête de l'utilisateur
+
+    `stats()` : compteurs de requêtes, réessais, 429, erreurs de connexion, requêtes en vol
+    et état des pools de connexions (ouvertes, réutilisées, inactives).
+    """
+
+    def __init__(self, name, max_concurrency=8, pool_size=10, retries=3, backoff_base=0.25,
+                 backoff_max=8.0, max_retry_after=30.0, timeout=15.0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.timeout = timeout
+
+        self.requests = 0
+        self.retried = 0
+        self.throttled = 0
+        self.connection_errors = 0
+        self.gave_up = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.wait_seconds = 0.0
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._async_slots = None
+        self._adapters = []
+        self._async_transports = []
+
+    # --- CLIENTS ---
+
+    def session(self):
+        """requests.Session poolée pour ce service (un adaptateur par session, pools partagés par hôte)"""
+        adapter = RetryingAdapter(self, pool_connections=4, pool_maxsize=self.pool_size)
+        self._adapters.append(adapter)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def async_transport(self, limits=None):
+        """Transport httpx (à créer dans la boucle d'événements qui l'utilisera)"""
+        limits = limits or httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+        transport = RetryingAsyncTransport(self, httpx.AsyncHTTPTransport(limits=limits))
+        self._async_transports.append(transport)
+        return transport
+
+    # --- POLITIQUE ---
+
+    def retry_delay(self, method, status_code, retry_after, attempt):
+        """Délai avant le réessai d'une réponse (secondes), ou None pour la rendre telle quelle"""
+        if status_code == THROTTLED:
+            with self._lock:
+                self.throttled += 1
+        elif not (status_code in TRANSIENT_ERRORS and method in IDEMPOTENT_METHODS):
+            return None
+
+        if attempt >= self.retries:
+            self._count("gave_up")
+            return None
+
+        wait = parse_retry_after(retry_after)
+        if wait is None:
+            return self.backoff(attempt)
+        if wait > self.max_retry_after:
+            self._count("gave_up")
+            return None
+        # Petite gigue en plus : les workers limités en même temps ne repartent pas ensemble
+        return wait + random.uniform(0, self.backoff_base)
+
+    def error_delay(self, method, attempt):
+        """Délai avant le réessai après une erreur de connexion, ou None pour la laisser remonter"""
+        self._count("connection_errors")
+        if method not in IDEMPOTENT_METHODS or attempt >= self.retries:
+            return None
+        return self.backoff(attempt)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    # --- PLACES (plafond de concurrence) ---
+
+    @contextmanager
+    def slot(self):
+        start = time.perf_counter()
+        with self._slots:
+            self._enter(time.perf_counter() - start)
+            try:
+                yield
+            finally:
+                self._leave()
+
+    @asynccontextmanager
+    async def async_slot(self):
+        start = time.perf_counter()
+        async with self._async_slots:
+            self._enter(time.perf_counter() - start)
+            try:
+                yield
+            finally:
+                self._leave()
+
+    def _enter(self, waited):
+        for counter in _counters.get():
+            counter["requests"] += 1
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.wait_seconds += waited
+
+    def _leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    # --- STATISTIQUES ---
+
+    def stats(self):
+        with self._lock:
+            counters = {
+                "max_concurrency": self.max_concurrency,
+                "requests": self.requests,
+                "retries": self.retried,
+                "throttled": self.throttled,
+                "connection_errors": self.connection_errors,
+                "gave_up": self.gave_up,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "wait_seconds": round(self.wait_seconds, 3),
+            }
+        counters["sync_pool"] = _sync_pool_stats(self._adapters)
+        counters["async_pool"] = _async_pool_stats(self._async_transports)
+        return counters
+
+
+class RetryingAdapter(HTTPAdapter):
+
+    """Adaptateur requests : plafond de concurrence et réessais de l'UpstreamTransport"""
+
+    def __init__(self, upstream, **kwargs):
+        self.upstream = upstream
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.upstream.timeout
+
+        attempt = 0
+        while True:
+            try:
+                with self.upstream.slot():
+                    response = super().send(request, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                delay = self.upstream.error_delay(request.method, attempt)
+                if delay is None:
+                    raise
+            else:
+                delay = self.upstream.retry_delay(
+                    request.method, response.status_code, response.headers.get("Retry-After"), attempt
+                )
+                if delay is None:
+                    return response
+                response.close()
+
+            self.upstream._count("retried")
+            time.sleep(delay)
+            attempt += 1
+
+
+class RetryingAsyncTransport(httpx.AsyncBaseTransport):
+
+    """Transport httpx : plafond de concurrence et réessais de l'UpstreamTransport, autour d'un pool keep-alive"""
+
+    def __init__(self, upstream, transport):
+        self.upstream = upstream
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        attempt = 0
+        while True:
+            try:
+                async with self.upstream.async_slot():
+                    response = await self.transport.handle_async_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError, httpx.ReadTimeout):
+                delay = self.upstream.error_delay(request.method, attempt)
+                if delay is None:
+                    raise
+            else:
+                delay = self.upstream.retry_delay(
+                    request.method, response.status_code, response.headers.get("Retry-After"), attempt
+                )
+                if delay is None:
+                    return response
+                await response.aclose()
+
+            self.upstream._count("retried")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def parse_retry_after(value):
+    """En-tête Retry-After -> secondes (None si absent ou illisible)"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _sync_pool_stats(adapters):
+    """Pools urllib3 : connexions ouvertes, requêtes servies (le reste a réutilisé une connexion), inactives"""
+    opened = served = idle = 0
+    for adapter in adapters:
+        for key in list(adapter.poolmanager.pools.keys()):
+            pool = adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            served += pool.num_requests
+            idle += sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+    return {"connections_opened": opened, "requests": served, "reused": max(served - opened, 0), "idle": idle}
+
+
+def _async_pool_stats(transports):
+    """Pools httpcore : connexions ouvertes et inactives (keep-alive)"""
+    connections = idle = 0
+    for transport in transports:
+        pool = getattr(transport.transport, "_pool", None)
+        for conn in list(getattr(pool, "connections", [])):
+            connections += 1
+            idle += conn.is_idle()
+    return {"connections": connections, "idle": idle}